@@ -0,0 +1,216 @@
+"""
+Binary deltas between stored files, rsync style.
+
+encode() describes a target file as COPY ranges of a base file plus
+LITERAL bytes: the base is cut into fixed-size blocks indexed by Adler-32
+and a strong hash, and the target is scanned with a rolling Adler-32 so a
+block is found again at any offset after an insertion or deletion. While
+consecutive blocks keep matching only the strong hash of the expected next
+block is checked, so the byte-by-byte scan runs over the changed regions
+only.
+
+A delta file is a header, the table of operations and the literal bytes.
+DeltaReader reconstructs the target from it lazily and supports seek(), so
+Range downloads and chains of deltas (a base that is itself a delta) read
+only what they need.
+"""
+import bisect
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+MAGIC = b'FMDELTA1'
+HEADER = struct.Struct('<8sQI')   # magic, target size, number of ops
+OP = struct.Struct('<BQQ')        # kind, offset (in base / in literals), length
+COPY, LITERAL = 0, 1
+
+ADLER_MOD = 65521
+
+
+def block_size_for(size):
+    """About sqrt(size), as a power of two between 2 KiB and 128 KiB."""
+    block = 2048
+    while block * block < size and block < 128 * 1024:
+        block *= 2
+    return block
+
+
+def _strong(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _index_base(path, block):
+    """({adler32: {strong hash: block number}}, [strong hash per block]) of the base's full blocks."""
+    index, strong = {}, []
+    with open(path, 'rb') as f:
+        for number, data in enumerate(iter(lambda: f.read(block), b'')):
+            if len(data) < block:
+                break
+            digest = _strong(data)
+            index.setdefault(zlib.adler32(data), {}).setdefault(digest, number)
+            strong.append(digest)
+    return index, strong
+
+
+def encode(base_path, target_path, tmp_dir, max_size=None):
+    """
+    Write a delta that rebuilds `target_path` from `base_path` to a temp
+    file in `tmp_dir` and return (path, size). Returns None, early, when
+    the delta would exceed `max_size` bytes (files too different to gain).
+    """
+    target_size = os.path.getsize(target_path)
+    block = block_size_for(target_size)
+    index, strong = _index_base(base_path, block)
+    if max_size is None:
+        max_size = target_size
+
+    ops = []
+    fd, literal_path = tempfile.mkstemp(dir=tmp_dir, suffix='.literal')
+    try:
+        with os.fdopen(fd, 'w+b') as literals:
+            literal_size = 0
+
+            def add(kind, offset, length):
+                last = ops[-1] if ops else None
+                if last and last[0] == kind and last[1] + last[2] == offset:
+                    ops[-1] = (kind, last[1], last[2] + length)
+                else:
+                    ops.append((kind, offset, length))
+
+            with open(target_path, 'rb') as f, (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if target_size else io.BytesIO()
+            ) as data:
+                view = memoryview(data) if target_size else memoryview(b'')
+                pos = literal_start = 0
+                expected = None     # block following the last match
+                a = b = None        # rolling Adler-32 halves of view[pos:pos + block]
+                window = None
+                try:
+                    while pos + block <= target_size:
+                        window = view[pos:pos + block]
+                        found = None
+                        if expected is not None and expected < len(strong) and _strong(window) == strong[expected]:
+                            found = expected
+                        else:
+                            if a is None:
+                                checksum = zlib.adler32(window)
+                                a, b = checksum & 0xffff, checksum >> 16
+                            candidates = index.get(a | (b << 16))
+                            if candidates:
+                                found = candidates.get(_strong(window))
+                        if found is None:
+                            # slide one byte: drop data[pos], take in data[pos + block]
+                            expected = None
+                            if pos + block < target_size:
+                                out, new = data[pos], data[pos + block]
+                                a = (a - out + new) % ADLER_MOD
+                                b = (b - block * out + a - 1) % ADLER_MOD
+                            pos += 1
+                            if literal_size + pos - literal_start + len(ops) * OP.size > max_size:
+                                return None
+                            continue
+                        if pos > literal_start:
+                            literals.write(view[literal_start:pos])
+                            add(LITERAL, literal_size, pos - literal_start)
+                            literal_size += pos - literal_start
+                        add(COPY, found * block, block)
+                        pos += block
+                        literal_start = pos
+                        expected, a, b = found + 1, None, None
+                    if target_size > literal_start:
+                        literals.write(view[literal_start:target_size])
+                        add(LITERAL, literal_size, target_size - literal_start)
+                        literal_size += target_size - literal_start
+                finally:
+                    # the mmap cannot close while slices of it are alive
+                    del window
+                    view.release()
+
+            size = HEADER.size + len(ops) * OP.size + literal_size
+            if size > max_size:
+                return None
+            fd, path = tempfile.mkstemp(dir=tmp_dir, suffix='.delta')
+            with os.fdopen(fd, 'wb') as out:
+                out.write(HEADER.pack(MAGIC, target_size, len(ops)))
+                for op in ops:
+                    out.write(OP.pack(*op))
+                literals.seek(0)
+                shutil.copyfileobj(literals, out)
+            return path, size
+    finally:
+        os.remove(literal_path)
+
+
+class DeltaReader(io.RawIOBase):
+    """
+    The target of a delta as a seekable binary file. `base` is the open
+    (seekable) base file and `delta` the open delta file; both are closed
+    with the reader. Only the operation table is held in memory.
+    """
+
+    def __init__(self, base, delta):
+        magic, self.size, count = HEADER.unpack(delta.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("not a delta file")
+        table = delta.read(count * OP.size)
+        self.ops = [OP.unpack_from(table, i * OP.size) for i in range(count)]
+        self.starts = []
+        offset = 0
+        for _, _, length in self.ops:
+            self.starts.append(offset)
+            offset += length
+        self.literals_at = HEADER.size + count * OP.size
+        self.base, self.delta = base, delta
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, buffer):
+        if self.pos >= self.size or not len(buffer):
+            return 0
+        i = bisect.bisect_right(self.starts, self.pos) - 1
+        kind, offset, length = self.ops[i]
+        skip = self.pos - self.starts[i]
+        wanted = min(len(buffer), length - skip)
+        if kind == COPY:
+            source, at = self.base, offset + skip
+        else:
+            source, at = self.delta, self.literals_at + offset + skip
+        source.seek(at)
+        data = source.read(wanted)
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.base.close()
+            self.delta.close()
+        super().close()
+
+
+def open_delta(base, delta, buffer_size=64 * 1024):
+    """Buffered file object over DeltaReader, so read(n) returns n bytes until EOF."""
+    return io.BufferedReader(DeltaReader(base, delta), buffer_size)
@@ -0,0 +1,218 @@
+"""
+Streaming file responses with HTTP Range and conditional request support,
+and streaming zip archives of many files.
+
+Bodies are produced by a generator that reads the stored file in bounded
+chunks, so a multi-GB download never sits in memory and a client can resume
+or seek with `Range: bytes=...`. Content stored gzipped can be sent as is to
+clients that accept it (Content-Encoding).
+"""
+import mimetypes
+import os
+import re
+import zipfile
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from .storage import CHUNK_SIZE
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def open_version(version):
+    """Binary file object with the bytes of a DocumentVersion."""
+    if version.blob_id:
+        return version.blob.open()
+    return version.file.storage.open(version.file.name, 'rb')
+
+
+def version_etag(version, content_encoding=None):
+    # Versions are immutable, so the content digest is a strong validator.
+    # Each content coding of it is a representation of its own.
+    if version.sha256:
+        tag = version.sha256
+    elif version.blob_id:
+        tag = version.blob.sha256
+    else:
+        tag = f"version-{version.pk}"
+    if content_encoding:
+        tag = f"{tag}-{content_encoding}"
+    return f'"{tag}"'
+
+
+def accepts_encoding(request, coding):
+    """Whether the request's Accept-Encoding allows `coding`, by name or `*`, with q > 0."""
+    wildcard = False
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if name not in (coding, '*'):
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name == coding:
+            return q > 0
+        wildcard = q > 0
+    return wildcard
+
+
+def parse_range(header, size):
+    """
+    Inclusive (start, end) for a single `bytes=` range. Returns None when the
+    header should be ignored (multiple or malformed ranges: the whole file is
+    sent) and raises ValueError when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("unsatisfiable range")
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("unsatisfiable range")
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    value = request.headers.get('If-Range')
+    if value is None:
+        return True
+    if value.startswith('"'):
+        return value == etag
+    return parse_http_date_safe(value) == int(last_modified.timestamp())
+
+
+def stream_file(file, start, length, chunk_size=CHUNK_SIZE):
+    """Yield `length` bytes of `file` from `start`, then close it."""
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = file.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def file_response(request, open_file, size, etag, last_modified, filename,
+                  content_type=None, as_attachment=False, content_encoding=None):
+    """
+    Build the response for a GET/HEAD of a stored file.
+
+    `open_file` is only called when a body is actually sent, so HEADs, 304s
+    and 416s never touch storage. With `content_encoding` the file holds the
+    content in that coding, `size` is its stored length, and Range is not
+    honoured (ranges refer to the decoded content).
+    """
+    last_modified_ts = int(last_modified.timestamp())
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+    if not_modified is not None:
+        not_modified.headers['ETag'] = etag
+        not_modified.headers['Last-Modified'] = http_date(last_modified_ts)
+        return not_modified
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and not content_encoding and _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f"bytes */{size}"
+            return response
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    length = end - start + 1 if size else 0
+    send_body = length and request.method != 'HEAD'
+    response = StreamingHttpResponse(
+        stream_file(open_file(), start, length) if send_body else iter(()),
+        status=206 if byte_range else 200,
+        content_type=content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+    )
+    response.headers['Content-Length'] = str(length)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified_ts)
+    response.headers['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    if byte_range:
+        response.headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    return response
+
+
+class _ZipOutput:
+    """
+    Write-only, unseekable sink for ZipFile. zipfile then streams entries
+    with data descriptors instead of seeking back to patch headers, and the
+    generator below hands each write on as soon as it is made.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(directories, files, chunk_size=CHUNK_SIZE):
+    """
+    Yield a zip archive piece by piece. `directories` are archive paths of
+    (possibly empty) folders; `files` is an iterable of (archive path,
+    modified datetime, size or None, open callable), consumed lazily so
+    the first bytes go out before the file list has been read. Memory use
+    is a chunk plus one small directory record per entry.
+    """
+    out = _ZipOutput()
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name in directories:
+            zf.writestr(zipfile.ZipInfo(f"{name}/"), b'')
+        yield out.drain()
+        for name, modified, size, open_file in files:
+            info = zipfile.ZipInfo(name, date_time=max(modified.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+            info.file_size = size or 0
+            with open_file() as src, zf.open(info, 'w', force_zip64=size is None) as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b''):
+                    dst.write(chunk)
+                    yield out.drain()
+            yield out.drain()
+    yield out.drain()
+
+
+def unique_archive_name(name, used):
+    """`name`, or `name (2).ext`, `name (3).ext`... if already in `used`."""
+    candidate = name
+    stem, ext = os.path.splitext(name)
+    n = 2
+    while candidate.lower() in used:
+        candidate = f"{stem} ({n}){ext}"
+        n += 1
+    used.add(candidate.lower())
+    return candidate
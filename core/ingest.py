@@ -0,0 +1,307 @@
+"""
+Bulk creation of folders, documents and their first versions.
+
+Used by the bulk upload endpoint and the import_tree command. Files are
+staged (hashed and written under MEDIA_ROOT/tmp) before any database work;
+the rows for a whole batch are then written with bulk_create and set-based
+updates in one transaction, so the number of queries grows with the depth
+of the tree, not with the number of files.
+"""
+import tarfile
+import zipfile
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from .models import (
+    Blob, Document, DocumentVersion, Folder, QuotaExceeded, UserQuota, add_folder_totals,
+    enqueue_version_processing,
+)
+from .permissions import ReadThrough, WriteThrough, copy_folder_access, invalidate_on_commit
+from .storage import stage_file
+
+BATCH_SIZE = 1000
+
+# `folders` is the tuple of directory names between the target folder and
+# the file, e.g. ('reports', '2024') for reports/2024/q1.pdf.
+IngestEntry = namedtuple('IngestEntry', 'folders name staged')
+IngestResult = namedtuple('IngestResult', 'folders_created documents_created skipped')
+
+
+class IngestError(Exception):
+    pass
+
+
+def _max_files():
+    return getattr(settings, 'BULK_UPLOAD_MAX_FILES', 10000)
+
+
+def _max_bytes():
+    return getattr(settings, 'BULK_UPLOAD_MAX_BYTES', 10 * 1024 ** 3)
+
+
+class _MeteredFile:
+    """
+    Read-only view of an archive member that counts the bytes read against
+    the upload's allowance and raises as soon as it is used up, so a small
+    archive that expands to a huge size stops filling MEDIA_ROOT/tmp early.
+    """
+
+    def __init__(self, file, allowance):
+        self.file = file
+        self.allowance = allowance
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.allowance.take(len(data))
+        return data
+
+
+class _Allowance:
+    def __init__(self, max_bytes, room):
+        self.max_bytes = max_bytes
+        self.room = room
+        self.used = 0
+
+    def take(self, size):
+        self.used += size
+        if self.room is not None and self.used > self.room:
+            raise QuotaExceeded("Storage quota exceeded.")
+        if self.used > self.max_bytes:
+            raise IngestError(f"At most {self.max_bytes} bytes per upload once extracted.")
+
+
+def _split_member(name):
+    """Directory parts and file name of an archive member, refusing escapes."""
+    if name.startswith(('/', '\\')):
+        raise IngestError(f"Absolute path in archive: {name!r}")
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts:
+        raise IngestError(f"Invalid path in archive: {name!r}")
+    if any(len(part) > 300 for part in parts):
+        raise IngestError(f"Name too long in archive: {name!r}")
+    return tuple(parts[:-1]), parts[-1]
+
+
+def _archive_members(archive):
+    """(name, binary file object) for every regular file in a zip or tar."""
+    if zipfile.is_zipfile(archive):
+        archive.seek(0)
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    with zf.open(info) as member:
+                        yield info.filename, member
+        return
+    archive.seek(0)
+    try:
+        tf = tarfile.open(fileobj=archive, mode='r:*')
+    except tarfile.TarError:
+        raise IngestError("Archive must be a zip or tar file.")
+    with tf:
+        for info in tf:
+            # links, devices etc. are skipped rather than followed
+            if info.isfile():
+                yield info.name, tf.extractfile(info)
+
+
+def stage_uploads(files):
+    """Stage uploaded files as entries directly in the target folder."""
+    entries = []
+    try:
+        for f in files:
+            if len(entries) >= _max_files():
+                raise IngestError(f"At most {_max_files()} files per upload.")
+            entries.append(IngestEntry((), f.name[:300], stage_file(f)))
+    except BaseException:
+        discard(entries)
+        raise
+    return entries
+
+
+def stage_archive(archive, user=None, staged_bytes=0):
+    """
+    Stage every file of a zip/tar archive, keeping its directory structure.
+    macOS resource-fork folders (__MACOSX) are ignored.
+
+    Extraction stops with IngestError once the files (plus `staged_bytes`
+    already staged for the same upload) exceed BULK_UPLOAD_MAX_BYTES, or
+    with QuotaExceeded once they no longer fit `user`'s quota; the files
+    staged so far are removed.
+    """
+    entries = []
+    allowance = _Allowance(_max_bytes(), UserQuota.objects.room(user.pk) if user is not None else None)
+    try:
+        allowance.take(staged_bytes)
+        for member_name, member in _archive_members(archive):
+            folders, name = _split_member(member_name)
+            if folders[:1] == ('__MACOSX',):
+                continue
+            if len(entries) >= _max_files():
+                raise IngestError(f"At most {_max_files()} files per upload.")
+            entries.append(IngestEntry(folders, name, stage_file(File(_MeteredFile(member, allowance), name=name))))
+    except (zipfile.BadZipFile, tarfile.TarError) as exc:
+        discard(entries)
+        raise IngestError(f"Corrupt archive: {exc}")
+    except BaseException:
+        discard(entries)
+        raise
+    return entries
+
+
+def discard(entries):
+    for entry in entries:
+        entry.staged.discard()
+
+
+def _ensure_folders(into, paths, user, create=True):
+    """
+    {directory tuple: Folder} for every prefix of `paths`, reusing folders
+    that already exist by name and creating the rest one tree level at a
+    time (the children's paths need their parents' ids). Also returns
+    {new folder id: id of the existing folder it inherits access from}.
+    With create=False nothing is written and missing folders (and all
+    below them) are simply absent from the result.
+    """
+    folders = {(): into}
+    # nearest pre-existing folder of each path, whose access new folders inherit
+    sources = {(): into.pk}
+    created = {}
+    wanted = {path[:i] for path in paths for i in range(1, len(path) + 1)}
+    for level in range(1, max((len(p) for p in wanted), default=0) + 1):
+        level_paths = sorted(p for p in wanted if len(p) == level and p[:-1] in folders)
+        parents = {folders[p[:-1]].pk for p in level_paths}
+        existing = {}
+        for folder in Folder.objects.filter(
+            parent_id__in=parents, name__in={p[-1] for p in level_paths}, trashed_at__isnull=True,
+        ).order_by('id'):
+            existing.setdefault((folder.parent_id, folder.name), folder)
+
+        new = {}
+        for path in level_paths:
+            parent = folders[path[:-1]]
+            folder = existing.get((parent.pk, path[-1]))
+            if folder is None:
+                if not create:
+                    continue
+                folder = Folder(
+                    name=path[-1], parent=parent, depth=parent.depth + 1,
+                    created_by=user, updated_by=user,
+                )
+                new[path] = folder
+                sources[path] = sources[path[:-1]]
+            else:
+                sources[path] = folder.pk
+            folders[path] = folder
+
+        # bulk_create skips Folder.save(), so paths are filled in here
+        Folder.objects.bulk_create(new.values(), batch_size=BATCH_SIZE)
+        for path, folder in new.items():
+            folder.path = f"{folder.parent.path}{folder.pk}/"
+            created[folder.pk] = sources[path]
+        Folder.objects.bulk_update(new.values(), ['path'], batch_size=BATCH_SIZE)
+    return folders, created
+
+
+def existing_documents(into, items):
+    """
+    The (folders, name) pairs of `items` that already exist as documents
+    below `into`, without creating anything. Lets an import skip files
+    before paying to copy them.
+    """
+    folders, _ = _ensure_folders(into, {item[0] for item in items}, None, create=False)
+    found = set(
+        Document.objects.filter(folder__in=[f.pk for f in folders.values()], trashed_at__isnull=True)
+        .values_list('folder_id', 'name')
+    )
+    return {
+        (path, name) for path, name in items
+        if path in folders and (folders[path].pk, name) in found
+    }
+
+
+def ingest(into, entries, user=None, skip_existing=False, read_ids=(), write_ids=()):
+    """
+    Create one document (with version 1.0) per entry below folder `into`,
+    creating intermediate folders as needed. With skip_existing, entries
+    whose folder already holds a document of that name are left out, which
+    makes re-running an interrupted import safe.
+
+    Staged files of created documents are moved into the blob store; the
+    caller discards the entries afterwards either way. Raises QuotaExceeded
+    (and creates nothing) when `user` has no room for the batch.
+    """
+    with transaction.atomic():
+        folders, created_folders = _ensure_folders(into, {e.folders for e in entries}, user)
+
+        kept, skipped = [], 0
+        if skip_existing:
+            seen = set(
+                Document.objects.filter(folder__in=[f.pk for f in folders.values()], trashed_at__isnull=True)
+                .values_list('folder_id', 'name')
+            )
+            for entry in entries:
+                key = (folders[entry.folders].pk, entry.name)
+                if key in seen:
+                    skipped += 1
+                else:
+                    seen.add(key)
+                    kept.append(entry)
+        else:
+            kept = list(entries)
+
+        documents = Document.objects.bulk_create(
+            [
+                Document(
+                    name=entry.name, folder=folders[entry.folders],
+                    created_by=user, updated_by=user, version_count=1,
+                )
+                for entry in kept
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        if user is not None:
+            UserQuota.objects.charge(user.pk, sum(entry.staged.size for entry in kept))
+        deltas = {}
+        for entry in kept:
+            for pk in folders[entry.folders].path.strip('/').split('/'):
+                size, count = deltas.get(int(pk), (0, 0))
+                deltas[int(pk)] = (size + entry.staged.size, count + 1)
+        add_folder_totals(deltas)
+
+        # sniffed before claim_many() moves the staged files away
+        content_types = [entry.staged.content_type for entry in kept]
+        blobs = Blob.objects.claim_many([entry.staged for entry in kept])
+        versions = DocumentVersion.objects.bulk_create(
+            [
+                DocumentVersion(
+                    document=document, blob=blobs[entry.staged.sha256],
+                    file=blobs[entry.staged.sha256].file.name,
+                    major=1, minor=0, size=entry.staged.size, content_type=content_type,
+                    sha256=entry.staged.sha256, uploaded_by=user,
+                )
+                for document, entry, content_type in zip(documents, kept, content_types)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        enqueue_version_processing([version.pk for version in versions])
+        document_ids = [document.pk for document in documents]
+        latest = DocumentVersion.objects.filter(document=OuterRef('pk')).values('pk')[:1]
+        for i in range(0, len(document_ids), BATCH_SIZE):
+            Document.objects.filter(pk__in=document_ids[i:i + BATCH_SIZE]).update(
+                current_version=Subquery(latest),
+            )
+
+        for through, user_ids in ((ReadThrough, read_ids), (WriteThrough, write_ids)):
+            through.objects.bulk_create(
+                [through(document_id=pk, user_id=uid) for pk in document_ids for uid in set(user_ids)],
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+        copy_folder_access(created_folders)
+
+    invalidate_on_commit({*read_ids, *write_ids, *([user.pk] if user else [])})
+    return IngestResult(len(created_folders), len(documents), skipped)
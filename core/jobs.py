@@ -0,0 +1,111 @@
+"""
+Handlers for background jobs (core.models.Job).
+
+Work queued with Job.objects.enqueue() is picked up by `manage.py run_jobs`,
+which calls run_job(). A handler receives the job's payload as keyword
+arguments; raising marks the attempt failed and it is retried with
+exponential backoff until JOB_MAX_ATTEMPTS. Handlers may run more than once
+for the same job (a worker can die after the work but before recording it),
+so they must be idempotent.
+"""
+import hashlib
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import retention
+from .models import Blob, DocumentVersion, Folder, Job, delta_encode_version
+from .storage import CHUNK_SIZE
+
+HANDLERS = {}
+
+
+class JobError(Exception):
+    pass
+
+
+def handler(kind):
+    """Register the decorated function as the handler for jobs of `kind`."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def run_job(job):
+    """Run one claimed job and record the outcome. Returns True on success."""
+    try:
+        func = HANDLERS.get(job.kind)
+        if func is None:
+            raise JobError(f"No handler for job kind {job.kind!r}")
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+        if job.attempts >= max_attempts:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.FAILED, last_error=error, finished_at=timezone.now(), locked_at=None,
+            )
+        else:
+            delay = getattr(settings, 'JOB_RETRY_DELAY', timedelta(seconds=30)) * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.PENDING, last_error=error, run_after=timezone.now() + delay, locked_at=None,
+            )
+        return False
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.DONE, last_error='', finished_at=timezone.now(), locked_at=None,
+    )
+    return True
+
+
+# -------------------- Document versions --------------------
+
+@handler('process_version')
+def process_version(version):
+    """
+    Post-upload pipeline for a new DocumentVersion. Runs outside the
+    request, so it may read the whole file.
+    """
+    version = DocumentVersion.objects.select_related('blob').filter(pk=version).first()
+    if version is None:
+        return  # deleted before we got to it
+    verify_checksum(version)
+    retention.compact_documents([version.document_id])
+    previous = (
+        DocumentVersion.objects.filter(document_id=version.document_id)
+        .filter(Q(major__lt=version.major) | Q(major=version.major, minor__lt=version.minor))
+        .first()
+    )
+    if previous is not None:
+        delta_encode_version(previous, version)
+    # after the delta above: a blob that became its base stays plain
+    if version.blob_id and getattr(settings, 'BLOB_COMPRESSION', False):
+        Blob.objects.compress(version.blob_id)
+
+
+def verify_checksum(version):
+    """Check the stored bytes still match the digest they were filed under."""
+    if version.blob is None:
+        return
+    digest, size = hashlib.sha256(), 0
+    with version.blob.open() as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    if digest.hexdigest() != version.blob.sha256 or size != version.blob.size:
+        raise JobError(f"Stored file {version.blob.file.name} does not match its checksum")
+
+
+# -------------------- Retention --------------------
+
+@handler('apply_retention')
+def apply_retention(folder):
+    """Compact the subtree of a folder whose retention policy was saved."""
+    folder = Folder.objects.filter(pk=folder).first()
+    if folder is None:
+        return
+    for _ in retention.compact(folder):
+        pass
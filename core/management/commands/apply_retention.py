@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import retention
+from core.models import Folder
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete old versions that the folders' retention policies no longer "
+        "keep, in batches of short transactions. New uploads are compacted "
+        "as they arrive; this catches up after a policy is added or changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folder', type=int, help="only the subtree of this folder")
+        parser.add_argument('--batch-size', type=int, default=retention.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        folder = None
+        if options['folder'] is not None:
+            folder = Folder.objects.filter(pk=options['folder']).first()
+            if folder is None:
+                raise CommandError(f"Folder {options['folder']} does not exist")
+
+        started = time.monotonic()
+        removed = 0
+        for count in retention.compact(folder, batch_size=options['batch_size']):
+            removed += count
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {removed} old versions in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,116 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import Folder
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a throwaway folder tree (default 100k folders, 25 levels deep) "
+        "and time ancestor, descendant and move queries on the materialized "
+        "path against walking the parent links one level per query. "
+        "Everything is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folders', type=int, default=100_000)
+        parser.add_argument('--depth', type=int, default=25)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['depth'] < 2 or options['folders'] < options['depth']:
+            raise CommandError("need --depth >= 2 and at least one folder per level")
+        with transaction.atomic():
+            levels = self.build(options['folders'], options['depth'])
+            deepest = Folder.objects.get(pk=levels[-1][0])
+            top = Folder.objects.get(pk=levels[1][0])
+            middle = Folder.objects.get(pk=levels[len(levels) // 2][0])
+            repeat = options['repeat']
+
+            self.report("ancestors of the deepest folder", repeat,
+                        lambda: list(deepest.get_ancestors()),
+                        lambda: self.walk_up(deepest))
+            for label, folder in (("a top-level", top), ("a mid-level", middle)):
+                self.report(f"descendants of {label} folder", repeat,
+                            lambda: list(folder.get_descendants().values_list('pk', flat=True)),
+                            lambda: self.walk_down(folder))
+
+            # back and forth between two folders of the level above
+            targets = [Folder.objects.get(pk=pk) for pk in levels[len(levels) // 2 - 1][-2:]]
+            timings = []
+            for i in range(repeat):
+                middle.parent = targets[i % 2]
+                started = time.perf_counter()
+                middle.save()
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f"move a subtree of {middle.get_descendants().count()} folders: "
+                f"{statistics.median(timings) * 1000:.1f} ms (path rewrite, one UPDATE)"
+            )
+            transaction.set_rollback(True)
+
+    def build(self, count, depth):
+        """
+        One root, then `depth` levels growing by a constant factor, so every
+        folder has about as many children as any other on its level.
+        Returns the ids per level.
+        """
+        started = time.monotonic()
+        root = Folder.objects.create(name='benchmark')
+        levels = [[root.pk]]
+        paths = {root.pk: root.path}
+        growth = (count - 1) ** (1 / depth)
+        weights = [growth ** level for level in range(1, depth + 1)]
+        for level, weight in enumerate(weights, start=1):
+            parents = levels[-1]
+            size = max(len(parents), int((count - 1) * weight / sum(weights)))
+            folders = Folder.objects.bulk_create(
+                [
+                    Folder(name=f'{level}-{i}', parent_id=parents[i * len(parents) // size], depth=level)
+                    for i in range(size)
+                ],
+                batch_size=1000,
+            )
+            # bulk_create skips Folder.save(), so paths are filled in here
+            for folder in folders:
+                folder.path = paths[folder.parent_id] + f'{folder.pk}/'
+                paths[folder.pk] = folder.path
+            Folder.objects.bulk_update(folders, ['path'], batch_size=1000)
+            levels.append([folder.pk for folder in folders])
+        self.stdout.write(
+            f"Built {len(paths)} folders, {depth} levels below the root, in {time.monotonic() - started:.1f}s"
+        )
+        return levels
+
+    def walk_up(self, folder):
+        ancestors = []
+        while folder.parent_id:
+            folder = Folder.objects.get(pk=folder.parent_id)
+            ancestors.append(folder)
+        return ancestors
+
+    def walk_down(self, folder):
+        found, level = [], [folder.pk]
+        while level:
+            level = list(Folder.objects.filter(parent_id__in=level).values_list('pk', flat=True))
+            found.extend(level)
+        return found
+
+    def report(self, label, repeat, by_path, by_parent):
+        results = []
+        for query in (by_path, by_parent):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rows = query()
+                timings.append(time.perf_counter() - started)
+            results.append((statistics.median(timings) * 1000, len(rows)))
+        (path_ms, path_rows), (parent_ms, parent_rows) = results
+        if path_rows != parent_rows:
+            raise CommandError(f"{label}: path found {path_rows} folders, parent links {parent_rows}")
+        self.stdout.write(
+            f"{label} ({path_rows} folders): path {path_ms:.1f} ms, parent links {parent_ms:.1f} ms"
+        )
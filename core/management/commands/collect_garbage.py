@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.orphans import find_orphans, remove_orphan
+
+
+class Command(BaseCommand):
+    help = (
+        "Find files under MEDIA_ROOT that no blob, version or upload session "
+        "refers to, streaming the directory tree against the database in "
+        "batches. Reports them, or removes them with --delete. Files touched "
+        "within the grace period are left alone, so it is safe to run while "
+        "uploads are in progress."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help="remove the orphans instead of listing them")
+        parser.add_argument('--grace-hours', type=float, default=24)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        grace = timedelta(hours=options['grace_hours'])
+        started = time.monotonic()
+        found = removed = size = 0
+        for orphan in find_orphans(grace, batch_size=options['batch_size']):
+            found += 1
+            if not options['delete']:
+                self.stdout.write(f"{orphan.name}\t{orphan.size}")
+                size += orphan.size
+            elif remove_orphan(orphan.name, grace):
+                removed += 1
+                size += orphan.size
+
+        elapsed = time.monotonic() - started
+        if options['delete']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Removed {removed} of {found} orphaned files ({size} bytes) in {elapsed:.1f}s"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Found {found} orphaned files ({size} bytes) in {elapsed:.1f}s; re-run with --delete to remove them"
+            ))
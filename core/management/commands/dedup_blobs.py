@@ -0,0 +1,85 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from core.models import Blob, DocumentVersion
+from core.storage import blob_name, hash_path, link
+
+
+class Command(BaseCommand):
+    help = (
+        "Move DocumentVersion files uploaded before the blob store into it: "
+        "hash them in parallel and point versions with identical bytes at "
+        "one shared Blob. Safe to run while the site is up and to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        last_id = 0
+        adopted = shared = missing = saved_bytes = 0
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                batch = list(
+                    DocumentVersion.objects.filter(blob__isnull=True, id__gt=last_id)
+                    .order_by('id').only('id', 'file')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                # hashing is the slow part; database updates stay sequential
+                for version, result in zip(batch, pool.map(self.hash_version, batch)):
+                    if result is None:
+                        missing += 1
+                        self.stderr.write(f"version {version.id}: file {version.file.name!r} is missing")
+                        continue
+                    sha256, size = result
+                    outcome = self.adopt(version, sha256, size)
+                    if outcome == 'new':
+                        adopted += 1
+                    elif outcome == 'shared':
+                        adopted += 1
+                        shared += 1
+                        saved_bytes += size
+                self.stdout.write(f"... up to version {last_id}: {adopted} adopted, {shared} deduplicated")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Adopted {adopted} versions ({shared} duplicates, {saved_bytes} bytes freed, "
+            f"{missing} missing files) in {elapsed:.1f}s"
+        ))
+
+    def hash_version(self, version):
+        path = default_storage.path(version.file.name)
+        if not os.path.exists(path):
+            return None
+        return hash_path(path)
+
+    def adopt(self, version, sha256, size):
+        old_name = version.file.name
+        with transaction.atomic():
+            blob, created = Blob.objects.select_for_update().get_or_create(
+                sha256=sha256, defaults={'file': blob_name(sha256), 'size': size},
+            )
+            updated = DocumentVersion.objects.filter(pk=version.pk, blob__isnull=True).update(
+                blob=blob, file=blob.file.name,
+            )
+            if not updated:
+                transaction.set_rollback(True)
+                return None
+            if created or not default_storage.exists(blob.file.name):
+                Blob.objects.store_whole(blob, default_storage.path(old_name), put=link)
+            Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+            # readers holding the old URL keep working until the swap commits
+            transaction.on_commit(lambda: default_storage.delete(old_name))
+        return 'new' if created else 'shared'
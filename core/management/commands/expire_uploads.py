@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete resumable upload sessions (and their part files) that have expired."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        removed = 0
+        while True:
+            ids = list(
+                UploadSession.objects.filter(expires_at__lt=timezone.now())
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            # the post_delete signal removes each session's part file
+            UploadSession.objects.filter(pk__in=ids).delete()
+            removed += len(ids)
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} expired upload sessions"))
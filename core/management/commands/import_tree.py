@@ -0,0 +1,119 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from core import ingest
+from core.models import Folder, QuotaExceeded
+from core.storage import TMP_DIR, stage_local
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a directory tree from local disk below an existing folder: "
+        "files are copied and hashed in a process pool and rows are created "
+        "in large batches. Files that already exist (same folder and name) "
+        "are skipped, so an interrupted import can simply be re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--into', type=int, required=True, help="id of the target folder")
+        parser.add_argument('--user', help="username recorded as creator of the imported rows")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        root = os.path.abspath(options['path'])
+        if not os.path.isdir(root):
+            raise CommandError(f"{root} is not a directory")
+        into = Folder.objects.filter(pk=options['into']).first()
+        if into is None:
+            raise CommandError(f"Folder {options['into']} does not exist")
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"User {options['user']!r} does not exist")
+
+        tmp_dir = default_storage.path(TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        self.started = time.monotonic()
+        self.totals = {'imported': 0, 'skipped': 0, 'failed': 0, 'folders': 0, 'bytes': 0}
+        batch = []
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            stage = partial(_stage, tmp_dir=tmp_dir)
+            for item in self.walk(root):
+                batch.append(item)
+                if len(batch) >= options['batch_size']:
+                    self.import_batch(into, batch, user, pool, stage)
+                    batch = []
+            if batch:
+                self.import_batch(into, batch, user, pool, stage)
+
+        t = self.totals
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {t['imported']} files ({t['bytes']} bytes) into {t['folders']} new folders, "
+            f"skipped {t['skipped']} existing, {t['failed']} failed, in {elapsed:.1f}s"
+        ))
+
+    def walk(self, root):
+        """((directory parts), name, absolute path) for every regular file."""
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, root)
+            parts = () if rel == '.' else tuple(rel.split(os.sep))
+            if any(len(part) > 300 for part in parts):
+                self.stderr.write(f"{dirpath}: name too long, skipped")
+                dirnames[:] = []
+                continue
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path) or not os.path.isfile(path) or len(name) > 300:
+                    self.stderr.write(f"{path}: not a regular file or name too long, skipped")
+                    self.totals['failed'] += 1
+                    continue
+                yield parts, name, path
+
+    def import_batch(self, into, batch, user, pool, stage):
+        existing = ingest.existing_documents(into, [(parts, name) for parts, name, _ in batch])
+        todo = [item for item in batch if item[:2] not in existing]
+        self.totals['skipped'] += len(batch) - len(todo)
+
+        entries = []
+        try:
+            for (parts, name, path), staged in zip(todo, pool.map(stage, [p for _, _, p in todo], chunksize=16)):
+                if staged is None:
+                    self.stderr.write(f"{path}: could not be read, skipped")
+                    self.totals['failed'] += 1
+                    continue
+                entries.append(ingest.IngestEntry(parts, name, staged))
+            result = ingest.ingest(into, entries, user=user, skip_existing=True)
+        except QuotaExceeded:
+            raise CommandError(f"Storage quota of {user} exceeded; imported files so far are kept")
+        finally:
+            ingest.discard(entries)
+
+        self.totals['imported'] += result.documents_created
+        self.totals['skipped'] += result.skipped
+        self.totals['folders'] += result.folders_created
+        self.totals['bytes'] += sum(entry.staged.size for entry in entries)
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        self.stdout.write(
+            f"... {self.totals['imported']} imported, {self.totals['skipped']} skipped: "
+            f"{self.totals['imported'] / elapsed:.0f} files/s, "
+            f"{self.totals['bytes'] / elapsed / 1024 / 1024:.1f} MiB/s"
+        )
+
+
+def _stage(path, tmp_dir):
+    try:
+        return stage_local(path, tmp_dir)
+    except OSError:
+        return None
@@ -0,0 +1,29 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Job
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete background jobs that finished successfully more than "
+        "JOB_RETENTION ago (or --older-than-days), in batches. Failed jobs "
+        "are kept. Run it periodically; run_jobs also prunes on startup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=float, help="override JOB_RETENTION")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        before = None
+        if options['older_than_days'] is not None:
+            before = timezone.now() - timedelta(days=options['older_than_days'])
+        started = time.monotonic()
+        deleted = Job.objects.prune(before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} finished jobs in {time.monotonic() - started:.1f}s"
+        ))
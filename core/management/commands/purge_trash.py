@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import trash
+
+
+class Command(BaseCommand):
+    help = (
+        "Permanently remove folders and documents that have been in the trash "
+        "longer than TRASH_RETENTION, with their versions and stored files, in "
+        "batches of short transactions. Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=trash.BATCH_SIZE)
+        parser.add_argument(
+            '--older-than-days', type=float,
+            help="purge what was trashed this many days ago instead of TRASH_RETENTION",
+        )
+
+    def handle(self, *args, **options):
+        retention = trash.trash_retention()
+        if options['older_than_days'] is not None:
+            retention = timedelta(days=options['older_than_days'])
+
+        started = time.monotonic()
+        removed = {'documents': 0, 'folders': 0}
+        for kind, count in trash.purge(timezone.now() - retention, batch_size=options['batch_size']):
+            removed[kind] += count
+            self.stdout.write(f"... {removed['documents']} documents, {removed['folders']} folders")
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {removed['documents']} documents and {removed['folders']} folders "
+            f"in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import recompute_storage_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every folder's size/document totals and every user's quota "
+        "usage from the stored versions. Only needed after rows were changed "
+        "outside the models; scans the whole tree."
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with transaction.atomic():
+            recompute_storage_totals()
+        self.stdout.write(self.style.SUCCESS(f"Recomputed storage totals in {time.monotonic() - started:.1f}s"))
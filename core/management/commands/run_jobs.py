@@ -0,0 +1,84 @@
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from core.jobs import run_job
+from core.models import Job
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs with a pool of worker threads. Runs until "
+        "interrupted, or until the queue is empty with --once."
+    )
+    stopping = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help="exit when no job is due")
+        parser.add_argument('--stats', action='store_true', help="print queue depth as JSON and exit")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(Job.objects.stats(), indent=2))
+            return
+
+        requeued = Job.objects.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale jobs")
+        pruned = Job.objects.prune()
+        if pruned:
+            self.stdout.write(f"Deleted {pruned} finished jobs")
+
+        self.done = self.failed = 0
+        self.lock = threading.Lock()
+        started = time.monotonic()
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = [
+                pool.submit(self.work, f"{name}:{i}", options['poll_interval'], options['once'])
+                for i in range(options['workers'])
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except KeyboardInterrupt:
+                self.stopping = True
+                self.stdout.write("Stopping after the running jobs finish...")
+            except BaseException:
+                # a worker died (or SystemExit): leaving the pool waits for
+                # the other workers, which would otherwise poll forever
+                self.stopping = True
+                raise
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {self.done + self.failed} jobs ({self.failed} failed) in {time.monotonic() - started:.1f}s"
+        ))
+
+    def work(self, worker, poll_interval, once):
+        try:
+            while not self.stopping:
+                close_old_connections()
+                job = Job.objects.claim(worker)
+                if job is None:
+                    if once:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+                ok = run_job(job)
+                with self.lock:
+                    if ok:
+                        self.done += 1
+                    else:
+                        self.failed += 1
+                        self.stderr.write(f"{job} failed (attempt {job.attempts})")
+        finally:
+            # each thread has its own connection
+            connection.close()
@@ -0,0 +1,63 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Blob, DocumentVersion
+from core.storage import blob_name, link
+
+
+class Command(BaseCommand):
+    help = (
+        "Move blobs stored under the old flat layout (blobs/<sha256>) to the "
+        "sharded one (blobs/ab/cd/<sha256>). Each file is hard-linked to its "
+        "new name, the rows are switched in a short transaction and the old "
+        "name is removed after commit, so downloads keep working throughout. "
+        "Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        last_id = 0
+        moved = missing = 0
+        while True:
+            batch = list(
+                Blob.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'sha256', 'file')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            for pk, sha256, name in batch:
+                if name.startswith(blob_name(sha256)):
+                    continue  # already sharded (deltas are only ever stored sharded)
+                if not default_storage.exists(name):
+                    missing += 1
+                    self.stderr.write(f"blob {sha256}: file {name!r} is missing")
+                    continue
+                if self.move(pk, blob_name(sha256)):
+                    moved += 1
+            elapsed = max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"... up to blob {last_id}: {moved} moved ({moved / elapsed:.0f}/s)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} blobs ({missing} missing files) in {time.monotonic() - started:.1f}s"
+        ))
+
+    def move(self, pk, new_name):
+        with transaction.atomic():
+            # claim() and release() lock the same row, so the file cannot be
+            # re-placed or deleted under us
+            blob = Blob.objects.select_for_update().filter(pk=pk).first()
+            if blob is None or blob.file.name.startswith(new_name):
+                return False
+            old_name = blob.file.name
+            link(default_storage.path(old_name), new_name)
+            Blob.objects.filter(pk=pk).update(file=new_name)
+            DocumentVersion.objects.filter(blob_id=pk).update(file=new_name)
+            transaction.on_commit(lambda: default_storage.delete(old_name))
+        return True
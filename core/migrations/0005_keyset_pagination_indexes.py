@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_rename_write_permissions_document_write_permissions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['updated_at', 'id'], name='document_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', 'updated_at', 'id'], name='folder_parent_updated_idx'),
+        ),
+    ]
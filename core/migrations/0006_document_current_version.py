@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_current_version(apps, schema_editor):
+    Document = apps.get_model('core', 'Document')
+    DocumentVersion = apps.get_model('core', 'DocumentVersion')
+
+    versions = DocumentVersion.objects.filter(document=OuterRef('pk'))
+    latest = versions.order_by('-uploaded_at', '-id').values('pk')[:1]
+    count = versions.order_by().values('document').annotate(n=Count('pk')).values('n')
+    Document.objects.update(
+        current_version=Subquery(latest),
+        version_count=Coalesce(Subquery(count), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='current_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.documentversion'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='version_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_current_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def split_version_strings(apps, schema_editor):
+    """
+    Parse the old '1.3' strings into integers. Versions created by racing
+    uploads may share a string; those keep their upload order and are moved
+    to the next free minor number so the unique constraint can be added.
+    """
+    DocumentVersion = apps.get_model('core', 'DocumentVersion')
+
+    batch = []
+    used = set()
+    current_document = None
+    versions = DocumentVersion.objects.order_by('document_id', 'uploaded_at', 'id')
+    for version in versions.only('id', 'document_id', 'version').iterator(chunk_size=2000):
+        if version.document_id != current_document:
+            current_document = version.document_id
+            used = set()
+        try:
+            major, minor = (int(part) for part in version.version.split('.', 1))
+        except (AttributeError, ValueError):
+            major, minor = 1, 0
+        while (major, minor) in used:
+            minor += 1
+        used.add((major, minor))
+        version.major, version.minor = major, minor
+        batch.append(version)
+        if len(batch) >= 2000:
+            DocumentVersion.objects.bulk_update(batch, ['major', 'minor'])
+            batch = []
+    if batch:
+        DocumentVersion.objects.bulk_update(batch, ['major', 'minor'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_document_current_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentversion',
+            name='major',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='minor',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(split_version_strings, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='documentversion',
+            name='version',
+        ),
+        migrations.AlterModelOptions(
+            name='documentversion',
+            options={'ordering': ['-major', '-minor']},
+        ),
+        migrations.AddConstraint(
+            model_name='documentversion',
+            constraint=models.UniqueConstraint(fields=('document', 'major', 'minor'), name='unique_document_version'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:27
+
+from django.db import migrations, models
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat
+
+
+def backfill_paths(apps, schema_editor):
+    """
+    Fill path/depth one tree level per UPDATE: roots first, then every
+    folder whose parent already has a path.
+    """
+    Folder = apps.get_model('core', 'Folder')
+
+    Folder.objects.filter(parent__isnull=True).update(
+        path=Concat(Value('/'), Cast('id', CharField()), Value('/')),
+        depth=0,
+    )
+    parent = Folder.objects.filter(pk=OuterRef('parent_id'))
+    while True:
+        updated = Folder.objects.filter(path='', parent__path__gt='').update(
+            path=Concat(
+                Subquery(parent.values('path')[:1]), Cast('id', CharField()), Value('/'),
+                output_field=CharField(),
+            ),
+            depth=Subquery(parent.values('depth')[:1]) + 1,
+        )
+        if not updated:
+            break
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_documentversion_major_minor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=1024),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_folder_materialized_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['folder', 'name', 'id'], name='document_folder_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['folder', 'updated_at', 'id'], name='document_folder_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', 'name', 'id'], name='folder_parent_name_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentversion',
+            name='content_type',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Func, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Folder = apps.get_model('core', 'Folder')
+    Document = apps.get_model('core', 'Document')
+    DocumentVersion = apps.get_model('core', 'DocumentVersion')
+    UserQuota = apps.get_model('core', 'UserQuota')
+
+    versions = DocumentVersion.objects.filter(document__folder__path__startswith=OuterRef('path')).order_by()
+    documents = Document.objects.filter(folder__path__startswith=OuterRef('path')).order_by()
+    Folder.objects.update(
+        total_size=Coalesce(Subquery(
+            versions.annotate(total=Func('size', function='SUM')).values('total')
+        ), 0),
+        total_documents=Coalesce(Subquery(
+            documents.annotate(n=Func('pk', function='COUNT')).values('n')
+        ), 0),
+    )
+
+    limit = getattr(settings, 'USER_STORAGE_QUOTA', None)
+    uploaders = DocumentVersion.objects.filter(uploaded_by__isnull=False).values_list('uploaded_by', flat=True).distinct()
+    UserQuota.objects.bulk_create([UserQuota(user_id=pk, limit_bytes=limit) for pk in uploaders])
+    uploaded = DocumentVersion.objects.filter(uploaded_by=OuterRef('user_id')).order_by()
+    UserQuota.objects.update(used_bytes=Coalesce(Subquery(
+        uploaded.annotate(total=Func('size', function='SUM')).values('total')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0014_documentversion_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserQuota',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_quota', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('limit_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('used_bytes', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='total_documents',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='total_size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_retention_policies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='delta_base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='delta_dependents', to='core.blob'),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
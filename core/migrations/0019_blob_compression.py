@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_blob_deltas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_blob_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='writes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,5 +1,98 @@
-from django.db import models
+import gzip
+import hashlib
+import os
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Count, Exists, F, Func, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Concat, Substr
+from django.db.models.lookups import StartsWith
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from . import delta
+from .storage import (
+    CHUNK_SIZE, COMPRESSIBLE_RATIO, GZIP, TMP_DIR, StagedFile, blob_name, copy_to_temp, gzip_file, hash_path,
+    looks_compressible, place, stage_file,
+)
+
+def trashed_above(path_ref, before=None):
+    """
+    Trashed folders whose path is a prefix of the outer query's `path_ref`
+    (the folder itself or any ancestor), for use in Exists(). Trashing only
+    marks the top folder, so this is how everything below it is hidden.
+    """
+    trashed = Folder.objects.filter(trashed_at__isnull=False)
+    if before is not None:
+        trashed = trashed.filter(trashed_at__lt=before)
+    return trashed.filter(StartsWith(OuterRef(path_ref), F('path')))
+
+
+class FolderQuerySet(models.QuerySet):
+    def live(self):
+        """Folders that are neither in the trash nor below a trashed folder."""
+        return self.filter(~Exists(trashed_above('path')))
+
+    def with_child_counts(self):
+        """
+        Everything FolderSerializer needs in one query: users joined and
+        subfolder_count / document_count (direct children only, trash
+        excluded) annotated, so the child rows themselves are never loaded.
+        """
+        subfolders = (
+            Folder.objects.filter(parent=OuterRef('pk'), trashed_at__isnull=True)
+            .order_by().values('parent').annotate(n=Count('pk')).values('n')
+        )
+        documents = (
+            Document.objects.filter(folder=OuterRef('pk'), trashed_at__isnull=True)
+            .order_by().values('folder').annotate(n=Count('pk')).values('n')
+        )
+        return self.select_related('created_by', 'updated_by').annotate(
+            subfolder_count=Coalesce(Subquery(subfolders), 0),
+            document_count=Coalesce(Subquery(documents), 0),
+        )
+
+
+def _path_ids(path):
+    return [int(pk) for pk in path.strip('/').split('/')]
+
+
+def adjust_folder_totals(folder_ids, size=0, documents=0):
+    """Add to the recursive totals of the given folders in one UPDATE."""
+    if folder_ids and (size or documents):
+        Folder.objects.filter(pk__in=folder_ids).update(
+            total_size=F('total_size') + size,
+            total_documents=F('total_documents') + documents,
+        )
+
+
+def shift_folder_totals(old_ids, new_ids, size, documents):
+    """
+    Move `size` bytes / `documents` documents from one chain of folders to
+    another, leaving the ancestors both chains share untouched.
+    """
+    common = set(old_ids) & set(new_ids)
+    adjust_folder_totals([pk for pk in old_ids if pk not in common], -size, -documents)
+    adjust_folder_totals([pk for pk in new_ids if pk not in common], size, documents)
+
+
+def add_folder_totals(deltas, batch_size=1000):
+    """
+    adjust_folder_totals() for many folders with different amounts:
+    `deltas` maps folder id -> (size, documents). One UPDATE per batch.
+    """
+    folders = []
+    for pk, (size, documents) in deltas.items():
+        folder = Folder(pk=pk)
+        folder.total_size = F('total_size') + size
+        folder.total_documents = F('total_documents') + documents
+        folders.append(folder)
+    Folder.objects.bulk_update(folders, ['total_size', 'total_documents'], batch_size=batch_size)
+
 
 class Folder(models.Model):
     name = models.CharField(max_length=300)
@@ -11,9 +104,212 @@ class Folder(models.Model):
     created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='created_folders')
     updated_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='updated_folders')
 
+    # Materialized path of ancestor ids, e.g. '/1/5/23/' for folder 23 under 5
+    # under root 1. A subtree is one indexed prefix scan (path LIKE '/1/5/%')
+    # and the ancestors are read straight out of the string. Maintained by
+    # save(); renames never touch it because it holds ids, not names.
+    path = models.CharField(max_length=1024, db_index=True, editable=False, default='')
+    depth = models.PositiveIntegerField(default=0, editable=False)
+
+    # Recursive totals over the whole subtree: bytes of every stored version
+    # and number of documents. Kept current incrementally (see
+    # adjust_folder_totals) so reading them never walks the tree. Trashed
+    # content still occupies storage and is counted until it is purged.
+    total_size = models.BigIntegerField(default=0, editable=False)
+    total_documents = models.PositiveIntegerField(default=0, editable=False)
+
+    # Set on the top folder of a trashed subtree only; everything below is
+    # hidden by FolderQuerySet.live() and removed by `manage.py purge_trash`.
+    trashed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    trashed_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+', editable=False)
+
+    objects = FolderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination of root folders / children: (parent, updated_at, id)
+            models.Index(fields=['parent', 'updated_at', 'id'], name='folder_parent_updated_idx'),
+            models.Index(fields=['parent', 'name', 'id'], name='folder_parent_name_idx'),
+            # the few trashed folders, probed by live() for every row
+            models.Index(fields=['path'], condition=Q(trashed_at__isnull=False), name='folder_trashed_path_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    # maintained with set-based UPDATEs, never written from an instance
+    DERIVED_FIELDS = ('path', 'depth', 'total_size', 'total_documents', 'trashed_at', 'trashed_by')
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write path/depth from a possibly stale instance; only
+            # _sync_path() changes them, from the values in the database.
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.DERIVED_FIELDS
+            ]
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if update_fields is None or 'parent' in update_fields:
+                self._sync_path()
+
+    def _sync_path(self):
+        """
+        Recompute this folder's path from its parent's stored path and, when
+        the folder moved, rewrite the whole subtree in one UPDATE.
+        """
+        stored = {
+            row[0]: row[1:]
+            for row in Folder.objects.filter(pk__in=[self.pk, self.parent_id])
+            .values_list('pk', 'path', 'depth', 'total_size', 'total_documents')
+        }
+        old_path, old_depth, total_size, total_documents = stored[self.pk]
+        if self.parent_id:
+            parent_path, parent_depth = stored[self.parent_id][:2]
+            new_path, new_depth = f"{parent_path}{self.pk}/", parent_depth + 1
+        else:
+            new_path, new_depth = f"/{self.pk}/", 0
+
+        if new_path == old_path:
+            return
+        # inherited folder grants follow the tree shape
+        from .permissions import inherit_folder_access, rebuild_moved_folder_access
+        if old_path:
+            Folder.objects.filter(path__startswith=old_path).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (new_depth - old_depth),
+            )
+            self.path, self.depth = new_path, new_depth
+            shift_folder_totals(
+                _path_ids(old_path)[:-1], _path_ids(new_path)[:-1], total_size, total_documents,
+            )
+            rebuild_moved_folder_access(self)
+        else:
+            Folder.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+            self.path, self.depth = new_path, new_depth
+            inherit_folder_access(self)
+
+    def trash(self, user=None):
+        """Move the folder and everything below it to the trash: one UPDATE."""
+        self.trashed_at = timezone.now()
+        self.trashed_by = user
+        Folder.objects.filter(pk=self.pk).update(trashed_at=self.trashed_at, trashed_by=user)
+
+    def restore(self):
+        self.trashed_at = self.trashed_by = None
+        Folder.objects.filter(pk=self.pk).update(trashed_at=None, trashed_by=None)
+
+    def delete(self, *args, **kwargs):
+        """
+        Delete the subtree at once, taking its totals off the ancestors and
+        its versions off their uploaders' quota usage. The API trashes
+        instead; see core.trash for the batched purge.
+        """
+        with transaction.atomic():
+            path, total_size, total_documents = Folder.objects.values_list(
+                'path', 'total_size', 'total_documents',
+            ).get(pk=self.pk)
+            adjust_folder_totals(_path_ids(path)[:-1], -total_size, -total_documents)
+            UserQuota.objects.refund(
+                DocumentVersion.objects.filter(document__folder__path__startswith=path)
+            )
+            return super().delete(*args, **kwargs)
+
+    def ancestor_ids(self):
+        """Ids from the root down to (not including) this folder."""
+        return _path_ids(self.path)[:-1]
+
+    def get_ancestors(self):
+        return Folder.objects.filter(pk__in=self.ancestor_ids()).order_by('depth')
+
+    def get_descendants(self, include_self=False):
+        qs = Folder.objects.filter(path__startswith=self.path)
+        return qs if include_self else qs.exclude(pk=self.pk)
+
+    def is_ancestor_of(self, folder):
+        return folder.pk != self.pk and folder.path.startswith(self.path)
+
+
+class FolderGrant(models.Model):
+    """
+    Access to a folder for one user, inherited by everything below it.
+    Effective access is precomputed into FolderAccess (core.permissions).
+    """
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='grants')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folder_grants')
+    can_write = models.BooleanField(default=False)
+    granted_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['folder', 'user'], name='unique_folder_grant'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} -> {self.folder} ({'write' if self.can_write else 'read'})"
+
+
+class FolderAccess(models.Model):
+    """
+    Precomputed effective access of a user to a folder: one row for every
+    folder at or below a FolderGrant. Checking a document is then a lookup
+    on (document.folder, user) however deep the folder is nested.
+    """
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='+')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    can_write = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['folder', 'user'], name='unique_folder_access'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'folder'], name='folder_access_user_idx'),
+        ]
+
+
+class RetentionPolicy(models.Model):
+    """
+    Which old versions to keep for documents below a folder; the nearest
+    policy up the tree applies. A version survives if it is among the
+    newest `keep_versions` or younger than `keep_days` (either may be
+    unset); the current version is always kept. See core.retention.
+    """
+    folder = models.OneToOneField(Folder, on_delete=models.CASCADE, related_name='retention_policy')
+    keep_versions = models.PositiveIntegerField(null=True, blank=True)
+    keep_days = models.PositiveIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    updated_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+    def __str__(self):
+        return f"{self.folder}: keep {self.keep_versions or '-'} versions / {self.keep_days or '-'} days"
+
+    def keeps(self, rank, uploaded_at, now):
+        """Whether the version at `rank` (0 = newest) uploaded at `uploaded_at` is kept."""
+        if self.keep_versions is not None and rank < self.keep_versions:
+            return True
+        if self.keep_days is not None and uploaded_at > now - timedelta(days=self.keep_days):
+            return True
+        return False
+
+
+class DocumentQuerySet(models.QuerySet):
+    def live(self):
+        """Documents that are not in the trash, themselves or with a folder above them."""
+        return self.filter(trashed_at__isnull=True).filter(~Exists(trashed_above('folder__path')))
+
+    def with_latest_version(self):
+        """
+        Everything DocumentSerializer needs in a constant number of queries:
+        users and the current version are joined, permission lists prefetched.
+        """
+        return (
+            self.select_related('created_by', 'updated_by', 'current_version')
+            .prefetch_related('read_permissions', 'write_permissions')
+        )
+
 
 class Document(models.Model):
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='documents')
@@ -26,19 +322,836 @@ class Document(models.Model):
     read_permissions = models.ManyToManyField(User, related_name="documents_can_read", blank=True)
     write_permissions = models.ManyToManyField(User, related_name="documents_can_write", blank=True)
 
+    # Denormalized pointer to the newest version so reads are a single join
+    # instead of sorting DocumentVersion; maintained by add_version().
+    current_version = models.ForeignKey(
+        'DocumentVersion', null=True, blank=True, on_delete=models.SET_NULL, related_name='+'
+    )
+    version_count = models.PositiveIntegerField(default=0)
+
+    # set when the document itself was trashed (see Folder.trashed_at)
+    trashed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    trashed_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+', editable=False)
+
+    objects = DocumentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the document list: (updated_at, id)
+            models.Index(fields=['updated_at', 'id'], name='document_updated_idx'),
+            # keyset pagination of folder contents
+            models.Index(fields=['folder', 'name', 'id'], name='document_folder_name_idx'),
+            models.Index(fields=['folder', 'updated_at', 'id'], name='document_folder_updated_idx'),
+            models.Index(fields=['trashed_at'], condition=Q(trashed_at__isnull=False), name='document_trashed_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    # maintained with UPDATEs by add_version(), retention and trash(), never
+    # written from an instance
+    DERIVED_FIELDS = ('current_version', 'version_count', 'trashed_at', 'trashed_by')
+
+    def save(self, *args, **kwargs):
+        """Keep the folder totals current when a document is added or moved."""
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # a stale instance must not roll back a newer version or a trash
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.DERIVED_FIELDS
+            ]
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            if self._state.adding:
+                super().save(*args, **kwargs)
+                path = Folder.objects.values_list('path', flat=True).get(pk=self.folder_id)
+                adjust_folder_totals(_path_ids(path), documents=1)
+                return
+            old_folder_id = None
+            if update_fields is None or 'folder' in update_fields:
+                old_folder_id = Document.objects.values_list('folder_id', flat=True).get(pk=self.pk)
+            super().save(*args, **kwargs)
+            if old_folder_id is not None and old_folder_id != self.folder_id:
+                paths = dict(Folder.objects.filter(pk__in=[old_folder_id, self.folder_id]).values_list('pk', 'path'))
+                size = self.versions.aggregate(total=Sum('size'))['total'] or 0
+                shift_folder_totals(_path_ids(paths[old_folder_id]), _path_ids(paths[self.folder_id]), size, 1)
+
+    def trash(self, user=None):
+        self.trashed_at = timezone.now()
+        self.trashed_by = user
+        Document.objects.filter(pk=self.pk).update(trashed_at=self.trashed_at, trashed_by=user)
+
+    def restore(self):
+        self.trashed_at = self.trashed_by = None
+        Document.objects.filter(pk=self.pk).update(trashed_at=None, trashed_by=None)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            path = Folder.objects.values_list('path', flat=True).get(pk=self.folder_id)
+            size = self.versions.aggregate(total=Sum('size'))['total'] or 0
+            adjust_folder_totals(_path_ids(path), -size, -1)
+            UserQuota.objects.refund(self.versions.all())
+            return super().delete(*args, **kwargs)
+
+    def add_version(self, file, uploaded_by=None):
+        """
+        Store `file` as the next minor version (1.0 for the first upload)
+        and make it current.
+
+        The bytes are staged and hashed before the transaction so the row
+        lock on this document is only held for the number allocation, the
+        blob claim and the inserts. Uploads to different documents never
+        wait on each other; uploads to the same document queue on the lock
+        and always get distinct, increasing numbers.
+        """
+        staged = stage_file(file)
+        try:
+            return self.add_staged_version(staged, uploaded_by=uploaded_by)
+        finally:
+            staged.discard()
+
+    def add_staged_version(self, staged, uploaded_by=None):
+        """
+        add_version() for bytes already staged in MEDIA_ROOT (see
+        core.storage). The caller discards `staged` afterwards.
+        """
+        content_type = staged.content_type
+        with transaction.atomic():
+            locked = (
+                Document.objects.select_for_update(of=('self',))
+                .select_related('current_version', 'folder')
+                .get(pk=self.pk)
+            )
+            latest = locked.current_version
+            major, minor = (latest.major, latest.minor + 1) if latest else (1, 0)
+            if uploaded_by is not None:
+                UserQuota.objects.charge(uploaded_by.pk, staged.size)
+            adjust_folder_totals(_path_ids(locked.folder.path), size=staged.size)
+            blob = Blob.objects.claim(staged)
+            new_version = DocumentVersion.objects.create(
+                document=self,
+                blob=blob,
+                file=blob.file.name,
+                major=major,
+                minor=minor,
+                size=staged.size,
+                content_type=content_type,
+                sha256=staged.sha256,
+                uploaded_by=uploaded_by,
+            )
+            Document.objects.filter(pk=self.pk).update(
+                current_version=new_version,
+                version_count=F('version_count') + 1,
+            )
+            enqueue_version_processing([new_version.pk])
+        self.current_version = new_version
+        self.version_count = locked.version_count + 1
+        return new_version
+
+
+class BlobManager(models.Manager):
+    def claim(self, staged):
+        """
+        Return the Blob for staged content with one more reference, moving
+        the staged bytes into place only if this content is new. Must run in
+        the same transaction as the row that takes the reference.
+        """
+        blob, created = self.select_for_update().get_or_create(
+            sha256=staged.sha256,
+            defaults={'file': blob_name(staged.sha256), 'size': staged.size},
+        )
+        if created or blob.delta_base_id or not default_storage.exists(blob.file.name):
+            self.store_whole(blob, staged.path)
+        self.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        blob.ref_count += 1
+        return blob
+
+    def claim_many(self, staged_files, batch_size=1000):
+        """
+        claim() for many staged files at once, in a constant number of
+        queries per batch of distinct digests. Returns {sha256: Blob}.
+        """
+        refs = Counter(staged.sha256 for staged in staged_files)
+        sources = {staged.sha256: staged for staged in staged_files}
+        digests = list(refs)
+        blobs = {}
+        for i in range(0, len(digests), batch_size):
+            batch = digests[i:i + batch_size]
+            self.bulk_create(
+                [Blob(sha256=sha, file=blob_name(sha), size=sources[sha].size) for sha in batch],
+                ignore_conflicts=True,
+            )
+            blobs.update((blob.sha256, blob) for blob in self.select_for_update().filter(sha256__in=batch))
+
+        for sha, blob in blobs.items():
+            if blob.delta_base_id or not default_storage.exists(blob.file.name):
+                self.store_whole(blob, sources[sha].path)
+        by_count = {}
+        for sha, n in refs.items():
+            by_count.setdefault(n, []).append(sha)
+        for n, shas in by_count.items():
+            for i in range(0, len(shas), batch_size):
+                self.filter(sha256__in=shas[i:i + batch_size]).update(ref_count=F('ref_count') + n)
+        for sha, blob in blobs.items():
+            blob.ref_count += refs[sha]
+        return blobs
+
+    def store_whole(self, blob, path, put=place):
+        """
+        Put the bytes at local `path` under the blob's plain name (`put` is
+        place, which moves them, or link). Content stored as a delta (an
+        old version uploaded again) is kept whole from then on, so the new
+        version reads fast; its base may become collectable.
+        """
+        name = blob_name(blob.sha256)
+        put(path, name)
+        if blob.file.name == name:
+            return
+        old_name, old_base = blob.file.name, blob.delta_base_id
+        self.filter(pk=blob.pk).update(file=name, delta_base=None, encoding='', stored_size=None)
+        DocumentVersion.objects.filter(blob=blob).update(file=name)
+        blob.file.name, blob.delta_base_id, blob.encoding, blob.stored_size = name, None, '', None
+        if old_base:
+            self._collect([old_base])
+        transaction.on_commit(lambda: default_storage.delete(old_name))
+
+    def store_as_delta(self, pk, base_pk):
+        """
+        Re-store blob `pk` as a delta against blob `base_pk` when that saves
+        at least half its size. The delta is computed outside any
+        transaction; the switch happens under both rows' locks (claim,
+        release and shard_blobs take the same locks), checking that
+        neither blob changed meanwhile. The base must be stored plain, as
+        deltas read it by seeking. Returns the bytes saved.
+        """
+        blob, base = self.filter(pk=pk).first(), self.filter(pk=base_pk).first()
+        if blob is None or base is None or blob.delta_base_id or base.delta_base_id or base.encoding:
+            return 0
+        tmp_dir = default_storage.path(TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        if blob.encoding:
+            with blob.open() as f:
+                target = copy_to_temp(f, tmp_dir)
+        else:
+            target = default_storage.path(blob.file.name)
+        try:
+            encoded = delta.encode(default_storage.path(base.file.name), target, tmp_dir, max_size=blob.size // 2)
+        finally:
+            if blob.encoding:
+                os.remove(target)
+        if encoded is None:
+            return 0
+        path, size = encoded
+        name = f"{blob_name(blob.sha256)}.delta"
+        try:
+            with transaction.atomic():
+                locked = {b.pk: b for b in self.select_for_update().filter(pk__in=[pk, base_pk]).order_by('pk')}
+                if (
+                    len(locked) < 2
+                    or locked[pk].file.name != blob.file.name or locked[pk].delta_base_id
+                    or locked[base_pk].file.name != base.file.name or locked[base_pk].delta_base_id
+                ):
+                    return 0
+                place(path, name)
+                self.filter(pk=pk).update(file=name, delta_base=base_pk, encoding='', stored_size=size)
+                DocumentVersion.objects.filter(blob_id=pk).update(file=name)
+                old_name = blob.file.name
+                transaction.on_commit(lambda: default_storage.delete(old_name))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        return blob.size - size
+
+    def compress(self, pk):
+        """
+        Re-store blob `pk` gzipped when samples of it compress well (see
+        core.storage.looks_compressible) and the whole file then does too.
+        Compression runs outside any transaction and the switch under the
+        row lock, as in store_as_delta(). Delta bases stay plain. Returns
+        the bytes saved.
+        """
+        blob = self.filter(pk=pk).first()
+        if blob is None or blob.encoding or blob.delta_base_id or blob.delta_dependents.exists():
+            return 0
+        source = default_storage.path(blob.file.name)
+        if not looks_compressible(source, blob.size):
+            return 0
+        tmp_dir = default_storage.path(TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        path, size = gzip_file(source, tmp_dir)
+        name = f"{blob_name(blob.sha256)}.gz"
+        try:
+            if size >= blob.size * COMPRESSIBLE_RATIO:
+                return 0
+            with transaction.atomic():
+                locked = self.select_for_update().filter(pk=pk).first()
+                if (
+                    locked is None or locked.file.name != blob.file.name
+                    or Blob.objects.filter(delta_base=pk).exists()
+                ):
+                    return 0
+                place(path, name)
+                self.filter(pk=pk).update(file=name, encoding=GZIP, stored_size=size)
+                DocumentVersion.objects.filter(blob_id=pk).update(file=name)
+                old_name = blob.file.name
+                transaction.on_commit(lambda: default_storage.delete(old_name))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        return blob.size - size
+
+    def release(self, pk):
+        """
+        Drop one reference. The last one deletes the row, and the file once
+        the transaction commits (unless the same content was re-uploaded in
+        the meantime).
+        """
+        self.release_many({pk: 1})
+
+    def release_many(self, refs, batch_size=1000):
+        """release() for {blob id: references dropped}, grouped into few UPDATEs."""
+        by_count = {}
+        for pk, n in refs.items():
+            by_count.setdefault(n, []).append(pk)
+        with transaction.atomic():
+            for n, pks in by_count.items():
+                for i in range(0, len(pks), batch_size):
+                    self.filter(pk__in=pks[i:i + batch_size]).update(ref_count=F('ref_count') - n)
+            self._collect(list(refs), batch_size)
+
+    def _collect(self, pks, batch_size=1000):
+        """
+        Delete the blobs among `pks` that nothing references any more, then
+        the delta bases they kept alive, and their files after commit. A
+        blob without references stays while deltas are stored against it.
+        """
+        dead = []
+        while pks:
+            found = []
+            for i in range(0, len(pks), batch_size):
+                found += (
+                    self.select_for_update()
+                    .filter(pk__in=pks[i:i + batch_size], ref_count=0)
+                    .exclude(Exists(Blob.objects.filter(delta_base=OuterRef('pk'))))
+                    .values_list('pk', 'sha256', 'file', 'delta_base_id')
+                )
+            for i in range(0, len(found), batch_size):
+                self.filter(pk__in=[row[0] for row in found[i:i + batch_size]]).delete()
+            dead += [row[:3] for row in found]
+            pks = list({row[3] for row in found if row[3]})
+
+        def remove_files():
+            # unless the same content was uploaded again into the same name
+            revived = set(self.filter(sha256__in=[sha for _, sha, _ in dead]).values_list('file', flat=True))
+            for _, _, name in dead:
+                if name not in revived:
+                    default_storage.delete(name)
+        if dead:
+            transaction.on_commit(remove_files)
+
+
+class Blob(models.Model):
+    """
+    One stored file, addressed by the SHA-256 of its bytes and shared by
+    every DocumentVersion with identical content.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='blobs/')
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Older versions may be stored as a binary delta against the blob of the
+    # version after them (see core.delta and BLOB_DELTA_STORAGE); file then
+    # holds the delta and stored_size its length. A blob some delta is
+    # based on is kept, even without references, until that delta goes.
+    delta_base = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.PROTECT, related_name='delta_dependents',
+    )
+    stored_size = models.BigIntegerField(null=True, blank=True)
+    # 'gzip' when file holds the content gzipped (see BlobManager.compress);
+    # stored_size is then the compressed length.
+    encoding = models.CharField(max_length=16, blank=True, default='')
+
+    objects = BlobManager()
+
+    def __str__(self):
+        return self.sha256
+
+    def open(self):
+        """
+        The blob's bytes as a seekable binary file, whatever way they are
+        stored. (Seeking backwards in gzipped content decompresses again
+        from the start.)
+        """
+        if self.encoding == GZIP:
+            return gzip.open(default_storage.path(self.file.name), 'rb')
+        stored = default_storage.open(self.file.name, 'rb')
+        if self.delta_base_id:
+            return delta.open_delta(self.delta_base.open(), stored)
+        return stored
+
+    def open_stored(self):
+        """The stored file as it is on disk (see encoding)."""
+        return default_storage.open(self.file.name, 'rb')
+
 
 class DocumentVersion(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='versions')
+    # file holds the same storage name as blob.file; versions uploaded
+    # before the blob store existed have no blob until dedup_blobs runs.
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name='versions')
     file = models.FileField(upload_to='documents/')
-    version = models.CharField(max_length=10, default='1.0')
+    major = models.PositiveIntegerField(default=1)
+    minor = models.PositiveIntegerField(default=0)
+    # recorded at upload so listings and downloads never stat the file;
+    # null only for rows older than these fields (see backfill_version_metadata)
+    size = models.BigIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     uploaded_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='uploaded_versions')
 
     class Meta:
-        ordering = ['-uploaded_at']  # newest first
+        ordering = ['-major', '-minor']  # newest first
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'major', 'minor'], name='unique_document_version'),
+        ]
 
     def __str__(self):
         return f"{self.document.name} v{self.version}"
+
+    @property
+    def version(self):
+        return f"{self.major}.{self.minor}"
+
+
+def delta_encode_version(version, newer):
+    """
+    With BLOB_DELTA_STORAGE on, store `version` as a delta against `newer`,
+    the version after it. Versions whose minor number is a multiple of
+    BLOB_DELTA_KEYFRAME_INTERVAL stay whole, which bounds the chain a read
+    has to follow, and so does content that is any document's current
+    version. Returns the bytes saved.
+    """
+    if not getattr(settings, 'BLOB_DELTA_STORAGE', False):
+        return 0
+    if (
+        not version.blob_id or not newer.blob_id or version.blob_id == newer.blob_id
+        or version.minor % getattr(settings, 'BLOB_DELTA_KEYFRAME_INTERVAL', 10) == 0
+        or (version.size or 0) < getattr(settings, 'BLOB_DELTA_MIN_SIZE', 64 * 1024)
+        or Document.objects.filter(current_version__blob_id=version.blob_id).exists()
+    ):
+        return 0
+    return Blob.objects.store_as_delta(version.blob_id, newer.blob_id)
+
+
+def release_version_files(versions):
+    """
+    Call before deleting a DocumentVersion queryset in bulk: drops the blob
+    references in a few grouped UPDATEs (instead of one release per row in
+    the post_delete handler) and, after commit, removes files of versions
+    from before the blob store that nothing else uses.
+    """
+    refs, legacy = Counter(), set()
+    for blob_id, name in versions.values_list('blob_id', 'file'):
+        if blob_id:
+            refs[blob_id] += 1
+        else:
+            legacy.add(name)
+    versions.update(blob=None)
+    Blob.objects.release_many(refs)
+
+    def remove_files():
+        used = set(DocumentVersion.objects.filter(file__in=legacy).values_list('file', flat=True))
+        for name in legacy - used:
+            default_storage.delete(name)
+    if legacy:
+        transaction.on_commit(remove_files)
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload. Chunks are written by offset, in any order and in
+    parallel, into a sparse part file under MEDIA_ROOT/tmp/; finalize()
+    verifies it and turns it into a new Document or DocumentVersion.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    # exactly one of folder (new document called `name`) or document (new version)
+    folder = models.ForeignKey(Folder, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    document = models.ForeignKey(Document, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    name = models.CharField(max_length=300, blank=True)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)  # expected digest of the whole file, optional
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # bumped by every write_chunk(), so finalize() can tell whether any
+    # bytes changed while it was hashing
+    writes = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.id)
+
+    @property
+    def part_path(self):
+        return default_storage.path(f"{TMP_DIR}/sessions/{self.id}.part")
+
+    def create_part_file(self):
+        os.makedirs(os.path.dirname(self.part_path), exist_ok=True)
+        with open(self.part_path, 'wb') as f:
+            f.truncate(self.size)
+
+    def received_ranges(self):
+        """Merged [start, end) byte ranges received so far."""
+        ranges = []
+        for offset, length in self.chunks.order_by('offset').values_list('offset', 'length'):
+            if ranges and offset <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], offset + length)
+            else:
+                ranges.append([offset, offset + length])
+        return ranges
+
+    def _lock_for_writing(self):
+        """
+        Share-lock the session row for a chunk write and return whether the
+        session still exists. Chunk writers hold the lock together; the
+        FOR UPDATE in finalize() waits for them and blocks new ones. Other
+        databases take an exclusive lock (or none, without row locks).
+        """
+        if connection.vendor == 'postgresql':
+            table = connection.ops.quote_name(self._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT 1 FROM {table} WHERE id = %s FOR SHARE", [self.pk])
+                return cursor.fetchone() is not None
+        return UploadSession.objects.select_for_update().filter(pk=self.pk).exists()
+
+    def write_chunk(self, offset, stream, length, sha256=None):
+        """
+        Copy `length` bytes from `stream` into the part file at `offset` and
+        record the chunk. When `sha256` is given the chunk is only recorded
+        if the bytes match it. Raises UploadError on any mismatch, after
+        marking the overwritten region as missing.
+        """
+        if offset < 0 or length <= 0 or offset + length > self.size:
+            raise UploadError("Chunk lies outside the declared file size.")
+        with transaction.atomic():
+            if not self._lock_for_writing():
+                raise UploadError("Upload was already finalized.")
+            digest = hashlib.sha256()
+            written = 0
+            with open(self.part_path, 'r+b') as part:
+                part.seek(offset)
+                while written < length:
+                    data = stream.read(min(CHUNK_SIZE, length - written))
+                    if not data:
+                        break
+                    digest.update(data)
+                    part.write(data)
+                    written += len(data)
+            error = None
+            if written != length:
+                error = f"Expected {length} bytes, received {written}."
+            elif sha256 and digest.hexdigest() != sha256.lower():
+                error = "Chunk checksum mismatch."
+            if error:
+                # The bad bytes are already in the part file: forget every chunk
+                # they overlap so that region has to be sent again.
+                (
+                    self.chunks.filter(offset__lt=offset + length)
+                    .annotate(end=F('offset') + F('length')).filter(end__gt=offset)
+                    .delete()
+                )
+            else:
+                UploadChunk.objects.update_or_create(session=self, offset=offset, defaults={'length': length})
+            UploadSession.objects.filter(pk=self.pk).update(
+                expires_at=timezone.now() + upload_session_ttl(), writes=F('writes') + 1,
+            )
+        if error:
+            raise UploadError(error)
+
+    def finalize(self):
+        """
+        Check that every byte arrived and matches the expected digest, then
+        store the part file as a version (renamed into the blob store, not
+        copied) and delete the session. Returns the new DocumentVersion.
+
+        The part file is hashed before any transaction starts; only
+        publishing the version holds the session's row lock, which waits
+        for chunk writes in progress and keeps new ones out. It fails if a
+        chunk was written in the meantime or the target went to the trash.
+        """
+        writes = UploadSession.objects.filter(pk=self.pk).values_list('writes', flat=True).first()
+        if writes is None:
+            raise UploadError("Upload was already finalized.")
+        if self.size and self.received_ranges() != [[0, self.size]]:
+            raise UploadError("Upload is incomplete.")
+        try:
+            sha256, size = hash_path(self.part_path)
+        except FileNotFoundError:
+            raise UploadError("Upload was already finalized.")
+        if self.sha256 and sha256 != self.sha256.lower():
+            raise UploadError("File checksum mismatch.")
+
+        staged = StagedFile(self.part_path, sha256, size, self.name or self.document.name)
+        with transaction.atomic():
+            locked = UploadSession.objects.select_for_update().filter(pk=self.pk)
+            current = locked.values_list('writes', flat=True).first()
+            if current is None:
+                raise UploadError("Upload was already finalized.")
+            if current != writes:
+                raise UploadError("A chunk was written while finalizing; finalize again.")
+            if self.document_id and not Document.objects.live().filter(pk=self.document_id).exists():
+                raise UploadError("The document is in the trash.")
+            if self.folder_id and not Folder.objects.live().filter(pk=self.folder_id).exists():
+                raise UploadError("The folder is in the trash.")
+            document = self.document
+            if document is None:
+                document = Document.objects.create(
+                    name=self.name,
+                    folder=self.folder,
+                    created_by=self.created_by,
+                    updated_by=self.created_by,
+                )
+            version = document.add_staged_version(staged, uploaded_by=self.created_by)
+            self.delete()
+        return version
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    offset = models.BigIntegerField()
+    length = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'offset'], name='unique_upload_chunk'),
+        ]
+
+
+class JobManager(models.Manager):
+    def enqueue(self, kind, payload, key=None, run_after=None):
+        """
+        Queue a job to run after the current transaction commits. A job with
+        the same `key` is only ever queued once, so retried requests and
+        replays do not duplicate work.
+        """
+        return self.enqueue_many(kind, [(payload, key)], run_after=run_after)
+
+    def enqueue_many(self, kind, items, run_after=None):
+        """enqueue() for many (payload, key) pairs in one statement."""
+        run_after = run_after or timezone.now()
+        self.bulk_create(
+            [Job(kind=kind, payload=payload, key=key, run_after=run_after) for payload, key in items],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def claim(self, worker):
+        """
+        Take the next due job for `worker`, or None. Concurrent workers skip
+        rows another worker has locked instead of waiting on them.
+        """
+        while True:
+            now = timezone.now()
+            with transaction.atomic():
+                job = (
+                    self.select_for_update(skip_locked=True)
+                    .filter(status=Job.PENDING, run_after__lte=now)
+                    .order_by('run_after', 'id')
+                    .first()
+                )
+                if job is None:
+                    return None
+                # conditional, for databases without row locks
+                claimed = self.filter(pk=job.pk, status=Job.PENDING).update(
+                    status=Job.RUNNING, attempts=F('attempts') + 1, locked_at=now, locked_by=worker,
+                )
+            if claimed:
+                job.status, job.attempts, job.locked_at, job.locked_by = Job.RUNNING, job.attempts + 1, now, worker
+                return job
+
+    def requeue_stale(self):
+        """Put back jobs whose worker died mid-run. Returns how many."""
+        cutoff = timezone.now() - getattr(settings, 'JOB_TIMEOUT', timedelta(minutes=15))
+        return self.filter(status=Job.RUNNING, locked_at__lt=cutoff).update(
+            status=Job.PENDING, locked_at=None, locked_by='',
+        )
+
+    def prune(self, before=None, batch_size=1000):
+        """
+        Delete jobs that finished successfully before `before` (default:
+        JOB_RETENTION ago), `batch_size` rows per statement, and return how
+        many. Their idempotency keys go with them, so a replay after that
+        runs the (idempotent) handler again. Failed jobs are kept for
+        inspection.
+        """
+        if before is None:
+            before = timezone.now() - getattr(settings, 'JOB_RETENTION', timedelta(days=7))
+        # run_after <= finished_at, so job_due_idx narrows the scan
+        done = self.filter(status=Job.DONE, run_after__lt=before, finished_at__lt=before)
+        deleted = 0
+        while True:
+            ids = list(done.order_by('run_after', 'id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += self.filter(pk__in=ids).delete()[0]
+
+    def stats(self):
+        """Queue depth per status and kind, and the age of the oldest due job."""
+        counts = {}
+        for row in self.order_by().values('kind', 'status').annotate(n=Count('pk')):
+            counts.setdefault(row['kind'], {})[row['status']] = row['n']
+        oldest = (
+            self.filter(status=Job.PENDING, run_after__lte=timezone.now())
+            .order_by('run_after').values_list('run_after', flat=True).first()
+        )
+        return {
+            "by_kind": counts,
+            "pending": sum(c.get(Job.PENDING, 0) for c in counts.values()),
+            "running": sum(c.get(Job.RUNNING, 0) for c in counts.values()),
+            "failed": sum(c.get(Job.FAILED, 0) for c in counts.values()),
+            "oldest_pending_seconds": (timezone.now() - oldest).total_seconds() if oldest else 0,
+        }
+
+
+class Job(models.Model):
+    """
+    A unit of background work (see core.jobs for the handlers), run by
+    `manage.py run_jobs`. Failed attempts are retried with backoff.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(s, s) for s in (PENDING, RUNNING, DONE, FAILED)]
+
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # idempotency key: at most one job per key
+    key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after', 'id'], name='job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+def enqueue_version_processing(version_ids):
+    """Queue the post-upload pipeline (core.jobs.process_version) for new versions."""
+    Job.objects.enqueue_many(
+        'process_version', [({'version': pk}, f"process_version:{pk}") for pk in version_ids],
+    )
+
+
+class UserQuotaManager(models.Manager):
+    def charge(self, user_id, size):
+        """
+        Add `size` bytes to the user's usage if it stays within their limit,
+        else raise QuotaExceeded. The check and the increment are a single
+        conditional UPDATE, so concurrent uploads cannot overshoot.
+        """
+        for _ in range(2):
+            charged = self.filter(
+                Q(limit_bytes__isnull=True) | Q(used_bytes__lte=F('limit_bytes') - size),
+                user_id=user_id,
+            ).update(used_bytes=F('used_bytes') + size)
+            if charged:
+                return
+            _, created = self.get_or_create(user_id=user_id, defaults={'limit_bytes': default_quota()})
+            if not created:
+                raise QuotaExceeded("Storage quota exceeded.")
+        raise QuotaExceeded("Storage quota exceeded.")
+
+    def has_room(self, user_id, size):
+        """Whether `size` more bytes would fit, without charging them."""
+        room = self.room(user_id)
+        return room is None or size <= room
+
+    def room(self, user_id):
+        """Bytes the user may still upload (None = unlimited), without charging any."""
+        quota = self.filter(user_id=user_id).values_list('limit_bytes', 'used_bytes').first()
+        limit, used = quota if quota else (default_quota(), 0)
+        return None if limit is None else max(limit - used, 0)
+
+    def refund(self, versions):
+        """Take the sizes of a DocumentVersion queryset off their uploaders' usage."""
+        for row in (
+            versions.filter(uploaded_by__isnull=False).order_by()
+            .values('uploaded_by').annotate(total=Sum('size'))
+        ):
+            if row['total']:
+                self.filter(user_id=row['uploaded_by']).update(used_bytes=F('used_bytes') - row['total'])
+
+
+class UserQuota(models.Model):
+    """
+    Bytes uploaded by a user (every version they uploaded, as counted by
+    the folder totals) and their limit; null means unlimited.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_quota')
+    limit_bytes = models.BigIntegerField(null=True, blank=True)
+    used_bytes = models.BigIntegerField(default=0)
+
+    objects = UserQuotaManager()
+
+    def __str__(self):
+        return f"{self.user}: {self.used_bytes}/{self.limit_bytes or 'unlimited'}"
+
+
+def default_quota():
+    return getattr(settings, 'USER_STORAGE_QUOTA', None)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def recompute_storage_totals():
+    """
+    Rebuild every folder's totals and every user's usage from the versions
+    themselves, for repairing drift after rows were changed behind the
+    models' back. Scans the whole tree; not for the request path.
+    """
+    subtree_versions = DocumentVersion.objects.filter(
+        document__folder__path__startswith=OuterRef('path'),
+    ).order_by()
+    subtree_documents = Document.objects.filter(folder__path__startswith=OuterRef('path')).order_by()
+    Folder.objects.update(
+        total_size=Coalesce(Subquery(
+            subtree_versions.annotate(total=Func('size', function='SUM')).values('total')
+        ), 0),
+        total_documents=Coalesce(Subquery(
+            subtree_documents.annotate(n=Func('pk', function='COUNT')).values('n')
+        ), 0),
+    )
+
+    uploaders = DocumentVersion.objects.filter(uploaded_by__isnull=False).values_list('uploaded_by', flat=True).distinct()
+    UserQuota.objects.bulk_create(
+        [UserQuota(user_id=pk, limit_bytes=default_quota()) for pk in uploaders],
+        ignore_conflicts=True,
+    )
+    uploaded = DocumentVersion.objects.filter(uploaded_by=OuterRef('user_id')).order_by()
+    UserQuota.objects.update(used_bytes=Coalesce(Subquery(
+        uploaded.annotate(total=Func('size', function='SUM')).values('total')
+    ), 0))
+
+
+class UploadError(Exception):
+    """A chunk or finalize request that cannot be accepted (HTTP 400)."""
+
+
+def upload_session_ttl():
+    return getattr(settings, 'UPLOAD_SESSION_TTL', timedelta(hours=24))
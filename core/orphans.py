@@ -0,0 +1,96 @@
+"""
+Finding stored files that no row refers to.
+
+Files are streamed from MEDIA_ROOT with os.scandir and checked against the
+database a batch at a time, so memory stays flat however many files there
+are. Files touched within the grace period are never reported: an upload
+moves its file into place before its row commits (and shard_blobs links
+files before switching rows), so a fresh file without a row is normally
+work in flight. Both bump the inode change time, which is what is checked.
+"""
+import os
+import time
+import uuid
+from collections import namedtuple
+
+from django.core.files.storage import default_storage
+
+from .models import Blob, DocumentVersion, UploadSession
+from .storage import BLOB_DIR, TMP_DIR
+
+# legacy per-version files (FileField upload_to) live under documents/
+SCANNED_DIRS = (BLOB_DIR, 'documents', TMP_DIR)
+
+Orphan = namedtuple('Orphan', 'name size')
+
+
+def _walk(root, top):
+    """(storage name, stat) of every regular file below `top`, without sorting or recursion limits."""
+    stack = [top]
+    while stack:
+        rel = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root, rel))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                name = f"{rel}/{entry.name}"
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(name)
+                elif entry.is_file(follow_symlinks=False):
+                    yield name, entry.stat(follow_symlinks=False)
+
+
+def _last_touched(stat):
+    return max(stat.st_mtime, stat.st_ctime)
+
+
+def referenced(names):
+    """The storage names among `names` that a Blob, DocumentVersion or upload session still uses."""
+    names = list(names)
+    used = set(Blob.objects.filter(file__in=names).values_list('file', flat=True))
+    used |= set(DocumentVersion.objects.filter(file__in=names).values_list('file', flat=True))
+    sessions = {}
+    for name in names:
+        if name.startswith(f"{TMP_DIR}/sessions/") and name.endswith('.part'):
+            try:
+                sessions[uuid.UUID(name[len(TMP_DIR) + 10:-5])] = name
+            except ValueError:
+                pass
+    used |= {sessions[pk] for pk in UploadSession.objects.filter(pk__in=sessions).values_list('pk', flat=True)}
+    return used
+
+
+def find_orphans(grace, batch_size=1000):
+    """Yield an Orphan for every stored file older than `grace` (a timedelta) that nothing uses."""
+    root = default_storage.path('')
+    cutoff = time.time() - grace.total_seconds()
+    batch = []
+    for top in SCANNED_DIRS:
+        for name, stat in _walk(root, top):
+            if _last_touched(stat) < cutoff:
+                batch.append(Orphan(name, stat.st_size))
+            if len(batch) >= batch_size:
+                used = referenced(orphan.name for orphan in batch)
+                yield from (orphan for orphan in batch if orphan.name not in used)
+                batch = []
+    if batch:
+        used = referenced(orphan.name for orphan in batch)
+        yield from (orphan for orphan in batch if orphan.name not in used)
+
+
+def remove_orphan(name, grace):
+    """
+    Delete a file reported by find_orphans() after checking again that it
+    is still old and unused. Returns whether it was removed.
+    """
+    path = default_storage.path(name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if _last_touched(stat) >= time.time() - grace.total_seconds() or referenced([name]):
+        return False
+    os.remove(path)
+    return True
@@ -0,0 +1,201 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+A page is addressed by the sort key of the row it starts after, never by an
+OFFSET, so page 1000 costs the same indexed range scan as page 1. Cursors are
+opaque to clients: base64 encoded JSON holding the key values and direction.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+def get_page_size(request):
+    """
+    Read ?page_size= from the request, falling back to API_PAGE_SIZE and
+    never exceeding API_MAX_PAGE_SIZE.
+    """
+    default = getattr(settings, 'API_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+    raw = request.query_params.get('page_size')
+    if raw in (None, ''):
+        return default
+    try:
+        size = int(raw)
+    except ValueError:
+        size = 0
+    if size < 1:
+        raise ValidationError({"page_size": ["Must be a positive integer."]})
+    return min(size, maximum)
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _load_datetime(value):
+    if not isinstance(value, dict) or not isinstance(value.get("dt"), str):
+        raise ValueError("bad datetime")
+    parsed = parse_datetime(value["dt"])
+    if parsed is None or parsed.tzinfo is None:
+        raise ValueError("bad datetime")
+    return parsed
+
+
+def _load_int(value):
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError("bad integer")
+    return value
+
+
+def _load_str(value):
+    if not isinstance(value, str):
+        raise ValueError("bad string")
+    return value
+
+
+def _load_scalar(value):
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise ValueError("bad key value")
+    return value
+
+
+# How to read each sort key back from a cursor. Cursors come from clients,
+# so every value is checked against its field's type before it reaches a
+# filter (a wrong type would otherwise fail in the database as a 500).
+# Other fields only get _load_scalar.
+KEY_LOADERS = {
+    'id': _load_int,
+    'name': _load_str,
+    'size': _load_int,
+    'updated_at': _load_datetime,
+    'trashed_at': _load_datetime,
+}
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset on a unique ordering, e.g. ('-updated_at', '-id').
+
+    The last field must make the ordering total (normally the primary key),
+    and the leading fields should be covered by an index so each page is a
+    single index range scan.
+    """
+
+    def __init__(self, ordering=('-updated_at', '-id')):
+        self.ordering = tuple(ordering)
+        self.fields = [f.lstrip('-') for f in self.ordering]
+        self.descending = [f.startswith('-') for f in self.ordering]
+        self.loaders = [KEY_LOADERS.get(f, _load_scalar) for f in self.fields]
+
+    # ---- cursor encoding ----
+
+    def encode_cursor(self, segment, row, direction):
+        values = [_dump_value(getattr(row, f)) for f in self.fields]
+        data = {"f": self.fields, "s": segment, "v": values, "d": direction}
+        raw = json.dumps(data, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor, segments=1):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            segment, direction, fields, values = data["s"], data["d"], data["f"], data["v"]
+            # A cursor only makes sense for the ordering that produced it.
+            if (
+                direction not in ('next', 'prev')
+                or fields != self.fields
+                or not isinstance(values, list)
+                or len(values) != len(self.fields)
+                or not isinstance(segment, int)
+                or not 0 <= segment < segments
+            ):
+                raise ValueError("cursor does not match this ordering")
+            values = [load(value) for load, value in zip(self.loaders, values)]
+        except (binascii.Error, ValueError, TypeError, KeyError, UnicodeDecodeError):
+            raise ValidationError({"cursor": ["Invalid cursor."]})
+        return segment, values, direction
+
+    # ---- keyset predicates ----
+
+    def _seek(self, values, forward):
+        """
+        Rows strictly after (forward) or before the given key, expressed as
+        (a > x) OR (a = x AND b > y) ... so the database can use the index.
+        """
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            going_up = self.descending[i] != forward
+            lookup = 'gt' if going_up else 'lt'
+            term = Q(**{f"{field}__{lookup}": values[i]})
+            for prev_field, prev_value in zip(self.fields[:i], values[:i]):
+                term &= Q(**{prev_field: prev_value})
+            condition |= term
+        return condition
+
+    def _reversed_ordering(self):
+        return [f[1:] if f.startswith('-') else f"-{f}" for f in self.ordering]
+
+    # ---- public API ----
+
+    def paginate(self, queryset, request):
+        page = self.paginate_segments([queryset], request)
+        page.items = [row for _, row in page.items]
+        return page
+
+    def paginate_segments(self, querysets, request):
+        """
+        Paginate several querysets as if they were one list: every row of
+        the first, then every row of the second, and so on, each in
+        self.ordering. Items come back as (segment index, row) pairs and a
+        page may span a segment boundary.
+        """
+        size = get_page_size(request)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            segment, values, direction = self.decode_cursor(cursor, len(querysets))
+        else:
+            segment, values, direction = 0, None, 'next'
+
+        rows = []
+        if direction == 'next':
+            for index in range(segment, len(querysets)):
+                qs = querysets[index].order_by(*self.ordering)
+                if index == segment and values is not None:
+                    qs = qs.filter(self._seek(values, forward=True))
+                rows += [(index, row) for row in qs[:size + 1 - len(rows)]]
+                if len(rows) > size:
+                    break
+            has_more = len(rows) > size
+            rows = rows[:size]
+            next_cursor = self.encode_cursor(*rows[-1], 'next') if has_more else None
+            previous_cursor = self.encode_cursor(*rows[0], 'prev') if values is not None and rows else None
+        else:
+            for index in range(segment, -1, -1):
+                qs = querysets[index].order_by(*self._reversed_ordering())
+                if index == segment:
+                    qs = qs.filter(self._seek(values, forward=False))
+                rows += [(index, row) for row in qs[:size + 1 - len(rows)]]
+                if len(rows) > size:
+                    break
+            has_more = len(rows) > size
+            rows = rows[:size][::-1]
+            previous_cursor = self.encode_cursor(*rows[0], 'prev') if has_more else None
+            next_cursor = self.encode_cursor(*rows[-1], 'next') if rows else None
+
+        return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,268 @@
+"""
+Document access checks backed by a per-user cache.
+
+A user may read a document they created or appear in read_permissions or
+write_permissions for, and may write one they created or appear in
+write_permissions for. Superusers may do anything.
+
+Folder grants are inherited by every folder and document below them. They
+are precomputed into FolderAccess rows (one per user per covered folder),
+rebuilt for just the affected subtree and users when a grant changes or a
+folder moves, so a check never walks up the tree.
+
+Single-document checks use the cached sets of readable / writable ids (one
+cache read per request, then O(1) lookups). List endpoints never loop over
+rows: filter_readable() adds the same rule to the queryset as indexed
+semi-joins. The cache is invalidated from the m2m_changed / post_save
+signals in core.signals, and again once their transaction commits.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Document, Folder, FolderAccess, FolderGrant
+
+ReadThrough = Document.read_permissions.through
+WriteThrough = Document.write_permissions.through
+
+
+def _cache_key(user_id):
+    return f"core:access:{user_id}"
+
+
+Access = namedtuple('Access', 'read_documents write_documents read_folders write_folders')
+
+
+def effective_permissions(user):
+    """Access (sets of readable / writable ids) for `user`, cached."""
+    key = _cache_key(user.pk)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    read_ids = set(ReadThrough.objects.filter(user_id=user.pk).values_list('document_id', flat=True))
+    write_ids = set(WriteThrough.objects.filter(user_id=user.pk).values_list('document_id', flat=True))
+    own_ids = set(Document.objects.filter(created_by_id=user.pk).values_list('id', flat=True))
+    folders = dict(FolderAccess.objects.filter(user_id=user.pk).values_list('folder_id', 'can_write'))
+    value = Access(
+        frozenset(read_ids | write_ids | own_ids),
+        frozenset(write_ids | own_ids),
+        frozenset(folders),
+        frozenset(pk for pk, writable in folders.items() if writable),
+    )
+    cache.set(key, value, getattr(settings, 'PERMISSION_CACHE_TIMEOUT', 300))
+    return value
+
+
+def invalidate(user_ids):
+    cache.delete_many([_cache_key(pk) for pk in user_ids])
+
+
+def invalidate_on_commit(user_ids):
+    """
+    invalidate() now and again once the current transaction commits: a
+    request that reads the old rows before then would otherwise cache
+    them until PERMISSION_CACHE_TIMEOUT.
+    """
+    user_ids = list(user_ids)
+    invalidate(user_ids)
+    transaction.on_commit(lambda: invalidate(user_ids))
+
+
+def can_read(user, document):
+    if user.is_superuser:
+        return True
+    access = effective_permissions(user)
+    return document.pk in access.read_documents or document.folder_id in access.read_folders
+
+
+def can_write(user, document):
+    if user.is_superuser:
+        return True
+    access = effective_permissions(user)
+    return document.pk in access.write_documents or document.folder_id in access.write_folders
+
+
+def can_manage_folder(user, folder):
+    """Whether `user` may grant and revoke access to `folder`, or add to it."""
+    if user.is_superuser or folder.created_by_id == user.pk:
+        return True
+    return folder.pk in effective_permissions(user).write_folders
+
+
+def filter_readable(queryset, user):
+    """Restrict a Document queryset to the documents `user` may read."""
+    if user.is_superuser:
+        return queryset
+    return queryset.filter(
+        Q(created_by=user)
+        | Exists(ReadThrough.objects.filter(document_id=OuterRef('pk'), user_id=user.pk))
+        | Exists(WriteThrough.objects.filter(document_id=OuterRef('pk'), user_id=user.pk))
+        | Exists(FolderAccess.objects.filter(folder_id=OuterRef('folder_id'), user_id=user.pk))
+    )
+
+
+# -------------------- Folder grants --------------------
+
+def _path_ids(path):
+    return [int(pk) for pk in path.strip('/').split('/')]
+
+
+def recompute_folder_access(folder, user_ids):
+    """
+    Rebuild the FolderAccess rows of `user_ids` for the subtree of `folder`
+    from their grants on its ancestors and inside it. Work is proportional
+    to the subtree size, never to the whole tree.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    grants = {}
+    for user_id, folder_id, writable in FolderGrant.objects.filter(
+        Q(folder_id__in=folder.ancestor_ids()) | Q(folder__path__startswith=folder.path),
+        user_id__in=user_ids,
+    ).values_list('user_id', 'folder_id', 'can_write'):
+        grants.setdefault(user_id, {})[folder_id] = writable
+
+    rows = []
+    if grants:
+        subtree = Folder.objects.filter(path__startswith=folder.path).values_list('id', 'path')
+        for folder_id, path in subtree.iterator():
+            chain = _path_ids(path)
+            for user_id, held in grants.items():
+                found = [held[pk] for pk in chain if pk in held]
+                if found:
+                    rows.append(FolderAccess(folder_id=folder_id, user_id=user_id, can_write=any(found)))
+
+    with transaction.atomic():
+        FolderAccess.objects.filter(user_id__in=user_ids, folder__path__startswith=folder.path).delete()
+        FolderAccess.objects.bulk_create(rows, batch_size=1000)
+    invalidate_on_commit(user_ids)
+
+
+def grant_folder(folder, user, can_write=False, granted_by=None):
+    with transaction.atomic():
+        grant, _ = FolderGrant.objects.update_or_create(
+            folder=folder, user=user, defaults={'can_write': can_write, 'granted_by': granted_by},
+        )
+        recompute_folder_access(folder, [user.pk])
+    return grant
+
+
+def revoke_folder(folder, user_id):
+    """Remove `user_id`'s grant on `folder`; returns whether one existed."""
+    with transaction.atomic():
+        deleted, _ = FolderGrant.objects.filter(folder=folder, user_id=user_id).delete()
+        if deleted:
+            recompute_folder_access(folder, [user_id])
+    return bool(deleted)
+
+
+def inherit_folder_access(folder):
+    """Copy the parent's effective access onto a newly created folder."""
+    if folder.parent_id is None:
+        return
+    inherited = list(FolderAccess.objects.filter(folder_id=folder.parent_id).values_list('user_id', 'can_write'))
+    FolderAccess.objects.bulk_create(
+        [FolderAccess(folder=folder, user_id=user_id, can_write=writable) for user_id, writable in inherited],
+        ignore_conflicts=True,
+    )
+    invalidate_on_commit([user_id for user_id, _ in inherited])
+
+
+def copy_folder_access(sources):
+    """
+    Give folders created in bulk (bypassing Folder.save()) the access of
+    an existing ancestor: `sources` maps new folder id -> that ancestor's id.
+    """
+    if not sources:
+        return
+    inherited = {}
+    for folder_id, user_id, writable in FolderAccess.objects.filter(
+        folder_id__in=set(sources.values()),
+    ).values_list('folder_id', 'user_id', 'can_write'):
+        inherited.setdefault(folder_id, []).append((user_id, writable))
+    FolderAccess.objects.bulk_create(
+        [
+            FolderAccess(folder_id=new_id, user_id=user_id, can_write=writable)
+            for new_id, source_id in sources.items()
+            for user_id, writable in inherited.get(source_id, ())
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    invalidate_on_commit({user_id for rows in inherited.values() for user_id, _ in rows})
+
+
+def rebuild_moved_folder_access(folder):
+    """
+    Recompute access below a folder that just moved (its path is already
+    rewritten). Only users who had access there before, or hold a grant on
+    the new ancestors or inside the subtree, can be affected.
+    """
+    user_ids = set(FolderAccess.objects.filter(folder=folder).values_list('user_id', flat=True))
+    user_ids.update(FolderGrant.objects.filter(
+        Q(folder_id__in=folder.ancestor_ids()) | Q(folder__path__startswith=folder.path),
+    ).values_list('user_id', flat=True))
+    recompute_folder_access(folder, user_ids)
+
+
+# -------------------- Bulk document permissions --------------------
+
+def _subtree_documents(folder):
+    return Document.objects.filter(folder__path__startswith=folder.path)
+
+
+def _insert_subtree(through, folder, user_ids):
+    """
+    INSERT ... SELECT one (document, user) row per document in the subtree
+    and user, skipping pairs that already exist. Returns rows inserted.
+    """
+    table = connection.ops.quote_name(through._meta.db_table)
+    document_col = connection.ops.quote_name(through._meta.get_field('document').column)
+    user_col = connection.ops.quote_name(through._meta.get_field('user').column)
+    documents_sql, params = _subtree_documents(folder).order_by().values('id').query.sql_with_params()
+    users_sql, user_params = User.objects.filter(pk__in=user_ids).values('id').query.sql_with_params()
+    # WHERE TRUE keeps SQLite from parsing ON CONFLICT as a join constraint.
+    sql = (
+        f"INSERT INTO {table} ({document_col}, {user_col}) "
+        f"SELECT d.id, u.id FROM ({documents_sql}) d CROSS JOIN ({users_sql}) u WHERE TRUE "
+        f"ON CONFLICT ({document_col}, {user_col}) DO NOTHING"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params, *user_params])
+        return cursor.rowcount
+
+
+def bulk_update_document_permissions(folder, user_ids, permission, action):
+    """
+    Grant or revoke `permission` ('read' or 'write') for `user_ids` on every
+    document in the subtree of `folder`, as a handful of set-based
+    statements in one transaction. Revoking read removes write as well, so
+    the users lose access entirely.
+
+    Bypasses m2m_changed, so the affected users' cached access is
+    invalidated here. Returns the number of rows inserted or deleted.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return 0
+    with transaction.atomic():
+        if action == 'grant':
+            through = WriteThrough if permission == 'write' else ReadThrough
+            changed = _insert_subtree(through, folder, user_ids)
+        else:
+            throughs = [WriteThrough] if permission == 'write' else [ReadThrough, WriteThrough]
+            changed = 0
+            for through in throughs:
+                # no signals or relations on the through tables: one DELETE each
+                deleted, _ = through.objects.filter(
+                    user_id__in=user_ids, document__in=_subtree_documents(folder),
+                ).delete()
+                changed += deleted
+    invalidate_on_commit(user_ids)
+    return changed
@@ -0,0 +1,106 @@
+"""
+Version retention.
+
+A RetentionPolicy on a folder decides which old versions of the documents
+below it are kept. Compaction is incremental: the process_version job
+applies the policy to the one document that just received a version, and
+`manage.py apply_retention` (queued when a policy is saved) sweeps a
+subtree in small batches. Each batch locks its documents the way
+Document.add_staged_version() does, so concurrent uploads are safe, and
+removed versions come off the folder totals and their uploaders' quota.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (
+    Document, DocumentVersion, RetentionPolicy, UserQuota, _path_ids, add_folder_totals, release_version_files,
+)
+
+BATCH_SIZE = 500
+
+
+def nearest_policies(paths):
+    """{folder path: the RetentionPolicy that applies below it, or None} in one query."""
+    ids = {pk for path in paths for pk in _path_ids(path)}
+    policies = {policy.folder_id: policy for policy in RetentionPolicy.objects.filter(folder_id__in=ids)}
+    found = {}
+    for path in paths:
+        found[path] = next(
+            (policies[pk] for pk in reversed(_path_ids(path)) if pk in policies), None,
+        )
+    return found
+
+
+def remove_versions(version_ids):
+    """
+    Delete non-current versions, taking their bytes off every folder above
+    them and off their uploaders' usage. Runs in the caller's transaction.
+    """
+    versions = DocumentVersion.objects.filter(pk__in=version_ids)
+    sizes, counts = Counter(), Counter()
+    for document_id, path, size in versions.values_list('document_id', 'document__folder__path', 'size'):
+        sizes[path] += size or 0
+        counts[document_id] += 1
+    deltas = Counter()
+    for path, size in sizes.items():
+        for pk in _path_ids(path):
+            deltas[pk] -= size
+    add_folder_totals({pk: (size, 0) for pk, size in deltas.items() if size})
+    UserQuota.objects.refund(versions)
+
+    by_count = {}
+    for document_id, n in counts.items():
+        by_count.setdefault(n, []).append(document_id)
+    for n, document_ids in by_count.items():
+        Document.objects.filter(pk__in=document_ids).update(version_count=F('version_count') - n)
+    release_version_files(versions)
+    versions.delete()
+    return sum(counts.values())
+
+
+def compact_documents(document_ids, now=None):
+    """Apply the retention policies to these documents. Returns how many versions were removed."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        documents = list(
+            Document.objects.select_for_update(of=('self',)).filter(pk__in=document_ids, version_count__gt=1)
+            .values_list('pk', 'current_version_id', 'folder__path')
+        )
+        policies = nearest_policies({path for _, _, path in documents})
+        applicable = {pk: policies[path] for pk, _, path in documents if policies[path] is not None}
+        if not applicable:
+            return 0
+        current_versions = {version_id for _, version_id, _ in documents}
+
+        doomed, rank = [], Counter()
+        for pk, document_id, uploaded_at in (
+            DocumentVersion.objects.filter(document_id__in=applicable)
+            .order_by('document_id', '-major', '-minor').values_list('pk', 'document_id', 'uploaded_at')
+        ):
+            policy = applicable[document_id]
+            if pk not in current_versions and not policy.keeps(rank[document_id], uploaded_at, now):
+                doomed.append(pk)
+            rank[document_id] += 1
+        return remove_versions(doomed) if doomed else 0
+
+
+def compact(folder=None, batch_size=BATCH_SIZE):
+    """
+    Sweep the documents below every policy (or only below `folder`) in
+    batches of short transactions. Yields the versions removed per batch.
+    """
+    roots = [folder] if folder is not None else [policy.folder for policy in RetentionPolicy.objects.select_related('folder')]
+    for root in roots:
+        last_id = 0
+        while True:
+            ids = list(
+                Document.objects.filter(folder__path__startswith=root.path, version_count__gt=1, pk__gt=last_id)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            yield compact_documents(ids)
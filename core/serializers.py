@@ -1,11 +1,39 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Folder, Document, DocumentVersion
+from django.urls import reverse
+from .models import Folder, FolderGrant, Document, DocumentVersion, RetentionPolicy, UploadSession, UserQuota
+from .storage import is_encoded
+
+
+def version_file_url(version, request):
+    """
+    Where to download a version: the media URL of its file, or the content
+    endpoint when the stored file is encoded and has to be decoded first.
+    """
+    if not version.file or not hasattr(version.file, 'url'):
+        return None
+    if is_encoded(version.file.name):
+        url = reverse('document-version-content', kwargs={'pk': version.document_id, 'vid': version.pk})
+    else:
+        url = version.file.url
+    return request.build_absolute_uri(url) if request else url
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username']
+
+
+class UserQuotaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserQuota
+        fields = ['user', 'limit_bytes', 'used_bytes']
+        read_only_fields = ['user', 'used_bytes']
+
+    def validate_limit_bytes(self, value):
+        if value is not None and value < 0:
+            raise serializers.ValidationError("Must not be negative.")
+        return value
     
     
 
@@ -16,13 +44,13 @@ class DocumentVersionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = DocumentVersion
-        fields = ['id', 'version', 'file', 'file_url', 'uploaded_at', 'uploaded_by']
+        fields = [
+            'id', 'version', 'file', 'file_url', 'size', 'content_type', 'sha256',
+            'uploaded_at', 'uploaded_by',
+        ]
 
     def get_file_url(self, obj):
-        request = self.context.get('request')
-        if obj.file and hasattr(obj.file, 'url'):
-            return request.build_absolute_uri(obj.file.url) if request else obj.file.url
-        return None
+        return version_file_url(obj, self.context.get('request'))
 
     def get_uploaded_by(self, obj):
         return obj.uploaded_by.username if obj.uploaded_by else None
@@ -33,6 +61,8 @@ class DocumentSerializer(serializers.ModelSerializer):
     updated_by = serializers.SerializerMethodField()
     latest_version = serializers.SerializerMethodField()
     latest_file_url = serializers.SerializerMethodField()
+    latest_size = serializers.SerializerMethodField()
+    latest_content_type = serializers.SerializerMethodField()
 
     #New
     read_permissions = serializers.PrimaryKeyRelatedField(
@@ -41,14 +71,15 @@ class DocumentSerializer(serializers.ModelSerializer):
     write_permissions = serializers.PrimaryKeyRelatedField(
         many=True, queryset=User.objects.all(), required=True
     )
+    folder = serializers.PrimaryKeyRelatedField(queryset=Folder.objects.live())
 
     class Meta:
         model = Document
         fields = [
             'id', 'name', 'folder',
-            'created_at', 'updated_at',
+            'created_at', 'updated_at', 'trashed_at',
             'created_by', 'updated_by',
-            'latest_version', 'latest_file_url',
+            'latest_version', 'latest_file_url', 'latest_size', 'latest_content_type',
             'read_permissions', 'write_permissions',
         ]
 
@@ -59,15 +90,20 @@ class DocumentSerializer(serializers.ModelSerializer):
         return obj.updated_by.username if obj.updated_by else None
 
     def get_latest_version(self, obj):
-        latest = obj.versions.first()
+        latest = obj.current_version
         return latest.version if latest else None
 
+    def get_latest_size(self, obj):
+        latest = obj.current_version
+        return latest.size if latest else None
+
+    def get_latest_content_type(self, obj):
+        latest = obj.current_version
+        return latest.content_type if latest else None
+
     def get_latest_file_url(self, obj):
-        request = self.context.get('request')
-        latest = obj.versions.first()
-        if latest and latest.file and hasattr(latest.file, 'url'):
-            return request.build_absolute_uri(latest.file.url) if request else latest.file.url
-        return None
+        latest = obj.current_version
+        return version_file_url(latest, self.context.get('request')) if latest else None
     
     def get_read_users(self, obj):
         return [user.username for user in obj.read_permissions.all()]
@@ -93,18 +129,38 @@ class DocumentSerializer(serializers.ModelSerializer):
 class FolderSerializer(serializers.ModelSerializer):
     created_by = serializers.SerializerMethodField()
     updated_by = serializers.SerializerMethodField()
-    subfolders = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
-    documents = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    subfolder_count = serializers.SerializerMethodField()
+    document_count = serializers.SerializerMethodField()
+    parent = serializers.PrimaryKeyRelatedField(
+        queryset=Folder.objects.live(), allow_null=True, required=False
+    )
 
     class Meta:
         model = Folder
         fields = [
-            'id', 'name', 'parent',
-            'created_at', 'updated_at',
+            'id', 'name', 'parent', 'path', 'depth',
+            'created_at', 'updated_at', 'trashed_at',
             'created_by', 'updated_by',
-            'subfolders', 'documents'
+            'subfolder_count', 'document_count',
+            'total_size', 'total_documents',
         ]
 
+    def get_subfolder_count(self, obj):
+        # annotated by Folder.objects.with_child_counts()
+        if hasattr(obj, 'subfolder_count'):
+            return obj.subfolder_count
+        return obj.subfolders.count()
+
+    def get_document_count(self, obj):
+        if hasattr(obj, 'document_count'):
+            return obj.document_count
+        return obj.documents.count()
+
+    def validate_parent(self, parent):
+        if parent and self.instance and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError("A folder cannot be moved inside itself.")
+        return parent
+
     def get_created_by(self, obj):
         return obj.created_by.username if obj.created_by else None
 
@@ -112,4 +168,81 @@ class FolderSerializer(serializers.ModelSerializer):
         return obj.updated_by.username if obj.updated_by else None
 
 
+class FolderGrantSerializer(serializers.ModelSerializer):
+    granted_by = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FolderGrant
+        fields = ['id', 'folder', 'user', 'can_write', 'granted_by', 'created_at']
+        read_only_fields = ['folder']
+
+    def get_granted_by(self, obj):
+        return obj.granted_by.username if obj.granted_by else None
 
+
+
+
+
+class RetentionPolicySerializer(serializers.ModelSerializer):
+    updated_by = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RetentionPolicy
+        fields = ['folder', 'keep_versions', 'keep_days', 'updated_at', 'updated_by']
+        read_only_fields = ['folder']
+
+    def validate_keep_versions(self, value):
+        if value is not None and value < 1:
+            raise serializers.ValidationError("Must be at least 1.")
+        return value
+
+    def validate(self, attrs):
+        keep_versions = attrs.get('keep_versions', getattr(self.instance, 'keep_versions', None))
+        keep_days = attrs.get('keep_days', getattr(self.instance, 'keep_days', None))
+        if keep_versions is None and keep_days is None:
+            raise serializers.ValidationError("Set keep_versions, keep_days or both.")
+        return attrs
+
+    def get_updated_by(self, obj):
+        return obj.updated_by.username if obj.updated_by else None
+
+
+class BulkPermissionSerializer(serializers.Serializer):
+    users = serializers.PrimaryKeyRelatedField(many=True, queryset=User.objects.all(), allow_empty=False)
+    permission = serializers.ChoiceField(choices=['read', 'write'])
+    action = serializers.ChoiceField(choices=['grant', 'revoke'])
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    received = serializers.SerializerMethodField()
+    folder = serializers.PrimaryKeyRelatedField(
+        queryset=Folder.objects.live(), allow_null=True, required=False
+    )
+    document = serializers.PrimaryKeyRelatedField(
+        queryset=Document.objects.live(), allow_null=True, required=False
+    )
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'name', 'folder', 'document', 'size', 'sha256', 'received', 'created_at', 'expires_at']
+        read_only_fields = ['expires_at']
+
+    def get_received(self, obj):
+        return obj.received_ranges()
+
+    def validate_sha256(self, value):
+        if value and (len(value) != 64 or any(c not in '0123456789abcdefABCDEF' for c in value)):
+            raise serializers.ValidationError("Must be a hex SHA-256 digest.")
+        return value.lower()
+
+    def validate_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError("Must not be negative.")
+        return value
+
+    def validate(self, attrs):
+        if bool(attrs.get('folder')) == bool(attrs.get('document')):
+            raise serializers.ValidationError("Give either folder (new document) or document (new version).")
+        if attrs.get('folder') and not attrs.get('name'):
+            raise serializers.ValidationError({"name": ["Required when uploading a new document."]})
+        return attrs
@@ -0,0 +1,53 @@
+import os
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import permissions
+from .models import Blob, Document, DocumentVersion, UploadSession
+
+
+@receiver(post_delete, sender=DocumentVersion)
+def release_version_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        Blob.objects.release(instance.blob_id)
+
+
+@receiver(post_delete, sender=UploadSession)
+def remove_upload_part_file(sender, instance, **kwargs):
+    path = instance.part_path
+
+    def remove():
+        if os.path.exists(path):
+            os.remove(path)
+    transaction.on_commit(remove)
+
+
+@receiver(m2m_changed, sender=Document.read_permissions.through)
+@receiver(m2m_changed, sender=Document.write_permissions.through)
+def invalidate_permission_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Drop the cached access sets of every user whose grants changed. For
+    clear() the affected users are only known before the rows go away.
+    """
+    if reverse:
+        # user.documents_can_read.add(...): only that user is affected
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            permissions.invalidate_on_commit([instance.pk])
+        return
+    if action == 'pre_clear':
+        instance._cleared_user_ids = list(
+            sender.objects.filter(document_id=instance.pk).values_list('user_id', flat=True)
+        )
+    elif action == 'post_clear':
+        permissions.invalidate_on_commit(getattr(instance, '_cleared_user_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        permissions.invalidate_on_commit(pk_set)
+
+
+@receiver(post_save, sender=Document)
+def invalidate_creator_permissions(sender, instance, created, **kwargs):
+    # the creator can always access their new document
+    if created and instance.created_by_id:
+        permissions.invalidate_on_commit([instance.created_by_id])
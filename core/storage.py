@@ -0,0 +1,223 @@
+"""
+Filesystem side of the content-addressed blob store.
+
+Uploads are streamed once into a temp file inside MEDIA_ROOT while their
+SHA-256 is computed; the bookkeeping (Blob rows, reference counts) lives on
+the Blob model, which then moves the temp file into place with a rename.
+Compressible blobs are later re-stored gzipped (Blob.objects.compress).
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+import zlib
+
+from django.core.files.storage import default_storage
+
+BLOB_DIR = 'blobs'
+TMP_DIR = 'tmp'
+CHUNK_SIZE = 64 * 1024
+
+GZIP = 'gzip'
+# Files are gzipped when zlib's fastest level shrinks samples of them below
+# this fraction, and kept gzipped when the whole file ends up below it too.
+COMPRESSIBLE_RATIO = 0.8
+COMPRESS_SAMPLE_SIZE = 64 * 1024
+COMPRESS_MIN_SIZE = 4 * 1024  # below this a file fills a disk block either way
+
+# Leading bytes of common formats, checked before trusting the file name.
+MAGIC_NUMBERS = [
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+    (b'PK\x03\x04', 'application/zip'),
+]
+
+
+def blob_name(sha256):
+    """
+    Storage name of the blob holding content with this digest, sharded
+    two levels deep on its leading hex digits (blobs/ab/cd/abcd...): a
+    million blobs put about 15 files in each of the 65536 leaf directories.
+    """
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def is_encoded(name):
+    """
+    Whether a stored file holds its content in another form (a delta, see
+    Blob.delta_base, or gzipped, see Blob.encoding) and so cannot be served
+    from MEDIA_URL as is.
+    """
+    return name.endswith(('.delta', '.gz'))
+
+
+def sniff_content_type(head, name=''):
+    """
+    MIME type from the first bytes of a file, falling back to its name.
+    Formats built on zip or OLE (docx, xlsx, odt, msg, ...) are named by
+    their extension when there is one.
+    """
+    guessed = mimetypes.guess_type(name)[0] if name else None
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            if content_type in ('application/zip', 'application/x-ole-storage') and guessed:
+                return guessed
+            return content_type
+    return guessed or 'application/octet-stream'
+
+
+class StagedFile:
+    """
+    Bytes written to a temp file next to the blob directory, with their
+    digest, size and (for content_type) original file name.
+    Blob.objects.claim() moves the file into place; discard() removes
+    whatever is left behind.
+    """
+
+    def __init__(self, path, sha256, size, name=''):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.name = name
+        self._content_type = None
+
+    @property
+    def content_type(self):
+        # read while the file is still staged, i.e. before claim()
+        if self._content_type is None:
+            with open(self.path, 'rb') as f:
+                self._content_type = sniff_content_type(f.read(512), self.name)
+        return self._content_type
+
+    def discard(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _stage_chunks(chunks, tmp_dir, name):
+    fd, path = tempfile.mkstemp(dir=tmp_dir, suffix='.upload')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in chunks:
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return StagedFile(path, digest.hexdigest(), size, name)
+
+
+def stage_file(file):
+    """
+    Copy an uploaded (or any Django) File into MEDIA_ROOT/tmp/, hashing it
+    in the same pass. Uploads received by HashingFileUploadHandler are
+    already staged and are returned without copying.
+    """
+    if getattr(file, 'staged', None) is not None:
+        return file.staged
+    tmp_dir = default_storage.path(TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    return _stage_chunks(file.chunks(CHUNK_SIZE), tmp_dir, os.path.basename(file.name or ''))
+
+
+def stage_local(path, tmp_dir):
+    """
+    stage_file() for a file on local disk. Takes the temp directory
+    explicitly so it can run in a worker process.
+    """
+    with open(path, 'rb') as f:
+        staged = _stage_chunks(iter(lambda: f.read(CHUNK_SIZE), b''), tmp_dir, os.path.basename(path))
+    staged.content_type  # sniff in the worker, not the importing process
+    return staged
+
+
+def hash_path(path):
+    """(sha256, size) of a file on disk, read in bounded chunks."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def place(path, name):
+    """Atomically move a local file to storage name `name`."""
+    target = default_storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(path, target)
+
+
+def link(path, name):
+    """
+    Make the local file at `path` also available as storage name `name`,
+    without copying when the filesystem supports hard links. The original
+    stays readable until the caller removes it.
+    """
+    target = default_storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(path, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(path, target)
+
+
+def looks_compressible(path, size):
+    """
+    Whether the file at `path` is worth gzipping, judged by compressing up
+    to three samples (start, middle, end) at zlib's fastest level, so
+    already-compressed formats cost a few milliseconds to rule out.
+    """
+    if size < COMPRESS_MIN_SIZE:
+        return False
+    with open(path, 'rb') as f:
+        if size <= 3 * COMPRESS_SAMPLE_SIZE:
+            sample = f.read()
+        else:
+            sample = b''
+            for offset in (0, (size - COMPRESS_SAMPLE_SIZE) // 2, size - COMPRESS_SAMPLE_SIZE):
+                f.seek(offset)
+                sample += f.read(COMPRESS_SAMPLE_SIZE)
+    return len(zlib.compress(sample, 1)) < len(sample) * COMPRESSIBLE_RATIO
+
+
+def gzip_file(path, tmp_dir):
+    """Gzip the file at `path` into a temp file in `tmp_dir`. Returns (path, size)."""
+    fd, out_path = tempfile.mkstemp(dir=tmp_dir, suffix='.gz')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            # mtime=0: the same content always gives the same bytes
+            with open(path, 'rb') as src, gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            size = out.tell()
+    except BaseException:
+        os.remove(out_path)
+        raise
+    return out_path, size
+
+
+def copy_to_temp(file, tmp_dir):
+    """Copy a binary file object to a temp file in `tmp_dir` and return its path."""
+    fd, path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            shutil.copyfileobj(file, out, CHUNK_SIZE)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
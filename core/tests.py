@@ -1,3 +1,1300 @@
-from django.test import TestCase
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+from . import delta
+from .models import (
+    Blob, Document, DocumentVersion, Folder, Job, RetentionPolicy, UploadError, UploadSession, UserQuota,
+    delta_encode_version,
+)
+from .permissions import effective_permissions, grant_folder
+from .retention import compact_documents
+from .jobs import run_job
+from .orphans import find_orphans, remove_orphan
+from .storage import TMP_DIR, hash_path
+from .trash import purge, purge_documents
+from .uploadhandlers import HashingFileUploadHandler
+
+
+def use_temp_media(test):
+    """Point MEDIA_ROOT at a fresh directory for the duration of `test`."""
+    media = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media, ignore_errors=True)
+    settings = override_settings(MEDIA_ROOT=media)
+    settings.enable()
+    test.addCleanup(settings.disable)
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        use_temp_media(self)
+        cache.clear()  # permission sets are cached per user id
+        self.alice = User.objects.create_user('alice', password='x')
+        self.mallory = User.objects.create_user('mallory', password='x')
+        self.client = self.client_for(self.alice)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def upload(self, client, folder, name='a.txt', content=b'hello'):
+        response = client.post(
+            '/api/documents/',
+            {'name': name, 'folder': folder.pk, 'file': SimpleUploadedFile(name, content)},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return Document.objects.get(pk=response.data['data']['id'])
+
+    def run_jobs(self):
+        """Run the queued background jobs (run_jobs --once, inline)."""
+        while job := Job.objects.claim('test'):
+            self.assertTrue(run_job(job), Job.objects.get(pk=job.pk).last_error)
+
+
+class FolderPermissionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.secret = Folder.objects.create(name='secret', created_by=self.alice)
+        self.document = self.upload(self.client, self.secret)
+        self.own = Folder.objects.create(name='mine', created_by=self.mallory)
+        self.mallory_client = self.client_for(self.mallory)
+
+    def test_cannot_move_someone_elses_folder_to_gain_access(self):
+        url = f'/api/documents/{self.document.pk}/'
+        self.assertEqual(self.mallory_client.get(url).status_code, 403)
+
+        response = self.mallory_client.put(
+            f'/api/folders/{self.secret.pk}/', {'parent': self.own.pk}, format='json',
+        )
+        self.assertEqual(response.status_code, 403)
+        self.secret.refresh_from_db()
+        self.assertIsNone(self.secret.parent_id)
+
+        self.mallory_client.post(
+            f'/api/folders/{self.own.pk}/grants/', {'user': self.mallory.pk}, format='json',
+        )
+        self.assertEqual(self.mallory_client.get(url).status_code, 403)
+
+    def test_cannot_move_own_folder_into_someone_elses(self):
+        response = self.client.put(
+            f'/api/folders/{self.secret.pk}/', {'parent': self.own.pk}, format='json',
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_owner_can_move_folder(self):
+        target = Folder.objects.create(name='archive', created_by=self.alice)
+        response = self.client.put(
+            f'/api/folders/{self.secret.pk}/', {'parent': target.pk}, format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.secret.refresh_from_db()
+        self.assertEqual(self.secret.parent_id, target.pk)
+
+    def test_cannot_trash_someone_elses_folder(self):
+        response = self.mallory_client.delete(f'/api/folders/{self.secret.pk}/')
+        self.assertEqual(response.status_code, 403)
+        self.secret.refresh_from_db()
+        self.assertIsNone(self.secret.trashed_at)
+
+    def test_cannot_create_folder_in_someone_elses(self):
+        response = self.mallory_client.post(
+            '/api/folders/', {'name': 'planted', 'parent': self.secret.pk}, format='json',
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Folder.objects.filter(name='planted').exists())
+
+        response = self.mallory_client.post(
+            '/api/folders/', {'name': 'planted', 'parent': self.own.pk}, format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_cannot_upload_into_someone_elses_folder(self):
+        response = self.mallory_client.post(
+            '/api/documents/',
+            {'name': 'planted.txt', 'folder': self.secret.pk, 'file': SimpleUploadedFile('planted.txt', b'x')},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Document.objects.filter(name='planted.txt').exists())
+
+    def test_cannot_bulk_upload_into_someone_elses_folder(self):
+        response = self.mallory_client.post(
+            '/api/documents/bulk/',
+            {'folder': self.secret.pk, 'files': [SimpleUploadedFile('planted.txt', b'x')]},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Document.objects.filter(name='planted.txt').exists())
+
+    def test_cannot_start_upload_session_in_someone_elses_folder(self):
+        response = self.mallory_client.post(
+            '/api/uploads/', {'name': 'planted.txt', 'folder': self.secret.pk, 'size': 1}, format='json',
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_cannot_move_document_into_someone_elses_folder(self):
+        document = self.upload(self.mallory_client, self.own, name='planted.txt')
+        response = self.mallory_client.put(
+            f'/api/documents/{document.pk}/', {'folder': self.secret.pk}, format='multipart',
+        )
+        self.assertEqual(response.status_code, 403)
+        document.refresh_from_db()
+        self.assertEqual(document.folder_id, self.own.pk)
+
+    def test_grantee_with_write_access_can_add_to_folder(self):
+        grant_folder(self.secret, self.mallory, can_write=True)
+        response = self.mallory_client.post(
+            '/api/folders/', {'name': 'shared', 'parent': self.secret.pk}, format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.upload(self.mallory_client, self.secret, name='shared.txt')
+
+
+class FolderGrantTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='shared', created_by=self.alice)
+        self.document = self.upload(self.client, self.folder)
+        self.reader = self.client_for(self.mallory)
+        self.url = f'/api/documents/{self.document.pk}/'
+
+    def test_revoke_takes_effect_on_next_request(self):
+        grant_folder(self.folder, self.mallory)
+        self.assertEqual(self.reader.get(self.url).status_code, 200)
+        stale = effective_permissions(self.mallory)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/folders/{self.folder.pk}/grants/{self.mallory.pk}/')
+            self.assertEqual(response.status_code, 204)
+            # a concurrent request re-caches what it read before the commit
+            cache.set(f'core:access:{self.mallory.pk}', stale)
+
+        self.assertEqual(self.reader.get(self.url).status_code, 403)
+
+    def test_grant_takes_effect_on_next_request(self):
+        self.assertEqual(self.reader.get(self.url).status_code, 403)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/folders/{self.folder.pk}/grants/', {'user': self.mallory.pk}, format='json',
+            )
+            self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.reader.get(self.url).status_code, 200)
+
+
+class BulkDocumentPermissionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user('bob', password='x')
+        self.folder = Folder.objects.create(name='f', created_by=self.alice)
+        sub = Folder.objects.create(name='sub', parent=self.folder, created_by=self.alice)
+        self.documents = [
+            self.upload(self.client, self.folder, name='1.txt'),
+            self.upload(self.client, self.folder, name='2.txt'),
+            self.upload(self.client, sub, name='3.txt'),
+        ]
+        self.outside = self.upload(self.client, Folder.objects.create(name='other', created_by=self.alice))
+        self.reader = self.client_for(self.mallory)
+
+    def change(self, users, permission, action, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = (client or self.client).post(
+                f'/api/folders/{self.folder.pk}/permissions/',
+                {'users': [user.pk for user in users], 'permission': permission, 'action': action},
+                format='json',
+            )
+        return response
+
+    def status(self, document, method='get'):
+        if method == 'put':
+            return self.reader.put(f'/api/documents/{document.pk}/', {'name': 'x.txt'}, format='multipart').status_code
+        return self.reader.get(f'/api/documents/{document.pk}/').status_code
+
+    def test_grant_counts_rows_and_is_idempotent(self):
+        response = self.change([self.mallory, self.bob], 'read', 'grant')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['data']['changed'], 6)
+        self.assertEqual(self.change([self.mallory, self.bob], 'read', 'grant').data['data']['changed'], 0)
+        self.assertEqual(self.change([self.mallory], 'write', 'grant').data['data']['changed'], 3)
+        for document in self.documents:
+            self.assertEqual(set(document.read_permissions.all()), {self.mallory, self.bob})
+            self.assertEqual(set(document.write_permissions.all()), {self.mallory})
+        self.assertFalse(self.outside.read_permissions.exists())
+
+    def test_grant_and_revoke_invalidate_cached_access(self):
+        self.assertEqual([self.status(document) for document in self.documents], [403] * 3)
+
+        self.change([self.mallory], 'write', 'grant')
+        self.change([self.mallory], 'read', 'grant')
+        self.assertEqual([self.status(document) for document in self.documents], [200] * 3)
+        self.assertEqual(self.status(self.documents[2], 'put'), 200)
+        self.assertEqual(self.status(self.outside), 403)
+
+        self.assertEqual(self.change([self.mallory], 'write', 'revoke').data['data']['changed'], 3)
+        self.assertEqual(self.status(self.documents[0]), 200)
+        self.assertEqual(self.status(self.documents[0], 'put'), 403)
+
+        self.change([self.mallory], 'write', 'grant')
+        # revoking read takes write with it
+        self.assertEqual(self.change([self.mallory], 'read', 'revoke').data['data']['changed'], 6)
+        self.assertEqual([self.status(document) for document in self.documents], [403] * 3)
+        self.assertEqual(self.change([self.mallory], 'read', 'revoke').data['data']['changed'], 0)
+
+    def test_needs_folder_management_rights(self):
+        response = self.change([self.mallory], 'read', 'grant', client=self.reader)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(self.documents[0].read_permissions.exists())
+
+
+class DocumentPermissionCacheTests(APITestCase):
+    def test_removed_reader_is_refused_on_next_request(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        document = self.upload(self.client, folder)
+        document.read_permissions.add(self.mallory)
+        reader = self.client_for(self.mallory)
+        self.assertEqual(reader.get(f'/api/documents/{document.pk}/').status_code, 200)
+        stale = effective_permissions(self.mallory)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            document.read_permissions.remove(self.mallory)
+            cache.set(f'core:access:{self.mallory.pk}', stale)
+
+        self.assertEqual(reader.get(f'/api/documents/{document.pk}/').status_code, 403)
+
+
+class FolderTreeTests(APITestCase):
+    def test_depth_must_be_ascii_digits(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        Folder.objects.create(name='child', parent=folder, created_by=self.alice)
+        for depth in ('\u00b2', '-1', 'x'):
+            response = self.client.get(f'/api/folders/{folder.pk}/tree/', {'depth': depth})
+            self.assertEqual(response.status_code, 400, depth)
+        response = self.client.get(f'/api/folders/{folder.pk}/tree/', {'depth': '0'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['children'], [])
+
+
+class FolderPathTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = Folder.objects.create(name='a', created_by=self.alice)
+        self.b = Folder.objects.create(name='b', parent=self.a, created_by=self.alice)
+        self.c = Folder.objects.create(name='c', parent=self.b, created_by=self.alice)
+        self.d = Folder.objects.create(name='d', parent=self.c, created_by=self.alice)
+        self.x = Folder.objects.create(name='x', created_by=self.alice)
+
+    def assert_paths(self, *expected):
+        for folder, chain in expected:
+            folder.refresh_from_db()
+            self.assertEqual(folder.path, ''.join(f'/{f.pk}' for f in chain) + '/', folder.name)
+            self.assertEqual(folder.depth, len(chain) - 1, folder.name)
+
+    def test_new_folders(self):
+        a, b, c, d = self.a, self.b, self.c, self.d
+        self.assert_paths((a, [a]), (b, [a, b]), (c, [a, b, c]), (d, [a, b, c, d]))
+        self.assertEqual(list(d.get_ancestors()), [a, b, c])
+        self.assertEqual(set(b.get_descendants()), {c, d})
+
+    def test_subtree_moves_with_its_folder(self):
+        a, b, c, d, x = self.a, self.b, self.c, self.d, self.x
+        response = self.client.put(f'/api/folders/{b.pk}/', {'parent': x.pk}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assert_paths((a, [a]), (b, [x, b]), (c, [x, b, c]), (d, [x, b, c, d]))
+        self.assertEqual(set(a.get_descendants()), set())
+        self.assertEqual(set(x.get_descendants()), {b, c, d})
+
+        response = self.client.put(f'/api/folders/{c.pk}/', {'parent': None}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assert_paths((b, [x, b]), (c, [c]), (d, [c, d]))
+
+    def test_rename_keeps_paths(self):
+        response = self.client.put(f'/api/folders/{self.b.pk}/', {'name': 'renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assert_paths((self.b, [self.a, self.b]), (self.d, [self.a, self.b, self.c, self.d]))
+
+    def test_cannot_move_into_own_subtree(self):
+        for target in (self.b, self.d):
+            response = self.client.put(f'/api/folders/{self.b.pk}/', {'parent': target.pk}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assert_paths((self.b, [self.a, self.b]), (self.d, [self.a, self.b, self.c, self.d]))
+
+
+class DocumentSaveTests(APITestCase):
+    def test_stale_save_keeps_derived_fields(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        document = self.upload(self.client, folder)
+        stale = Document.objects.get(pk=document.pk)
+        document.add_version(SimpleUploadedFile('a.txt', b'second'))
+        document.trash(self.alice)
+
+        stale.name = 'renamed.txt'
+        stale.save()
+
+        document.refresh_from_db()
+        self.assertEqual(document.name, 'renamed.txt')
+        self.assertEqual(document.version_count, 2)
+        self.assertEqual(document.current_version.version, '1.1')
+        self.assertIsNotNone(document.trashed_at)
+
+class QueryCountTests(APITestCase):
+    """List endpoints filter permissions in SQL: the query count does not grow with the rows."""
+
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='shared', created_by=self.alice)
+        grant_folder(self.folder, self.mallory)
+        self.reader = self.client_for(self.mallory)
+
+    def add_documents(self, count):
+        for _ in range(count):
+            n = Document.objects.count()
+            self.upload(self.client, self.folder, name=f'{n}.txt', content=str(n).encode())
+            Folder.objects.create(name=f'sub {n}', parent=self.folder, created_by=self.alice)
+
+    def assert_constant_queries(self, url, expected):
+        for count in (2, 10):
+            self.add_documents(count)
+            cache.clear()
+            with self.assertNumQueries(expected):
+                response = self.reader.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_document_list(self):
+        self.assert_constant_queries('/api/documents/', 3)
+
+    def test_folder_contents(self):
+        self.assert_constant_queries(f'/api/folders/{self.folder.pk}/contents/', 5)
+
+
+def cursor(fields, values, segment=0, direction='next'):
+    raw = json.dumps({"f": fields, "s": segment, "v": values, "d": direction})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+class CursorTests(APITestCase):
+    def test_tampered_document_cursors_are_rejected(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        self.upload(self.client, folder)
+        fields = ['updated_at', 'id']
+        for values in (["x", 1], [None, 1], [[1], 2], [{"dt": "yesterday"}, 1], [{"dt": 5}, 1],
+                       [{"dt": "2026-01-01T00:00:00+00:00"}, "1"], [{"dt": "2026-01-01T00:00:00+00:00"}, True]):
+            response = self.client.get('/api/documents/', {'cursor': cursor(fields, values)})
+            self.assertEqual(response.status_code, 400, values)
+            self.assertEqual(response.data, {"cursor": ["Invalid cursor."]})
+
+        response = self.client.get(
+            '/api/documents/', {'cursor': cursor(fields, [{"dt": "2999-01-01T00:00:00+00:00"}, 1])},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']), 1)
+
+    def test_tampered_contents_cursors_are_rejected(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        self.upload(self.client, folder)
+        url = f'/api/folders/{folder.pk}/contents/'
+        for sort, values in (('size', ["big", 1]), ('size', [None, 1]), ('size', [1.5, 1]),
+                             ('name', [1, 1]), ('name', [["a"], 1]), ('name', ["a", "1"])):
+            response = self.client.get(url, {'sort': sort, 'cursor': cursor([sort, 'id'], values)})
+            self.assertEqual(response.status_code, 400, (sort, values))
+
+        response = self.client.get(url, {'sort': 'size', 'cursor': cursor(['size', 'id'], [0, 0], segment=1)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']), 1)
+
+
+class BulkUploadLimitTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='f', created_by=self.alice)
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('small.txt', b'x' * 1000)
+            zf.writestr('bomb.bin', bytes(1024 * 1024))
+        self.archive = data.getvalue()
+
+    def post_archive(self):
+        return self.client.post(
+            '/api/documents/bulk/',
+            {'folder': self.folder.pk, 'archive': SimpleUploadedFile('a.zip', self.archive)},
+            format='multipart',
+        )
+
+    def staged_files(self):
+        tmp = default_storage.path(TMP_DIR)
+        return [name for name in os.listdir(tmp) if os.path.isfile(os.path.join(tmp, name))] if os.path.isdir(tmp) else []
+
+    @override_settings(BULK_UPLOAD_MAX_BYTES=100 * 1024)
+    def test_expanded_size_is_limited_while_extracting(self):
+        response = self.post_archive()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Document.objects.exists())
+        self.assertEqual(self.staged_files(), [])
+
+    def test_quota_is_checked_while_extracting(self):
+        UserQuota.objects.create(user=self.alice, limit_bytes=100 * 1024)
+        response = self.post_archive()
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Document.objects.exists())
+        self.assertEqual(self.staged_files(), [])
+
+
+class UploadSessionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='f', created_by=self.alice)
+
+    def start(self, **target):
+        response = self.client.post('/api/uploads/', {'size': 5, **target}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        session = response.data['data']['id']
+        response = self.client.put(
+            f'/api/uploads/{session}/chunk/?offset=0', b'hello', content_type='application/octet-stream',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        return session
+
+    def test_offset_must_be_ascii_digits(self):
+        session = self.start(name='a.txt', folder=self.folder.pk)
+        response = self.client.put(
+            f'/api/uploads/{session}/chunk/?offset=\u00b2', b'hello', content_type='application/octet-stream',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_finalize(self):
+        session = self.start(name='a.txt', folder=self.folder.pk)
+        response = self.client.post(f'/api/uploads/{session}/finalize/')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.client.post(f'/api/uploads/{session}/finalize/').status_code, 404)
+
+    def test_finalize_into_trashed_folder(self):
+        session = self.start(name='a.txt', folder=self.folder.pk)
+        self.folder.trash(self.alice)
+        self.assertEqual(self.client.post(f'/api/uploads/{session}/finalize/').status_code, 409)
+        self.assertFalse(Document.objects.exists())
+
+    def test_finalize_after_losing_write_access(self):
+        document = self.upload(self.client, self.folder)
+        document.write_permissions.add(self.mallory)
+        mallory = self.client_for(self.mallory)
+        response = mallory.post('/api/uploads/', {'size': 5, 'document': document.pk}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        session = response.data['data']['id']
+        mallory.put(f'/api/uploads/{session}/chunk/?offset=0', b'hello', content_type='application/octet-stream')
+
+        document.write_permissions.remove(self.mallory)
+        self.assertEqual(mallory.post(f'/api/uploads/{session}/finalize/').status_code, 403)
+        self.assertEqual(document.versions.count(), 1)
+
+    def test_chunk_written_while_finalizing(self):
+        session = UploadSession.objects.get(pk=self.start(name='a.txt', folder=self.folder.pk))
+
+        def hash_and_write(path):
+            digest = hash_path(path)
+            session.write_chunk(0, io.BytesIO(b'HELLO'), 5)
+            return digest
+
+        with mock.patch('core.models.hash_path', side_effect=hash_and_write):
+            response = self.client.post(f'/api/uploads/{session.pk}/finalize/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Document.objects.exists())
+
+        response = self.client.post(f'/api/uploads/{session.pk}/finalize/')
+        self.assertEqual(response.status_code, 201, response.data)
+        document = Document.objects.get()
+        with document.current_version.blob.open() as f:
+            self.assertEqual(f.read(), b'HELLO')
+
+    def test_chunk_after_finalize_is_refused(self):
+        session = UploadSession.objects.get(pk=self.start(name='a.txt', folder=self.folder.pk))
+        self.assertEqual(self.client.post(f'/api/uploads/{session.pk}/finalize/').status_code, 201)
+        with self.assertRaisesMessage(UploadError, 'already finalized'):
+            session.write_chunk(0, io.BytesIO(b'HELLO'), 5)
+        with Document.objects.get().current_version.blob.open() as f:
+            self.assertEqual(f.read(), b'hello')
+
+
+class JobPruneTests(TestCase):
+    def test_prune_deletes_only_old_finished_jobs(self):
+        now = timezone.now()
+        old = now - timedelta(days=30)
+        kept = [
+            Job.objects.create(kind='k', key='recent', status=Job.DONE, run_after=now, finished_at=now),
+            Job.objects.create(kind='k', key='failed', status=Job.FAILED, run_after=old, finished_at=old),
+            Job.objects.create(kind='k', key='pending', status=Job.PENDING, run_after=old),
+        ]
+        for i in range(3):
+            Job.objects.create(kind='k', key=f'old {i}', status=Job.DONE, run_after=old, finished_at=old)
+
+        self.assertEqual(Job.objects.prune(batch_size=2), 3)
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {job.pk for job in kept})
+
+        # the key is free again once its job is gone
+        Job.objects.enqueue('k', {}, key='old 0')
+        self.assertTrue(Job.objects.filter(key='old 0', status=Job.PENDING).exists())
+
+
+class RunJobsTests(TestCase):
+    def test_a_dead_worker_stops_the_others(self):
+        calls = []
+
+        def claim(worker):
+            calls.append(worker)
+            if len(calls) == 1:
+                raise RuntimeError('boom')
+            if len(calls) > 500:
+                raise RuntimeError('still polling')
+            return None
+
+        with mock.patch.object(type(Job.objects), 'claim', side_effect=claim):
+            with self.assertRaisesMessage(RuntimeError, 'boom'):
+                call_command('run_jobs', workers=2, poll_interval=0.01, stdout=io.StringIO())
+        self.assertLess(len(calls), 50)
+
+
+class DownloadTests(APITestCase):
+    content = b'abcdefghijklmnopqrstuvwxyz'
+
+    def setUp(self):
+        super().setUp()
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        self.version = self.upload(self.client, folder, content=self.content).current_version
+        self.url = f'/api/documents/{self.version.document_id}/versions/{self.version.pk}/content/'
+
+    def get(self, method='get', **headers):
+        response = getattr(self.client, method)(self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_whole_file(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Content-Length'], '26')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_range(self):
+        response, body = self.get(Range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b'cdef')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/26')
+        self.assertEqual(response['Content-Length'], '4')
+
+        response, body = self.get(Range='bytes=20-100')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b'uvwxyz')
+        self.assertEqual(response['Content-Range'], 'bytes 20-25/26')
+
+    def test_suffix_range(self):
+        response, body = self.get(Range='bytes=-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b'xyz')
+        self.assertEqual(response['Content-Range'], 'bytes 23-25/26')
+
+        response, body = self.get(Range='bytes=-100')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content)
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=26-', 'bytes=100-200', 'bytes=-0'):
+            response, body = self.get(Range=header)
+            self.assertEqual(response.status_code, 416, header)
+            self.assertEqual(response['Content-Range'], 'bytes */26')
+            self.assertEqual(body, b'')
+
+    def test_ignored_ranges_send_the_whole_file(self):
+        for header in ('bytes=0-1,4-5', 'bytes=5-2', 'bytes=-', 'items=0-1', 'bytes=a-b'):
+            response, body = self.get(Range=header)
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(body, self.content)
+
+    def test_if_range(self):
+        etag = f'"{self.version.sha256}"'
+        response, body = self.get(Range='bytes=0-1', If_Range=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, b'ab')
+
+        stale_date = http_date((self.version.uploaded_at - timedelta(days=1)).timestamp())
+        for validator in ('"stale"', stale_date):
+            response, body = self.get(Range='bytes=0-1', If_Range=validator)
+            self.assertEqual(response.status_code, 200, validator)
+            self.assertEqual(body, self.content)
+
+    def test_not_modified(self):
+        response, _ = self.get()
+        response, body = self.get(If_None_Match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+
+        response, _ = self.get(If_None_Match='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_head_has_no_body(self):
+        response, body = self.get('head')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '26')
+        self.assertEqual(body, b'')
+
+
+class DeltaTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+        self.base = random.Random(1).randbytes(200_000)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def encode(self, target, max_size=None):
+        """The size of the delta from self.base to `target`, after checking it rebuilds `target`."""
+        base_path, target_path = self.write('base', self.base), self.write('target', target)
+        encoded = delta.encode(base_path, target_path, self.dir, max_size=max_size)
+        if encoded is None:
+            return None
+        path, size = encoded
+        self.assertEqual(os.path.getsize(path), size)
+        with delta.open_delta(open(base_path, 'rb'), open(path, 'rb')) as f:
+            self.assertEqual(f.read(), target)
+            f.seek(len(target) // 2)
+            self.assertEqual(f.read(100), target[len(target) // 2:][:100])
+        return size
+
+    # the base's trailing partial block is never indexed, so it comes back as literal bytes
+
+    def test_identical(self):
+        self.assertLess(self.encode(self.base), delta.block_size_for(len(self.base)))
+
+    def test_appended(self):
+        self.assertLess(self.encode(self.base + b'more bytes at the end'), delta.block_size_for(len(self.base)))
+
+    def test_inserted_in_the_middle(self):
+        target = self.base[:100_000] + b'inserted' * 100 + self.base[100_000:]
+        self.assertLess(self.encode(target), 10_000)
+
+    def test_completely_different(self):
+        target = random.Random(2).randbytes(200_000)
+        self.assertIsNone(self.encode(target))
+        self.assertGreater(self.encode(target, max_size=2 * len(target)), len(target))
+
+    def test_bails_out_at_max_size(self):
+        target = self.base[:100_000] + random.Random(2).randbytes(50_000)
+        self.assertIsNone(self.encode(target, max_size=40_000))
+        self.assertIsNotNone(self.encode(target, max_size=60_000))
+
+    def test_empty(self):
+        self.assertLessEqual(self.encode(b'', max_size=100), 100)
+
+
+@override_settings(BLOB_DELTA_STORAGE=True, BLOB_DELTA_MIN_SIZE=1024, BLOB_DELTA_KEYFRAME_INTERVAL=10)
+class DeltaStorageTests(APITestCase):
+    def test_delta_stored_version_downloads_unchanged(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        contents = [random.Random(1).randbytes(100_000)]
+        contents.append(contents[0][:50_000] + b'edit' + contents[0][50_000:])
+        contents.append(contents[1] + b'appended')
+        document = self.upload(self.client, folder, name='a.bin', content=contents[0])
+        for content in contents[1:]:
+            document.add_version(SimpleUploadedFile('a.bin', content), uploaded_by=self.alice)
+        first, middle, newest = DocumentVersion.objects.filter(document=document).order_by('minor')
+
+        self.assertEqual(delta_encode_version(first, middle), 0)  # keyframe
+        self.assertGreater(delta_encode_version(middle, newest), 90_000)
+        middle.refresh_from_db()
+        self.assertEqual(middle.blob.delta_base_id, newest.blob_id)
+        self.assertTrue(middle.file.name.endswith('.delta'))
+
+        url = f'/api/documents/{document.pk}/versions/{middle.pk}/content/'
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), contents[1])
+        response = self.client.get(url, headers={'Range': 'bytes=49998-50005'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), contents[1][49_998:50_006])
+
+
+@override_settings(BLOB_COMPRESSION=True)
+class CompressionTests(APITestCase):
+    compressible = b'the same words over and over, ' * 1000
+    incompressible = random.Random(1).randbytes(30_000)
+
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='f', created_by=self.alice)
+
+    def stored(self, content):
+        version = self.upload(self.client, self.folder, content=content).current_version
+        self.run_jobs()
+        version.refresh_from_db()
+        return version
+
+    def get(self, version, **headers):
+        url = f'/api/documents/{version.document_id}/versions/{version.pk}/content/'
+        response = self.client.get(url, headers=headers)
+        return response, b''.join(response.streaming_content)
+
+    def test_compressible_content_is_gzipped(self):
+        version = self.stored(self.compressible)
+        self.assertEqual(version.blob.encoding, 'gzip')
+        self.assertTrue(version.file.name.endswith('.gz'))
+        self.assertLess(version.blob.stored_size, len(self.compressible) // 10)
+        self.assertEqual(version.blob.size, len(self.compressible))
+        with version.blob.open() as f:
+            self.assertEqual(f.read(), self.compressible)
+
+    def test_incompressible_content_is_left_alone(self):
+        version = self.stored(self.incompressible)
+        self.assertEqual(version.blob.encoding, '')
+        self.assertIsNone(version.blob.stored_size)
+        with version.blob.open_stored() as f:
+            self.assertEqual(f.read(), self.incompressible)
+
+    def test_gzip_is_sent_as_stored(self):
+        version = self.stored(self.compressible)
+        response, body = self.get(version, Accept_Encoding='br, gzip;q=0.5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['ETag'], f'"{version.sha256}-gzip"')
+        self.assertEqual(response['Content-Length'], str(version.blob.stored_size))
+        with version.blob.open_stored() as f:
+            self.assertEqual(body, f.read())
+        self.assertEqual(gzip.decompress(body), self.compressible)
+
+    def test_decoded_without_accept_encoding(self):
+        version = self.stored(self.compressible)
+        for headers in ({}, {'Accept_Encoding': 'gzip;q=0, br'}):
+            response, body = self.get(version, **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('Content-Encoding', response)
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(response['ETag'], f'"{version.sha256}"')
+            self.assertEqual(body, self.compressible)
+
+    def test_range_is_served_from_decoded_content(self):
+        version = self.stored(self.compressible)
+        for headers in ({}, {'Accept_Encoding': 'gzip'}):
+            response, body = self.get(version, Range='bytes=1000-1099', **headers)
+            self.assertEqual(response.status_code, 206)
+            self.assertNotIn('Content-Encoding', response)
+            self.assertEqual(response['Content-Range'], f'bytes 1000-1099/{len(self.compressible)}')
+            self.assertEqual(body, self.compressible[1000:1100])
+
+
+@override_settings(BLOB_COMPRESSION=True)
+class FolderArchiveTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='proj', created_by=self.alice)
+        self.sub = Folder.objects.create(name='sub', parent=self.folder, created_by=self.alice)
+        Folder.objects.create(name='empty', parent=self.sub, created_by=self.alice)
+        self.text = b'compressible text, ' * 1000
+        self.documents = [
+            self.upload(self.client, self.folder, name='a.txt', content=b'first'),
+            self.upload(self.client, self.folder, name='a.txt', content=b'second'),
+            self.upload(self.client, self.folder, name='a.txt', content=b'third'),
+            self.upload(self.client, self.sub, name='big.txt', content=self.text),
+        ]
+        self.run_jobs()
+
+    def archive(self, client):
+        response = client.get(f'/api/folders/{self.folder.pk}/archive/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn('proj.zip', response['Content-Disposition'])
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def test_contents(self):
+        archive = self.archive(self.client)
+        self.assertEqual(
+            sorted(archive.namelist()),
+            ['proj/', 'proj/a (2).txt', 'proj/a (3).txt', 'proj/a.txt',
+             'proj/sub/', 'proj/sub/big.txt', 'proj/sub/empty/'],
+        )
+        self.assertEqual(
+            [archive.read(f'proj/{name}') for name in ('a.txt', 'a (2).txt', 'a (3).txt')],
+            [b'first', b'second', b'third'],
+        )
+
+    def test_gzip_stored_documents_are_archived_decoded(self):
+        big = self.documents[3].current_version
+        big.refresh_from_db()
+        self.assertEqual(big.blob.encoding, 'gzip')
+        self.assertEqual(self.archive(self.client).read('proj/sub/big.txt'), self.text)
+
+    def test_unreadable_documents_are_left_out(self):
+        self.documents[0].read_permissions.add(self.mallory)
+        self.documents[3].read_permissions.add(self.mallory)
+        archive = self.archive(self.client_for(self.mallory))
+        self.assertEqual(
+            sorted(name for name in archive.namelist() if not name.endswith('/')),
+            ['proj/a.txt', 'proj/sub/big.txt'],
+        )
+        self.assertEqual(archive.read('proj/a.txt'), b'first')
+
+
+class BlobDedupTests(APITestCase):
+    def test_identical_uploads_share_one_blob(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        documents = [self.upload(self.client, folder, name=f'{n}.txt', content=b'same bytes') for n in range(3)]
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 3)
+        self.assertEqual({d.current_version.blob_id for d in documents}, {blob.pk})
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+        documents[0].delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            for document in documents[1:]:
+                document.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+
+class ShardBlobsTests(APITestCase):
+    def test_flat_blobs_move_to_sharded_names(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        version = self.upload(self.client, folder, content=b'sharded').current_version
+        sha = version.sha256
+        flat = f'blobs/{sha}'
+        os.rename(default_storage.path(version.blob.file.name), default_storage.path(flat))
+        Blob.objects.filter(pk=version.blob_id).update(file=flat)
+        DocumentVersion.objects.filter(pk=version.pk).update(file=flat)
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('shard_blobs', stdout=out)
+        self.assertIn('Moved 1 blobs', out.getvalue())
+
+        version.refresh_from_db()
+        sharded = f'blobs/{sha[:2]}/{sha[2:4]}/{sha}'
+        self.assertEqual(version.file.name, sharded)
+        self.assertEqual(version.blob.file.name, sharded)
+        self.assertFalse(default_storage.exists(flat))
+        with version.blob.open() as f:
+            self.assertEqual(f.read(), b'sharded')
+        response = self.client.get(f'/api/documents/{version.document_id}/versions/{version.pk}/content/')
+        self.assertEqual(b''.join(response.streaming_content), b'sharded')
+
+        call_command('shard_blobs', stdout=out)
+        self.assertIn('Moved 0 blobs', out.getvalue())
+
+
+class ImportTreeTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='into', created_by=self.alice)
+        self.source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source, ignore_errors=True)
+        for name, content in (('a.txt', b'a'), ('sub/b.txt', b'b'), ('sub/deeper/c.txt', b'c')):
+            self.write(name, content)
+
+    def write(self, name, content):
+        path = os.path.join(self.source, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def run_import(self):
+        out = io.StringIO()
+        call_command('import_tree', self.source, into=self.folder.pk, user='alice', workers=1, stdout=out)
+        return out.getvalue()
+
+    def test_rerun_skips_imported_files(self):
+        self.assertIn('Imported 3 files (3 bytes) into 2 new folders, skipped 0 existing', self.run_import())
+        self.assertIn('Imported 0 files (0 bytes) into 0 new folders, skipped 3 existing', self.run_import())
+
+        self.write('sub/new.txt', b'new')
+        self.assertIn('Imported 1 files (3 bytes) into 0 new folders, skipped 3 existing', self.run_import())
+
+        self.assertEqual(
+            sorted(Document.objects.values_list('folder__name', 'name')),
+            [('deeper', 'c.txt'), ('into', 'a.txt'), ('sub', 'b.txt'), ('sub', 'new.txt')],
+        )
+        self.assertEqual(Folder.objects.filter(name='sub').count(), 1)
+        self.assertEqual(DocumentVersion.objects.count(), 4)
+        c = Document.objects.get(name='c.txt')
+        with c.current_version.blob.open() as f:
+            self.assertEqual(f.read(), b'c')
+        self.assertEqual(c.created_by, self.alice)
+
+
+class VersionMetadataTests(APITestCase):
+    png = b'\x89PNG\r\n\x1a\n' + b'pixels' * 10
+
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='f', created_by=self.alice)
+
+    def test_recorded_at_upload(self):
+        document = self.upload(self.client, self.folder, name='picture', content=self.png)
+        version = document.current_version
+        self.assertEqual(version.size, len(self.png))
+        self.assertEqual(version.content_type, 'image/png')
+        self.assertEqual(version.sha256, hashlib.sha256(self.png).hexdigest())
+
+        response = self.client.get(f'/api/documents/{document.pk}/history/')
+        self.assertEqual(response.status_code, 200)
+        listed = response.data['data'][0]
+        self.assertEqual(
+            (listed['size'], listed['content_type'], listed['sha256']),
+            (version.size, version.content_type, version.sha256),
+        )
+
+    def test_backfill(self):
+        document = self.upload(self.client, self.folder, name='picture', content=self.png)
+        version = document.current_version
+        DocumentVersion.objects.filter(pk=version.pk).update(size=None, content_type='', sha256='')
+        # from before the blob store: a plain file and no blob
+        legacy_name = default_storage.save('documents/notes.txt', ContentFile(b'plain text'))
+        legacy = DocumentVersion.objects.create(document=document, file=legacy_name, major=0, minor=1)
+
+        out = io.StringIO()
+        call_command('backfill_version_metadata', workers=1, stdout=out)
+        self.assertIn('Updated 2 versions (0 missing files)', out.getvalue())
+
+        version.refresh_from_db()
+        legacy.refresh_from_db()
+        self.assertEqual(
+            (version.size, version.content_type, version.sha256),
+            (len(self.png), 'image/png', hashlib.sha256(self.png).hexdigest()),
+        )
+        self.assertEqual(
+            (legacy.size, legacy.content_type, legacy.sha256),
+            (10, 'text/plain', hashlib.sha256(b'plain text').hexdigest()),
+        )
+        self.folder.refresh_from_db()
+        self.assertEqual(self.folder.total_size, len(self.png) + 10)
+
+        call_command('backfill_version_metadata', workers=1, stdout=out)
+        self.assertIn('Updated 0 versions', out.getvalue())
+
+
+class StorageTotalsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = Folder.objects.create(name='a', created_by=self.alice)
+        self.b = Folder.objects.create(name='b', parent=self.a, created_by=self.alice)
+        self.c = Folder.objects.create(name='c', parent=self.b, created_by=self.alice)
+        self.x = Folder.objects.create(name='x', created_by=self.alice)
+
+    def totals(self, *folders):
+        for folder in folders:
+            folder.refresh_from_db()
+        return [(folder.total_size, folder.total_documents) for folder in folders]
+
+    def used(self):
+        return UserQuota.objects.get(user=self.alice).used_bytes
+
+    def stored_files(self):
+        root = default_storage.path('')
+        return sorted(
+            os.path.relpath(os.path.join(dirpath, name), root)
+            for dirpath, _, names in os.walk(root) for name in names
+        )
+
+    def test_totals_follow_moves_trash_and_purge(self):
+        document = self.upload(self.client, self.c, content=b'x' * 100)
+        self.client.put(f'/api/documents/{document.pk}/', {'file': SimpleUploadedFile('a.txt', b'y' * 50)},
+                        format='multipart')
+        self.assertEqual(self.totals(self.a, self.b, self.c), [(150, 1)] * 3)
+        self.assertEqual(self.used(), 150)
+
+        self.client.put(f'/api/documents/{document.pk}/', {'folder': self.b.pk}, format='multipart')
+        self.assertEqual(self.totals(self.a, self.b, self.c), [(150, 1), (150, 1), (0, 0)])
+
+        self.client.put(f'/api/folders/{self.b.pk}/', {'parent': self.x.pk}, format='json')
+        self.assertEqual(self.totals(self.a, self.x, self.b, self.c), [(0, 0), (150, 1), (150, 1), (0, 0)])
+
+        # trashed content still takes up storage until it is purged
+        self.assertEqual(self.client.delete(f'/api/documents/{document.pk}/').status_code, 204)
+        self.assertEqual(self.totals(self.x, self.b), [(150, 1)] * 2)
+        self.assertEqual(self.used(), 150)
+
+        list(purge(before=timezone.now() + timedelta(seconds=1)))
+        self.assertEqual(self.totals(self.x, self.b), [(0, 0)] * 2)
+        self.assertEqual(self.used(), 0)
+
+    def test_purging_a_trashed_folder(self):
+        self.upload(self.client, self.c, content=b'x' * 100)
+        self.upload(self.client, self.b, name='b.txt', content=b'x' * 10)
+        self.assertEqual(self.client.delete(f'/api/folders/{self.b.pk}/').status_code, 204)
+        self.assertEqual(self.totals(self.a), [(110, 2)])
+
+        list(purge(before=timezone.now() + timedelta(seconds=1)))
+        self.assertEqual(self.totals(self.a), [(0, 0)])
+        self.assertFalse(Folder.objects.filter(pk__in=[self.b.pk, self.c.pk]).exists())
+        self.assertEqual(self.used(), 0)
+
+    def test_over_quota_upload_writes_nothing(self):
+        document = self.upload(self.client, self.c, content=b'x' * 100)
+        UserQuota.objects.filter(user=self.alice).update(limit_bytes=120)
+        files = self.stored_files()
+
+        response = self.client.post(
+            '/api/documents/',
+            {'name': 'b.txt', 'folder': self.c.pk, 'file': SimpleUploadedFile('b.txt', b'z' * 50)},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.put(
+            f'/api/documents/{document.pk}/', {'file': SimpleUploadedFile('a.txt', b'z' * 50)}, format='multipart',
+        )
+        self.assertEqual(response.status_code, 403)
+
+        self.assertEqual(Document.objects.count(), 1)
+        self.assertEqual(DocumentVersion.objects.count(), 1)
+        self.assertEqual(self.used(), 100)
+        self.assertEqual(self.totals(self.a, self.c), [(100, 1)] * 2)
+        self.assertEqual(self.stored_files(), files)
+
+
+class HashingUploadHandlerTests(APITestCase):
+    def tmp_files(self):
+        return [name for name in os.listdir(default_storage.path(TMP_DIR)) if name.endswith('.upload')]
+
+    def receive(self, chunks):
+        handler = HashingFileUploadHandler()
+        handler.new_file('file', 'dir/report.pdf', 'application/pdf', None)
+        start = 0
+        for chunk in chunks:
+            handler.receive_data_chunk(chunk, start)
+            start += len(chunk)
+        return handler, handler.file_complete(start)
+
+    def test_digest_and_size_match_the_bytes(self):
+        chunks = [random.Random(n).randbytes(64 * 1024) for n in range(3)] + [b'tail']
+        content = b''.join(chunks)
+        _, uploaded = self.receive(chunks)
+        self.assertEqual(uploaded.staged.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(uploaded.staged.size, len(content))
+        self.assertEqual(uploaded.size, len(content))
+        self.assertEqual(uploaded.name, 'report.pdf')
+        with open(uploaded.temporary_file_path(), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(uploaded.read(), content)
+
+        path = uploaded.temporary_file_path()
+        uploaded.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_interrupted_upload_is_removed(self):
+        handler, _ = self.receive([b'partial'])
+        handler.upload_interrupted()
+        self.assertEqual(self.tmp_files(), [])
+
+    def test_requests_leave_no_temp_files(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        content = b'stored once'
+        version = self.upload(self.client, folder, content=content).current_version
+        self.assertEqual(version.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(version.size, len(content))
+
+        response = self.client_for(self.mallory).post(
+            '/api/documents/', {'name': 'b.txt', 'folder': folder.pk, 'file': SimpleUploadedFile('b.txt', content)},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.tmp_files(), [])
+
+
+class OrphanTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='f', created_by=self.alice)
+        self.stray = default_storage.save('blobs/ab/cd/stray', ContentFile(b'lost'))
+
+    def orphans(self, grace):
+        return sorted(orphan.name for orphan in find_orphans(grace, batch_size=2))
+
+    def test_unreferenced_file_is_removed_only_after_the_grace_period(self):
+        self.assertEqual(self.orphans(timedelta(hours=1)), [])
+        self.assertFalse(remove_orphan(self.stray, timedelta(hours=1)))
+        self.assertTrue(default_storage.exists(self.stray))
+
+        self.assertEqual(self.orphans(timedelta(0)), [self.stray])
+        self.assertTrue(remove_orphan(self.stray, timedelta(0)))
+        self.assertFalse(default_storage.exists(self.stray))
+
+    def test_referenced_files_are_kept(self):
+        document = self.upload(self.client, self.folder)
+        response = self.client.post('/api/uploads/', {'name': 'b.txt', 'folder': self.folder.pk, 'size': 5}, format='json')
+        session = UploadSession.objects.get(pk=response.data['data']['id'])
+
+        # a blob whose only use left is as the base of another blob's delta
+        content = random.Random(1).randbytes(100_000)
+        base = self.upload(self.client, self.folder, name='base.bin', content=content)
+        target = self.upload(self.client, self.folder, name='target.bin', content=content + b'more')
+        base_blob = base.current_version.blob
+        with self.captureOnCommitCallbacks(execute=True):  # removes the target's whole file
+            self.assertGreater(Blob.objects.store_as_delta(target.current_version.blob_id, base_blob.pk), 0)
+        base.delete()
+        base_blob.refresh_from_db()
+        self.assertEqual(base_blob.ref_count, 0)
+
+        names = [
+            document.current_version.file.name,
+            os.path.relpath(session.part_path, default_storage.path('')),
+            base_blob.file.name,
+            Blob.objects.get(pk=target.current_version.blob_id).file.name,
+        ]
+        self.assertEqual(self.orphans(timedelta(0)), [self.stray])
+        for name in names:
+            self.assertFalse(remove_orphan(name, timedelta(0)), name)
+            self.assertTrue(default_storage.exists(name), name)
+
+
+class RetentionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = Folder.objects.create(name='f', created_by=self.alice)
+        self.document = self.upload(self.client, self.folder, content=b'v0')
+        for n in range(1, 4):
+            self.document.add_version(SimpleUploadedFile('a.txt', f'v{n}'.encode()), uploaded_by=self.alice)
+
+    def contents(self):
+        return sorted(self.document.versions.values_list('sha256', flat=True))
+
+    def digests(self, *names):
+        return sorted(hashlib.sha256(name.encode()).hexdigest() for name in names)
+
+    def test_keeps_the_configured_number_of_versions(self):
+        response = self.client.put(f'/api/folders/{self.folder.pk}/retention/', {'keep_versions': 2}, format='json')
+        self.assertIn(response.status_code, (200, 201), response.data)
+        self.run_jobs()
+
+        self.assertEqual(self.contents(), self.digests('v2', 'v3'))
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.version_count, 2)
+        self.folder.refresh_from_db()
+        self.assertEqual(self.folder.total_size, 4)
+        self.assertEqual(UserQuota.objects.get(user=self.alice).used_bytes, 4)
+
+    def test_current_version_is_always_kept(self):
+        oldest = self.document.versions.get(minor=0)
+        Document.objects.filter(pk=self.document.pk).update(current_version=oldest)
+        RetentionPolicy.objects.create(folder=self.folder, keep_versions=1)
+
+        self.assertEqual(compact_documents([self.document.pk]), 2)
+        self.assertEqual(self.contents(), self.digests('v0', 'v3'))
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.current_version_id, oldest.pk)
+
+
+class PurgeTests(APITestCase):
+    def test_restored_document_is_not_purged(self):
+        folder = Folder.objects.create(name='f', created_by=self.alice)
+        document = self.upload(self.client, folder)
+        document.trash(self.alice)
+        before = timezone.now()
+        document.restore()  # between picking the ids and purging them
+
+        self.assertEqual(purge_documents([document.pk], before), 0)
+        self.assertTrue(Document.objects.filter(pk=document.pk).exists())
+
+
+@unittest.skipUnless(connection.features.has_select_for_update, "needs SELECT ... FOR UPDATE")
+class ConcurrentUploadTests(TransactionTestCase):
+    """Parallel uploads to one document queue on its row lock (Document.add_version); other documents do not wait."""
+
+    def setUp(self):
+        use_temp_media(self)
+
+    def test_parallel_uploads_get_unique_contiguous_versions(self):
+        user = User.objects.create_user('alice', password='x')
+        folder = Folder.objects.create(name='f', created_by=user)
+        document = Document.objects.create(name='d.txt', folder=folder, created_by=user)
+        threads, uploads, errors = 8, 5, []
+        start = threading.Barrier(threads)
+
+        def upload(n):
+            try:
+                start.wait()
+                for i in range(uploads):
+                    Document.objects.get(pk=document.pk).add_version(
+                        ContentFile(f'{n}-{i}'.encode(), name='d.txt'), uploaded_by=user,
+                    )
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=upload, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        minors = sorted(DocumentVersion.objects.filter(document=document).values_list('minor', flat=True))
+        self.assertEqual(minors, list(range(threads * uploads)))
+        document.refresh_from_db()
+        self.assertEqual(document.version_count, threads * uploads)
+        self.assertEqual(document.current_version.minor, threads * uploads - 1)
+
+    def test_lock_on_one_document_does_not_block_others(self):
+        user = User.objects.create_user('alice', password='x')
+        folder = Folder.objects.create(name='f', created_by=user)
+        locked, other = (Document.objects.create(name=name, folder=folder, created_by=user) for name in 'ab')
+        holding, release = threading.Event(), threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    Document.objects.select_for_update(of=('self',)).get(pk=locked.pk)
+                    holding.set()
+                    release.wait(30)
+            finally:
+                connection.close()
+
+        def upload(document):
+            try:
+                Document.objects.get(pk=document.pk).add_version(ContentFile(b'x', name='x.txt'), uploaded_by=user)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        self.assertTrue(holding.wait(10))
+        try:
+            blocked = threading.Thread(target=upload, args=(locked,))
+            free = threading.Thread(target=upload, args=(other,))
+            blocked.start()
+            free.start()
+            free.join(10)
+            self.assertFalse(free.is_alive())
+            self.assertEqual(other.versions.count(), 1)
+            blocked.join(0.5)
+            self.assertTrue(blocked.is_alive())
+        finally:
+            release.set()
+            holder.join()
+        blocked.join(10)
+        self.assertEqual(locked.versions.count(), 1)
@@ -0,0 +1,101 @@
+"""
+Purging the trash.
+
+Deleting a folder or document through the API only sets its trashed_at
+(see Folder.trash), which hides the whole subtree at once. Once the
+retention period has passed, `manage.py purge_trash` removes the rows and
+files here in bounded batches, each its own short transaction, taking the
+purged bytes off the folder totals and the uploaders' quota usage and
+dropping the blob references.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import (
+    Document, DocumentVersion, Folder, UserQuota, _path_ids, add_folder_totals, release_version_files,
+    trashed_above,
+)
+
+BATCH_SIZE = 500
+
+
+def trash_retention():
+    return getattr(settings, 'TRASH_RETENTION', timedelta(days=30))
+
+
+def expired_documents(before):
+    """Documents trashed before `before`, themselves or with a folder above them."""
+    return Document.objects.filter(
+        Q(trashed_at__lt=before) | Exists(trashed_above('folder__path', before=before))
+    )
+
+
+def expired_folders(before):
+    """Folders in subtrees trashed before `before` that hold no documents any more."""
+    return Folder.objects.filter(Exists(trashed_above('path', before=before))).exclude(
+        Exists(Document.objects.filter(folder__path__startswith=OuterRef('path')))
+    )
+
+
+def purge_documents(document_ids, before):
+    """
+    Delete documents with all their versions. Their bytes come off every
+    folder above them and off the uploaders' usage, and their blob
+    references are dropped. Documents restored since `document_ids` was
+    read (no longer trashed before `before`) are left alone.
+    """
+    with transaction.atomic():
+        document_ids = list(
+            expired_documents(before).select_for_update(of=('self',))
+            .filter(pk__in=document_ids).values_list('pk', flat=True)
+        )
+        versions = DocumentVersion.objects.filter(document_id__in=document_ids)
+
+        counts = Counter(
+            Document.objects.filter(pk__in=document_ids).values_list('folder__path', flat=True)
+        )
+        sizes = Counter()
+        for path, size in versions.values_list('document__folder__path', 'size'):
+            sizes[path] += size or 0
+        deltas = {}
+        for path, n in counts.items():
+            for pk in _path_ids(path):
+                size, count = deltas.get(pk, (0, 0))
+                deltas[pk] = (size - sizes[path], count - n)
+        add_folder_totals(deltas)
+        UserQuota.objects.refund(versions)
+
+        release_version_files(versions)
+        Document.objects.filter(pk__in=document_ids).delete()
+    return len(document_ids)
+
+
+def purge(before=None, batch_size=BATCH_SIZE):
+    """
+    Remove everything trashed before `before` (default: the retention
+    period ago), `batch_size` rows per transaction. Documents go first,
+    then the emptied folders deepest first. Yields ('documents' |
+    'folders', count) after each batch.
+    """
+    if before is None:
+        before = timezone.now() - trash_retention()
+
+    while True:
+        ids = list(expired_documents(before).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        yield 'documents', purge_documents(ids, before)
+
+    while True:
+        # no deeper folder is left in the subtree, so nothing cascades
+        ids = list(expired_folders(before).order_by('-depth', 'pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            Folder.objects.filter(pk__in=ids).delete()
+        yield 'folders', len(ids)
@@ -0,0 +1,73 @@
+"""
+Upload handler that writes file fields straight into MEDIA_ROOT/tmp while
+hashing them.
+
+Django's default handlers spool large uploads to the system temp dir, after
+which stage_file() reads and writes every byte again. With this handler the
+multipart parser's single write is the staging copy: stage_file() returns
+the StagedFile as-is and the blob store renames it into place.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .storage import TMP_DIR, StagedFile
+
+
+class StagedUploadedFile(UploadedFile):
+    """An uploaded file already staged (and hashed) in MEDIA_ROOT/tmp."""
+
+    def __init__(self, file, staged, name, content_type, charset, content_type_extra=None):
+        super().__init__(file, name, content_type, staged.size, charset, content_type_extra)
+        self.staged = staged
+
+    def temporary_file_path(self):
+        return self.staged.path
+
+    def close(self):
+        # Runs at the end of the request; a file that was stored has already
+        # been renamed away, anything else is removed.
+        try:
+            return self.file.close()
+        finally:
+            self.staged.discard()
+
+
+class HashingFileUploadHandler(FileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        tmp_dir = default_storage.path(TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=tmp_dir, suffix='.upload')
+        self.file = os.fdopen(fd, 'w+b')
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.flush()
+        self.file.seek(0)
+        staged = StagedFile(self.path, self.digest.hexdigest(), file_size, os.path.basename(self.file_name))
+        return StagedUploadedFile(
+            self.file, staged, self.file_name, self.content_type, self.charset, self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class HashingUploadMixin:
+    """Use HashingFileUploadHandler for the file fields of an APIView's requests."""
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [HashingFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
@@ -1,9 +1,15 @@
 from django.urls import path
 from .views import (
     RegisterAPIView, LoginAPIView, LogoutAPIView,
-    UserAPIView,
-    FolderCreateAPIView, FolderDetailAPIView,
-    DocumentCreateAPIView, DocumentDetailAPIView, DocumentHistoryAPIView, RefreshTokenAPIView, DocumentAPIView
+    UserAPIView, UserQuotaAPIView,
+    FolderCreateAPIView, FolderDetailAPIView, FolderTreeAPIView, FolderContentsAPIView, FolderArchiveAPIView,
+    FolderGrantAPIView, FolderGrantDetailAPIView, FolderDocumentPermissionsAPIView,
+    FolderRetentionAPIView,
+    DocumentCreateAPIView, DocumentDetailAPIView, DocumentHistoryAPIView, RefreshTokenAPIView, DocumentAPIView,
+    DocumentVersionContentAPIView, DocumentBulkUploadAPIView,
+    UploadSessionCreateAPIView, UploadSessionDetailAPIView, UploadChunkAPIView, UploadFinalizeAPIView,
+    TrashAPIView, FolderRestoreAPIView, DocumentRestoreAPIView,
+    JobStatsAPIView,
 )
 
 urlpatterns = [
@@ -17,13 +23,41 @@ urlpatterns = [
 
     #Users
     path("users/", UserAPIView.as_view(), name="users"),
+    path("users/<int:pk>/quota/", UserQuotaAPIView.as_view(), name="user-quota"),
 
     # Folders
     path("folders/", FolderCreateAPIView.as_view(), name="folder-create"),
     path("folders/<int:pk>/", FolderDetailAPIView.as_view(), name="folder-detail"),
+    path("folders/<int:pk>/tree/", FolderTreeAPIView.as_view(), name="folder-tree"),
+    path("folders/<int:pk>/contents/", FolderContentsAPIView.as_view(), name="folder-contents"),
+    path("folders/<int:pk>/archive/", FolderArchiveAPIView.as_view(), name="folder-archive"),
+    path("folders/<int:pk>/grants/", FolderGrantAPIView.as_view(), name="folder-grants"),
+    path("folders/<int:pk>/grants/<int:user_id>/", FolderGrantDetailAPIView.as_view(), name="folder-grant-detail"),
+    path("folders/<int:pk>/permissions/", FolderDocumentPermissionsAPIView.as_view(), name="folder-permissions"),
+    path("folders/<int:pk>/retention/", FolderRetentionAPIView.as_view(), name="folder-retention"),
+    path("folders/<int:pk>/restore/", FolderRestoreAPIView.as_view(), name="folder-restore"),
 
     # Documents
     path("documents/", DocumentCreateAPIView.as_view(), name="document-create"),
+    path("documents/bulk/", DocumentBulkUploadAPIView.as_view(), name="document-bulk-upload"),
     path("documents/<int:pk>/", DocumentDetailAPIView.as_view(), name="document-detail"),
     path("documents/<int:pk>/history/", DocumentHistoryAPIView.as_view(), name="document-history"),
+    path(
+        "documents/<int:pk>/versions/<int:vid>/content/",
+        DocumentVersionContentAPIView.as_view(),
+        name="document-version-content",
+    ),
+    path("documents/<int:pk>/restore/", DocumentRestoreAPIView.as_view(), name="document-restore"),
+
+    # Trash
+    path("trash/", TrashAPIView.as_view(), name="trash"),
+
+    # Resumable uploads
+    path("uploads/", UploadSessionCreateAPIView.as_view(), name="upload-create"),
+    path("uploads/<uuid:pk>/", UploadSessionDetailAPIView.as_view(), name="upload-detail"),
+    path("uploads/<uuid:pk>/chunk/", UploadChunkAPIView.as_view(), name="upload-chunk"),
+    path("uploads/<uuid:pk>/finalize/", UploadFinalizeAPIView.as_view(), name="upload-finalize"),
+
+    # Background jobs
+    path("jobs/stats/", JobStatsAPIView.as_view(), name="job-stats"),
 ]
\ No newline at end of file
@@ -1,8 +1,18 @@
-from decimal import Decimal, InvalidOperation
+import re
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header
 from django.contrib.auth.models import User
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
@@ -10,14 +20,35 @@ from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
 # from rest_framework.authtoken.models import Token
-from .models import Folder, Document, DocumentVersion
+from .models import (
+    Folder, Document, DocumentVersion, Job, QuotaExceeded, RetentionPolicy, UploadSession, UploadError, UserQuota,
+    default_quota, upload_session_ttl,
+)
+from . import ingest
+from .downloads import (
+    accepts_encoding, file_response, open_version, stream_zip, unique_archive_name, version_etag,
+)
+from .pagination import KeysetPaginator
+from .trash import trash_retention
+from .permissions import (
+    bulk_update_document_permissions, can_manage_folder, can_read, can_write, filter_readable, grant_folder, revoke_folder,
+)
+from .uploadhandlers import HashingUploadMixin
 from .serializers import (
     UserSerializer,
+    UserQuotaSerializer,
     FolderSerializer,
+    FolderGrantSerializer,
+    BulkPermissionSerializer,
+    RetentionPolicySerializer,
     DocumentSerializer,
     DocumentVersionSerializer,
+    UploadSessionSerializer,
 )
 
+# str.isdigit() also accepts characters such as '²' that int() rejects
+DIGITS_RE = re.compile(r'[0-9]+')
+
 
 # -------------------- Auth APIs --------------------
 class RegisterAPIView(APIView):
@@ -164,30 +195,95 @@ class UserAPIView(APIView):
         )
 
 
+class UserQuotaAPIView(APIView):
+    """
+    GET /api/users/<id>/quota/  - own quota, or anyone's for admins
+    PUT /api/users/<id>/quota/  body: { "limit_bytes": <int or null> } (admins)
+    """
+    def get(self, request, pk):
+        if pk != request.user.pk and not request.user.is_staff:
+            return Response(
+                {
+                    "message": "You do not have permission to view this quota"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+        quota = UserQuota.objects.filter(user_id=pk).first() or UserQuota(
+            user_id=pk, limit_bytes=default_quota(),
+        )
+        return Response(
+            {
+                "message": "success", 
+                "data": UserQuotaSerializer(quota).data
+            }, status=status.HTTP_200_OK
+        )
+
+    def put(self, request, pk):
+        if not request.user.is_staff:
+            return Response(
+                {
+                    "message": "You do not have permission to change quotas"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+        if not User.objects.filter(pk=pk).exists():
+            return Response(
+                {
+                    "message": f"User with ID {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        quota, _ = UserQuota.objects.get_or_create(user_id=pk, defaults={'limit_bytes': default_quota()})
+        serializer = UserQuotaSerializer(quota, data=request.data, partial=True)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(
+                {
+                    "message": "Update quota successful", 
+                    "data": serializer.data
+                }, status=status.HTTP_200_OK
+            )
+        return Response(
+            {
+                "message": "Update failed", 
+                "errors": serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST
+        )
+
+
 # -------------------- Folder APIs --------------------
 
 class FolderCreateAPIView(APIView):
     def get(self, request):
-        folders = Folder.objects.filter(parent=None).prefetch_related('subfolders', 'documents')
-        if not folders.exists():
+        folders = Folder.objects.with_child_counts().filter(parent=None, trashed_at__isnull=True)
+        page = KeysetPaginator().paginate(folders, request)
+        if not page.items:
             return Response(
                 {
                     "message": "No folders found", 
-                    "data": []
+                    "data": [],
+                    "next": page.next_cursor,
+                    "previous": page.previous_cursor,
                 }, status=status.HTTP_200_OK
             )
 
-        serializer = FolderSerializer(folders, many=True)
+        serializer = FolderSerializer(page.items, many=True)
         return Response(
             {
                 "message": "success", 
-                "data": serializer.data
+                "data": serializer.data,
+                "next": page.next_cursor,
+                "previous": page.previous_cursor,
             }, status=status.HTTP_200_OK
         )
 
     def post(self, request):
         serializer = FolderSerializer(data=request.data)
         if serializer.is_valid():
+            parent = serializer.validated_data.get('parent')
+            if parent is not None and not can_manage_folder(request.user, parent):
+                return Response(
+                    {
+                        "message": "You do not have permission to add to this folder"
+                    }, status=status.HTTP_403_FORBIDDEN
+                )
             obj = serializer.save(created_by=request.user, updated_by=request.user)
             out = FolderSerializer(obj).data
             return Response(
@@ -208,7 +304,7 @@ class FolderCreateAPIView(APIView):
 class FolderDetailAPIView(APIView):
     def get_object(self, pk):
         try:
-            return Folder.objects.get(pk=pk)
+            return Folder.objects.live().with_child_counts().get(pk=pk)
         except Folder.DoesNotExist:
             return None
 
@@ -222,10 +318,12 @@ class FolderDetailAPIView(APIView):
                 }, status=status.HTTP_404_NOT_FOUND
             )
         serializer = FolderSerializer(folder)
+        breadcrumbs = [{"id": f.id, "name": f.name} for f in folder.get_ancestors()]
         return Response(
             {
                 "message": "success", 
-                "data": serializer.data
+                "data": serializer.data,
+                "breadcrumbs": breadcrumbs,
             }, status=status.HTTP_200_OK
         )
 
@@ -237,9 +335,27 @@ class FolderDetailAPIView(APIView):
                     "message": f"Folder with ID {pk} not found"
                 }, status=status.HTTP_404_NOT_FOUND
             )
+        if not can_manage_folder(request.user, folder):
+            return Response(
+                {
+                    "message": "You do not have permission to modify this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
 
         serializer = FolderSerializer(folder, data=request.data, partial=True)
         if serializer.is_valid():
+            # Moving a folder changes who inherits access to it, so the
+            # destination must be the user's to manage as well.
+            parent = serializer.validated_data.get('parent')
+            if (
+                parent is not None and parent.pk != folder.parent_id
+                and not can_manage_folder(request.user, parent)
+            ):
+                return Response(
+                    {
+                        "message": "You do not have permission to move a folder into this folder"
+                    }, status=status.HTTP_403_FORBIDDEN
+                )
             obj = serializer.save(updated_by=request.user)
             out = FolderSerializer(obj).data
             return Response(
@@ -265,7 +381,15 @@ class FolderDetailAPIView(APIView):
                 }, status=status.HTTP_404_NOT_FOUND
             )
 
-        folder.delete()
+        if not can_manage_folder(request.user, folder):
+            return Response(
+                {
+                    "message": "You do not have permission to delete this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+
+        # Only marks the folder; the subtree is purged after TRASH_RETENTION.
+        folder.trash(request.user)
         return Response(
             {
                 "message": "Deleted folder successful"
@@ -273,40 +397,455 @@ class FolderDetailAPIView(APIView):
         )
 
 
-# -------------------- Helpers for Versions --------------------
+class FolderTreeAPIView(APIView):
+    """
+    GET /api/folders/<id>/tree/?depth=N&documents=true
+    The folder and its subtree (or the first N levels of it) as nested JSON.
+    Built from one flat query on the materialized path and assembled in
+    memory, so a whole sidebar loads in a single request.
+    """
+    def get(self, request, pk):
+        folder = Folder.objects.live().filter(pk=pk).first()
+        if not folder:
+            return Response(
+                {
+                    "message": f"Folder with ID {pk} not found", 
+                    "data": []
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+
+        depth = request.query_params.get('depth')
+        if depth is not None and not DIGITS_RE.fullmatch(depth):
+            return Response(
+                {
+                    "message": "Invalid request", 
+                    "errors": {"depth": ["Must be a non-negative integer."]}
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        folders = folder.get_descendants().live()
+        documents = filter_readable(
+            Document.objects.live().filter(folder__path__startswith=folder.path), request.user
+        )
+        if depth is not None:
+            folders = folders.filter(depth__lte=folder.depth + int(depth))
+            documents = documents.filter(folder__depth__lte=folder.depth + int(depth))
+
+        with_documents = request.query_params.get('documents') in ('1', 'true', 'True')
+        root = {"id": folder.id, "name": folder.name, "children": []}
+        if with_documents:
+            root["documents"] = []
+        nodes = {folder.id: root}
+
+        # Ordered by depth, so every parent is in `nodes` before its children.
+        for row in folders.order_by('depth', 'name', 'id').values('id', 'name', 'parent_id'):
+            node = {"id": row['id'], "name": row['name'], "children": []}
+            if with_documents:
+                node["documents"] = []
+            nodes[row['id']] = node
+            nodes[row['parent_id']]["children"].append(node)
+
+        if with_documents:
+            for row in documents.order_by('name', 'id').values('id', 'name', 'folder_id'):
+                nodes[row['folder_id']]["documents"].append({"id": row['id'], "name": row['name']})
+
+        return Response(
+            {
+                "message": "success", 
+                "data": root
+            }, status=status.HTTP_200_OK
+        )
+
+
+class FolderContentsAPIView(APIView):
+    """
+    GET /api/folders/<id>/contents/?sort=name|updated_at|size&order=asc|desc
+    Subfolders followed by documents as one keyset-paginated list
+    (?page_size=, ?cursor=). Each item carries a "type" of folder/document.
+    A folder's size is its recursive total, a document's its latest version.
+    """
+    SORT_FIELDS = ('name', 'updated_at', 'size')
+
+    def get(self, request, pk):
+        folder = Folder.objects.live().filter(pk=pk).first()
+        if not folder:
+            return Response(
+                {
+                    "message": f"Folder with ID {pk} not found", 
+                    "data": []
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+
+        sort = request.query_params.get('sort', 'name')
+        order = request.query_params.get('order', 'asc')
+        if sort not in self.SORT_FIELDS or order not in ('asc', 'desc'):
+            return Response(
+                {
+                    "message": "Invalid request", 
+                    "errors": {"detail": f"sort must be one of {', '.join(self.SORT_FIELDS)}; order must be asc or desc"}
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        prefix = '-' if order == 'desc' else ''
+        paginator = KeysetPaginator(ordering=(f"{prefix}{sort}", f"{prefix}id"))
+        page = paginator.paginate_segments(
+            [
+                # children of a live folder are live unless trashed themselves
+                Folder.objects.with_child_counts().filter(parent=folder, trashed_at__isnull=True)
+                .annotate(size=F('total_size')),
+                filter_readable(
+                    Document.objects.with_latest_version().filter(folder=folder, trashed_at__isnull=True),
+                    request.user,
+                ).annotate(size=Coalesce('current_version__size', 0)),
+            ],
+            request,
+        )
+
+        subfolders = [row for segment, row in page.items if segment == 0]
+        documents = [row for segment, row in page.items if segment == 1]
+        data = [
+            {"type": "folder", **item} for item in FolderSerializer(subfolders, many=True).data
+        ] + [
+            {"type": "document", **item}
+            for item in DocumentSerializer(documents, many=True, context={'request': request}).data
+        ]
+        return Response(
+            {
+                "message": "success", 
+                "data": data,
+                "next": page.next_cursor,
+                "previous": page.previous_cursor,
+            }, status=status.HTTP_200_OK
+        )
+
+
+class FolderArchiveAPIView(APIView):
+    """
+    GET /api/folders/<id>/archive/
+    The latest version of every readable document in the subtree as a zip,
+    streamed while it is built: no temporary file, memory bounded by one
+    chunk, and the first bytes leave before the document list is read.
+    Entries are stored uncompressed, so throughput is disk-bound.
+    """
+    def perform_content_negotiation(self, request, force=False):
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, pk):
+        folder = Folder.objects.live().filter(pk=pk).first()
+        if not folder:
+            return Response(
+                {
+                    "message": f"Folder with ID {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+
+        # Archive directory of every folder, ordered by depth so parents come first.
+        dirs = {folder.id: archive_part(folder.name)}
+        used = {folder.id: set()}
+        for row in folder.get_descendants().live().order_by('depth', 'name', 'id').values('id', 'name', 'parent_id'):
+            name = unique_archive_name(archive_part(row['name']), used[row['parent_id']])
+            dirs[row['id']] = f"{dirs[row['parent_id']]}/{name}"
+            used[row['id']] = set()
+
+        documents = (
+            filter_readable(Document.objects.live().filter(folder__path__startswith=folder.path), request.user)
+            .filter(current_version__isnull=False)
+            .select_related('current_version__blob')
+            .order_by('folder_id', 'name', 'id')
+        )
+
+        def files():
+            for document in documents.iterator(chunk_size=500):
+                version = document.current_version
+                name = unique_archive_name(archive_part(document.name), used[document.folder_id])
+                yield (
+                    f"{dirs[document.folder_id]}/{name}",
+                    version.uploaded_at,
+                    version.size if version.size is not None else (version.blob.size if version.blob_id else None),
+                    lambda version=version: open_version(version),
+                )
+
+        response = StreamingHttpResponse(stream_zip(dirs.values(), files()), content_type='application/zip')
+        response['Content-Disposition'] = content_disposition_header(True, f"{dirs[folder.id]}.zip")
+        return response
+
+
+def archive_part(name):
+    """A folder or document name as one path component of an archive entry."""
+    name = name.replace('/', '_').replace('\\', '_').strip()
+    return name if name not in ('', '.', '..') else '_'
+
+
+class FolderGrantAPIView(APIView):
+    """
+    GET  /api/folders/<id>/grants/
+    POST /api/folders/<id>/grants/  body: { "user": <id>, "can_write": true|false }
+    Grants are inherited by every subfolder and document below the folder.
+    Posting for a user who already has a grant here replaces it.
+    """
+    def get(self, request, pk):
+        folder = Folder.objects.live().filter(pk=pk).first()
+        if not folder:
+            return Response(
+                {
+                    "message": f"Folder with ID {pk} not found", 
+                    "data": []
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        if not can_manage_folder(request.user, folder):
+            return Response(
+                {
+                    "message": "You do not have permission to view grants on this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+
+        grants = folder.grants.select_related('granted_by').order_by('id')
+        return Response(
+            {
+                "message": "success", 
+                "data": FolderGrantSerializer(grants, many=True).data
+            }, status=status.HTTP_200_OK
+        )
+
+    def post(self, request, pk):
+        folder = Folder.objects.live().filter(pk=pk).first()
+        if not folder:
+            return Response(
+                {
+                    "message": f"Folder with ID {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        if not can_manage_folder(request.user, folder):
+            return Response(
+                {
+                    "message": "You do not have permission to share this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = FolderGrantSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "message": "Grant failed", 
+                    "errors": serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        grant = grant_folder(
+            folder,
+            serializer.validated_data['user'],
+            can_write=serializer.validated_data.get('can_write', False),
+            granted_by=request.user,
+        )
+        return Response(
+            {
+                "message": "Grant successful", 
+                "data": FolderGrantSerializer(grant).data
+            }, status=status.HTTP_201_CREATED
+        )
+
+
+class FolderGrantDetailAPIView(APIView):
+    """DELETE /api/folders/<id>/grants/<user_id>/"""
+    def delete(self, request, pk, user_id):
+        folder = Folder.objects.live().filter(pk=pk).first()
+        if not folder:
+            return Response(
+                {
+                    "message": f"Folder with ID {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        if not can_manage_folder(request.user, folder):
+            return Response(
+                {
+                    "message": "You do not have permission to share this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+
+        if not revoke_folder(folder, user_id):
+            return Response(
+                {
+                    "message": f"User {user_id} has no grant on this folder"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            {
+                "message": "Revoke successful"
+            }, status=status.HTTP_204_NO_CONTENT
+        )
+
+
+class FolderDocumentPermissionsAPIView(APIView):
+    """
+    POST /api/folders/<id>/permissions/
+    body: { "users": [<id>, ...], "permission": "read"|"write", "action": "grant"|"revoke" }
+    Sets the per-document read/write permissions of every document in the
+    folder's subtree at once. Revoking read also revokes write.
+    """
+    def post(self, request, pk):
+        folder = Folder.objects.live().filter(pk=pk).first()
+        if not folder:
+            return Response(
+                {
+                    "message": f"Folder with ID {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        if not can_manage_folder(request.user, folder):
+            return Response(
+                {
+                    "message": "You do not have permission to share this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = BulkPermissionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "message": "Update failed", 
+                    "errors": serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        data = serializer.validated_data
+        changed = bulk_update_document_permissions(
+            folder, [user.pk for user in data['users']], data['permission'], data['action'],
+        )
+        return Response(
+            {
+                "message": "Update permissions successful", 
+                "data": {"changed": changed}
+            }, status=status.HTTP_200_OK
+        )
+
 
-def bump_minor(version_str: str) -> str:
+class FolderRetentionAPIView(APIView):
     """
-    Safely bump a semantic-like minor version by 0.1 using Decimal.
-    '1.0' -> '1.1'
+    GET / PUT / DELETE /api/folders/<id>/retention/
+    body: { "keep_versions": N, "keep_days": D } (either may be null)
+    The retention policy for old versions of every document below the
+    folder. Saving one queues a background sweep of the subtree; new
+    uploads are compacted as they are processed.
     """
-    try:
-        v = Decimal(version_str)
-    except (InvalidOperation, TypeError):
-        v = Decimal('1.0')
-    return f"{(v + Decimal('0.1')).quantize(Decimal('0.1'))}"
+    def get_folder(self, request, pk):
+        folder = Folder.objects.live().filter(pk=pk).first()
+        if not folder:
+            return None, Response(
+                {
+                    "message": f"Folder with ID {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        if not can_manage_folder(request.user, folder):
+            return None, Response(
+                {
+                    "message": "You do not have permission to manage this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+        return folder, None
+
+    def get(self, request, pk):
+        folder, error = self.get_folder(request, pk)
+        if error:
+            return error
+        policy = RetentionPolicy.objects.select_related('updated_by').filter(folder=folder).first()
+        return Response(
+            {
+                "message": "success", 
+                "data": RetentionPolicySerializer(policy).data if policy else None
+            }, status=status.HTTP_200_OK
+        )
+
+    def put(self, request, pk):
+        folder, error = self.get_folder(request, pk)
+        if error:
+            return error
+        policy = RetentionPolicy.objects.filter(folder=folder).first()
+        serializer = RetentionPolicySerializer(policy, data=request.data, partial=policy is not None)
+        if not serializer.is_valid():
+            return Response(
+                {
+                    "message": "Update failed", 
+                    "errors": serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            policy = serializer.save(folder=folder, updated_by=request.user)
+            Job.objects.enqueue('apply_retention', {'folder': folder.pk})
+        return Response(
+            {
+                "message": "Update retention policy successful", 
+                "data": RetentionPolicySerializer(policy).data
+            }, status=status.HTTP_200_OK
+        )
+
+    def delete(self, request, pk):
+        folder, error = self.get_folder(request, pk)
+        if error:
+            return error
+        if not RetentionPolicy.objects.filter(folder=folder).delete()[0]:
+            return Response(
+                {
+                    "message": "This folder has no retention policy"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            {
+                "message": "Deleted retention policy successful"
+            }, status=status.HTTP_204_NO_CONTENT
+        )
 
 
 # -------------------- Document APIs --------------------
 
-class DocumentCreateAPIView(APIView):
+def quota_exceeded_response():
+    return Response(
+        {
+            "message": "Upload failed", 
+            "errors": {"detail": "Storage quota exceeded"}
+        }, status=status.HTTP_403_FORBIDDEN
+    )
+
+
+def parse_m2m(request, field):
+    """User ids from a form field given repeatedly and/or comma separated."""
+    if field in request.data:
+        if hasattr(request.data, "getlist"):
+            values = request.data.getlist(field)
+        else:
+            values = [request.data.get(field)]
+
+        ids = []
+        for v in values:
+            if isinstance(v, str) and "," in v:
+                ids.extend([int(i) for i in v.split(",") if i.strip().isdigit()])
+            elif str(v).isdigit():
+                ids.append(int(v))
+        return ids
+    return []
+
+class DocumentCreateAPIView(HashingUploadMixin, APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get(self, request):
-        docs = Document.objects.all().prefetch_related('versions')
-        if not docs.exists():
+        docs = filter_readable(Document.objects.live().with_latest_version(), request.user)
+        page = KeysetPaginator().paginate(docs, request)
+        if not page.items:
             return Response(
                 {
                     "message": "No documents found", 
-                    "data": []
+                    "data": [],
+                    "next": page.next_cursor,
+                    "previous": page.previous_cursor,
                 }, status=status.HTTP_200_OK
             )
 
-        serializer = DocumentSerializer(docs, many=True, context={'request': request})
+        serializer = DocumentSerializer(page.items, many=True, context={'request': request})
         return Response(
             {
                 "message": "success", 
-                "data": serializer.data
+                "data": serializer.data,
+                "next": page.next_cursor,
+                "previous": page.previous_cursor,
             }, status=status.HTTP_200_OK
         )
 
@@ -327,8 +866,7 @@ class DocumentCreateAPIView(APIView):
         name = request.data.get('name')
         folder_id = request.data.get('folder')
         file_obj = request.FILES.get('file')
-        folder = Folder.objects.get(pk=folder_id)
-       
+
         if not name or not folder_id:
             return Response(
                 {
@@ -339,7 +877,7 @@ class DocumentCreateAPIView(APIView):
             )
 
         try:
-            folder = Folder.objects.get(pk=folder_id)
+            folder = Folder.objects.live().get(pk=folder_id)
         except Folder.DoesNotExist:
             return Response(
                 {
@@ -347,55 +885,46 @@ class DocumentCreateAPIView(APIView):
                     "errors": {"folder": ["Folder not found"]}
                 }, status=status.HTTP_400_BAD_REQUEST
             )
+        if not can_manage_folder(request.user, folder):
+            return Response(
+                {
+                    "message": "You do not have permission to add to this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
 
-        # Create the logical document
-        doc = Document.objects.create(
-            name=name,
-            folder=folder,
-            created_by=request.user,
-            updated_by=request.user,
-        )
-        
-        def parse_m2m(field):
-            if field in request.data:
-                if hasattr(request.data, "getlist"):
-                    values = request.data.getlist(field)
-                else:
-                    values = [request.data.get(field)]
-                
-                ids = []
-                for v in values:
-                    if isinstance(v, str) and "," in v:
-                        ids.extend([int(i) for i in v.split(",") if i.strip().isdigit()])
-                    elif str(v).isdigit():
-                        ids.append(int(v))
-                return ids
-            return []
-        
-        read_ids = parse_m2m("read_permissions")
-        write_ids = parse_m2m("write_permissions")
+        if not UserQuota.objects.has_room(request.user.pk, file_obj.size):
+            return quota_exceeded_response()
 
-        if read_ids:
-            doc.read_permissions.set(User.objects.filter(id__in=read_ids))
-            print(f"Assigned read_permissions: {read_ids}")
-        
-        if write_ids:
-            doc.write_permissions.set(User.objects.filter(id__in=write_ids))
-            print(f"Assigned write_permissions:{write_ids}")
-        
-        #create first version 1.0 
-        DocumentVersion.objects.create(
-            document = doc,
-            file = file_obj,
-            version = '1.0',
-            uploaded_by = request.user,
-        )
+        try:
+            with transaction.atomic():
+                # Create the logical document
+                doc = Document.objects.create(
+                    name=name,
+                    folder=folder,
+                    created_by=request.user,
+                    updated_by=request.user,
+                )
+
+                read_ids = parse_m2m(request, "read_permissions")
+                write_ids = parse_m2m(request, "write_permissions")
+
+                if read_ids:
+                    doc.read_permissions.set(User.objects.filter(id__in=read_ids))
+
+                if write_ids:
+                    doc.write_permissions.set(User.objects.filter(id__in=write_ids))
+
+                #create first version 1.0 
+                doc.add_version(file_obj, uploaded_by=request.user)
+        except QuotaExceeded:
+            return quota_exceeded_response()
 
 
         #final response with file + permissions
+        doc = Document.objects.with_latest_version().get(pk=doc.pk)
         out = DocumentSerializer(doc, context={'request':request}).data
-        out["read_permissions"] = [{"id": uid} for uid in doc.read_permissions.values_list("id", flat=True)]
-        out["write_permissions"] = [{"id": uid} for uid in doc.write_permissions.values_list("id", flat=True)]
+        out["read_permissions"] = [{"id": user.id} for user in doc.read_permissions.all()]
+        out["write_permissions"] = [{"id": user.id} for user in doc.write_permissions.all()]
 
         return Response(
             {
@@ -437,12 +966,94 @@ class DocumentCreateAPIView(APIView):
     
 
 
-class DocumentDetailAPIView(APIView):
+class DocumentBulkUploadAPIView(HashingUploadMixin, APIView):
+    """
+    POST /api/documents/bulk/
+    form-data: folder, files (repeated) and/or archive (zip or tar),
+               read_permissions, write_permissions (optional)
+    Every file becomes a document with version 1.0; an archive's directory
+    structure is recreated as folders below `folder` (existing folders of
+    the same name are reused). All rows are created in one transaction.
+    """
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        folder = Folder.objects.live().filter(pk=request.data.get('folder') or None).first()
+        if not folder:
+            return Response(
+                {
+                    "message": "Upload failed", 
+                    "errors": {"folder": ["Folder not found"]}
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+        if not can_manage_folder(request.user, folder):
+            return Response(
+                {
+                    "message": "You do not have permission to add to this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+
+        files = request.FILES.getlist('files')
+        archive = request.FILES.get('archive')
+        if not files and not archive:
+            return Response(
+                {
+                    "message": "Upload failed", 
+                    "errors": {"files": ["Send one or more 'files' or an 'archive'."]}
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        read_ids = parse_m2m(request, "read_permissions")
+        write_ids = parse_m2m(request, "write_permissions")
+        user_ids = set(read_ids + write_ids)
+        known = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        if user_ids - known:
+            return Response(
+                {
+                    "message": "Upload failed", 
+                    "errors": {"detail": f"Unknown users: {sorted(user_ids - known)}"}
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        entries = []
+        try:
+            entries = ingest.stage_uploads(files)
+            if archive:
+                entries += ingest.stage_archive(
+                    archive, user=request.user, staged_bytes=sum(entry.staged.size for entry in entries),
+                )
+            result = ingest.ingest(
+                folder, entries, user=request.user, read_ids=read_ids, write_ids=write_ids,
+            )
+        except QuotaExceeded:
+            return quota_exceeded_response()
+        except ingest.IngestError as exc:
+            return Response(
+                {
+                    "message": "Upload failed", 
+                    "errors": {"detail": str(exc)}
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+        finally:
+            ingest.discard(entries)
+
+        return Response(
+            {
+                "message": "Bulk upload successful",
+                "data": {
+                    "folders_created": result.folders_created,
+                    "documents_created": result.documents_created,
+                }
+            }, status=status.HTTP_201_CREATED
+        )
+
+
+class DocumentDetailAPIView(HashingUploadMixin, APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get_object(self, pk):
         try:
-            return Document.objects.prefetch_related('versions').get(pk=pk)
+            return Document.objects.live().with_latest_version().get(pk=pk)
         except Document.DoesNotExist:
             return None
 
@@ -455,6 +1066,12 @@ class DocumentDetailAPIView(APIView):
                     "data": []
                 }, status=status.HTTP_404_NOT_FOUND
             )
+        if not can_read(request.user, doc):
+            return Response(
+                {
+                    "message": "You do not have permission to view this document"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
 
         serializer = DocumentSerializer(doc, context={'request': request})
         return Response(
@@ -467,7 +1084,7 @@ class DocumentDetailAPIView(APIView):
     def put(self, request, pk):
         """
         Update a document.
-        - If 'file' provided: create a new version (bump minor: 1.0 -> 1.1).
+        - If 'file' provided: create a new version (bump minor: 1.9 -> 1.10).
         - If only metadata (name/folder) provided: update document fields.
         """
         doc = self.get_object(pk)
@@ -477,6 +1094,12 @@ class DocumentDetailAPIView(APIView):
                     "message": f"Document with ID {pk} not found"
                 }, status=status.HTTP_404_NOT_FOUND
             )
+        if not can_write(request.user, doc):
+            return Response(
+                {
+                    "message": "You do not have permission to modify this document"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
 
         file_obj = request.FILES.get('file', None)
         name = request.data.get('name', None)
@@ -487,8 +1110,7 @@ class DocumentDetailAPIView(APIView):
             doc.name = name
         if folder_id is not None:
             try:
-                folder = Folder.objects.get(pk=folder_id)
-                doc.folder = folder
+                folder = Folder.objects.live().get(pk=folder_id)
             except Folder.DoesNotExist:
                 return Response(
                     {
@@ -496,23 +1118,28 @@ class DocumentDetailAPIView(APIView):
                         "errors": {"folder": ["Folder not found"]}
                     }, status=status.HTTP_400_BAD_REQUEST
                 )
+            if folder.pk != doc.folder_id and not can_manage_folder(request.user, folder):
+                return Response(
+                    {
+                        "message": "You do not have permission to move a document into this folder"
+                    }, status=status.HTTP_403_FORBIDDEN
+                )
+            doc.folder = folder
 
         # If file present, create a new version
         version_msg = None
         if file_obj:
-            latest = doc.versions.first()
-            next_version = bump_minor(latest.version if latest else '1.0')
-            DocumentVersion.objects.create(
-                document=doc,
-                file=file_obj,
-                version=next_version,
-                uploaded_by=request.user,
-            )
-            version_msg = f"New version created: {next_version}"
+            try:
+                new_version = doc.add_version(file_obj, uploaded_by=request.user)
+            except QuotaExceeded:
+                return quota_exceeded_response()
+            version_msg = f"New version created: {new_version.version}"
 
         doc.updated_by = request.user
-        doc.save()
+        doc.save(update_fields=['name', 'folder', 'updated_by', 'updated_at'])
 
+        # re-read so the annotated latest version reflects the new upload
+        doc = self.get_object(pk)
         out = DocumentSerializer(doc, context={'request': request}).data
         message = "Update document successful"
         if version_msg:
@@ -532,8 +1159,14 @@ class DocumentDetailAPIView(APIView):
                     "message": f"Document with ID {pk} not found"
                 }, status=status.HTTP_404_NOT_FOUND
             )
+        if not can_write(request.user, doc):
+            return Response(
+                {
+                    "message": "You do not have permission to delete this document"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
 
-        doc.delete()
+        doc.trash(request.user)
         return Response(
             {
                 "message": "Deleted document successful"
@@ -548,15 +1181,21 @@ class DocumentHistoryAPIView(APIView):
     """
     def get(self, request, pk):
         try:
-            doc = Document.objects.get(pk=pk)
+            doc = Document.objects.live().get(pk=pk)
         except Document.DoesNotExist:
             return Response(
                 {
                     "message": f"Document with ID {pk} not found", "data": []
                 }, status=status.HTTP_404_NOT_FOUND
             )
+        if not can_read(request.user, doc):
+            return Response(
+                {
+                    "message": "You do not have permission to view this document"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
 
-        versions = doc.versions.all()
+        versions = doc.versions.select_related('uploaded_by')
         serializer = DocumentVersionSerializer(versions, many=True, context={'request': request})
         return Response(
             {
@@ -588,6 +1227,387 @@ class DocumentHistoryAPIView(APIView):
 
 
 
+class DocumentVersionContentAPIView(APIView):
+    """
+    GET /api/documents/<id>/versions/<vid>/content/[?download=1]
+    Streams the stored file in bounded chunks. Supports Range (206/416),
+    If-Range, and ETag / Last-Modified validators (304), so players can
+    seek and download tools can resume or split the transfer.
+    """
+    def perform_content_negotiation(self, request, force=False):
+        # The body is the file itself, whatever the client says it accepts.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, pk, vid):
+        version = (
+            DocumentVersion.objects.select_related('document', 'blob')
+            .filter(pk=vid, document__in=Document.objects.live().filter(pk=pk)).first()
+        )
+        if not version:
+            return Response(
+                {
+                    "message": f"Version {vid} of document {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        if not can_read(request.user, version.document):
+            return Response(
+                {
+                    "message": "You do not have permission to view this document"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+
+        size = version.size
+        if size is None:  # not backfilled yet
+            size = version.blob.size if version.blob_id else version.file.size
+        open_file = partial(open_version, version)
+        blob = version.blob if version.blob_id else None
+        encoding = None
+        if (
+            blob is not None and blob.encoding and 'Range' not in request.headers
+            and accepts_encoding(request, blob.encoding)
+        ):
+            # send the stored bytes as they are; the client decodes them
+            encoding, size, open_file = blob.encoding, blob.stored_size, blob.open_stored
+        response = file_response(
+            request,
+            open_file=open_file,
+            size=size,
+            etag=version_etag(version, encoding),
+            last_modified=version.uploaded_at,
+            filename=version.document.name,
+            content_type=version.content_type or None,
+            as_attachment=request.query_params.get('download') in ('1', 'true', 'True'),
+            content_encoding=encoding,
+        )
+        if blob is not None and blob.encoding:
+            patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+
+# -------------------- Resumable upload APIs --------------------
+
+class UploadSessionCreateAPIView(APIView):
+    def post(self, request):
+        """
+        POST /api/uploads/
+        body: { "name": "...", "folder": <id>, "size": <bytes>, "sha256": "<optional>" }
+          or: { "document": <id>, "size": <bytes>, "sha256": "<optional>" } for a new version
+        """
+        serializer = UploadSessionSerializer(data=request.data)
+        if serializer.is_valid():
+            document = serializer.validated_data.get('document')
+            folder = serializer.validated_data.get('folder')
+            if document and not can_write(request.user, document):
+                return Response(
+                    {
+                        "message": "You do not have permission to modify this document"
+                    }, status=status.HTTP_403_FORBIDDEN
+                )
+            if folder and not can_manage_folder(request.user, folder):
+                return Response(
+                    {
+                        "message": "You do not have permission to add to this folder"
+                    }, status=status.HTTP_403_FORBIDDEN
+                )
+            # fail before the client sends any bytes; finalize charges for real
+            if not UserQuota.objects.has_room(request.user.pk, serializer.validated_data['size']):
+                return quota_exceeded_response()
+            session = serializer.save(
+                created_by=request.user,
+                expires_at=timezone.now() + upload_session_ttl(),
+            )
+            session.create_part_file()
+            return Response(
+                {
+                    "message": "Upload session created", 
+                    "data": UploadSessionSerializer(session).data
+                }, status=status.HTTP_201_CREATED
+            )
+
+        return Response(
+            {
+                "message": "Creation failed", 
+                "errors": serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST
+        )
+
+
+class UploadSessionDetailAPIView(APIView):
+    def get_object(self, request, pk):
+        return UploadSession.objects.filter(pk=pk, created_by=request.user).first()
+
+    def get(self, request, pk):
+        """
+        GET /api/uploads/<id>/
+        Session state; "received" lists the byte ranges stored so far.
+        """
+        session = self.get_object(request, pk)
+        if not session:
+            return Response(
+                {
+                    "message": f"Upload session {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            {
+                "message": "success", 
+                "data": UploadSessionSerializer(session).data
+            }, status=status.HTTP_200_OK
+        )
+
+    def delete(self, request, pk):
+        session = self.get_object(request, pk)
+        if not session:
+            return Response(
+                {
+                    "message": f"Upload session {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        session.delete()
+        return Response(
+            {
+                "message": "Upload session cancelled"
+            }, status=status.HTTP_204_NO_CONTENT
+        )
+
+
+class UploadChunkAPIView(APIView):
+    def put(self, request, pk):
+        """
+        PUT /api/uploads/<id>/chunk/?offset=<byte offset>
+        Body: the raw chunk bytes. Optional header X-Chunk-SHA256 is checked
+        before the chunk is recorded. Chunks may arrive in any order and in
+        parallel; re-sending a chunk overwrites it.
+        """
+        session = UploadSession.objects.filter(pk=pk, created_by=request.user).first()
+        if not session:
+            return Response(
+                {
+                    "message": f"Upload session {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+
+        offset = request.query_params.get('offset', '')
+        length = request.META.get('CONTENT_LENGTH') or ''
+        if not DIGITS_RE.fullmatch(offset) or not DIGITS_RE.fullmatch(length) or int(length) == 0:
+            return Response(
+                {
+                    "message": "Upload failed", 
+                    "errors": {"detail": "offset query parameter and a non-empty body with Content-Length are required"}
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+        if int(length) > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response(
+                {
+                    "message": "Upload failed", 
+                    "errors": {"detail": f"chunks may be at most {settings.UPLOAD_CHUNK_MAX_SIZE} bytes"}
+                }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        try:
+            session.write_chunk(
+                int(offset), request.stream, int(length), sha256=request.headers.get('X-Chunk-SHA256'),
+            )
+        except UploadError as e:
+            return Response(
+                {
+                    "message": "Upload failed", 
+                    "errors": {"detail": str(e)}
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            {
+                "message": "Chunk received", 
+                "data": {"received": session.received_ranges()}
+            }, status=status.HTTP_200_OK
+        )
+
+
+class UploadFinalizeAPIView(APIView):
+    def post(self, request, pk):
+        """
+        POST /api/uploads/<id>/finalize/
+        Verify the upload and create the document (or new version).
+        """
+        session = (
+            UploadSession.objects.select_related('document', 'folder')
+            .filter(pk=pk, created_by=request.user).first()
+        )
+        if not session:
+            return Response(
+                {
+                    "message": f"Upload session {pk} not found"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        # Access may have changed since the session was created.
+        if session.document_id and not can_write(request.user, session.document):
+            return Response(
+                {
+                    "message": "You do not have permission to modify this document"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+        if session.folder_id and not can_manage_folder(request.user, session.folder):
+            return Response(
+                {
+                    "message": "You do not have permission to add to this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+        target = (
+            Document.objects.live().filter(pk=session.document_id) if session.document_id
+            else Folder.objects.live().filter(pk=session.folder_id)
+        )
+        if not target.exists():
+            return Response(
+                {
+                    "message": "The document or folder of this upload is in the trash"
+                }, status=status.HTTP_409_CONFLICT
+            )
+
+        try:
+            version = session.finalize()
+        except QuotaExceeded:
+            return quota_exceeded_response()
+        except UploadError as e:
+            return Response(
+                {
+                    "message": "Finalize failed", 
+                    "errors": {"detail": str(e)}
+                }, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        doc = Document.objects.with_latest_version().get(pk=version.document_id)
+        return Response(
+            {
+                "message": f"Upload complete (version {version.version})",
+                "data": DocumentSerializer(doc, context={'request': request}).data
+            }, status=status.HTTP_201_CREATED
+        )
+
+
+# -------------------- Trash APIs --------------------
+
+class TrashAPIView(APIView):
+    """
+    GET /api/trash/
+    Folders and then documents the user deleted (everything, for
+    superusers), each most recently deleted first, keyset-paginated like
+    folder contents.
+    Each item carries "type" and "purge_after", when it is removed for good.
+    """
+    def get(self, request):
+        folders = Folder.objects.with_child_counts().filter(trashed_at__isnull=False)
+        documents = Document.objects.with_latest_version().filter(trashed_at__isnull=False)
+        if not request.user.is_superuser:
+            folders = folders.filter(trashed_by=request.user)
+            documents = documents.filter(trashed_by=request.user)
+
+        paginator = KeysetPaginator(ordering=('-trashed_at', '-id'))
+        page = paginator.paginate_segments([folders, documents], request)
+
+        retention = trash_retention()
+        data = [
+            {"type": "folder", **FolderSerializer(row).data, "purge_after": row.trashed_at + retention}
+            if segment == 0 else
+            {
+                "type": "document",
+                **DocumentSerializer(row, context={'request': request}).data,
+                "purge_after": row.trashed_at + retention,
+            }
+            for segment, row in page.items
+        ]
+        return Response(
+            {
+                "message": "success", 
+                "data": data,
+                "next": page.next_cursor,
+                "previous": page.previous_cursor,
+            }, status=status.HTTP_200_OK
+        )
+
+
+class FolderRestoreAPIView(APIView):
+    """POST /api/folders/<id>/restore/ - take a folder and its subtree out of the trash."""
+    def post(self, request, pk):
+        folder = Folder.objects.filter(pk=pk, trashed_at__isnull=False).first()
+        if not folder:
+            return Response(
+                {
+                    "message": f"Folder with ID {pk} is not in the trash"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        if not can_manage_folder(request.user, folder):
+            return Response(
+                {
+                    "message": "You do not have permission to restore this folder"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+        if folder.parent_id and not Folder.objects.live().filter(pk=folder.parent_id).exists():
+            return Response(
+                {
+                    "message": "Restore failed", 
+                    "errors": {"detail": "The containing folder is in the trash; restore it first"}
+                }, status=status.HTTP_409_CONFLICT
+            )
+
+        folder.restore()
+        return Response(
+            {
+                "message": "Restore folder successful", 
+                "data": FolderSerializer(Folder.objects.with_child_counts().get(pk=pk)).data
+            }, status=status.HTTP_200_OK
+        )
+
+
+class DocumentRestoreAPIView(APIView):
+    """POST /api/documents/<id>/restore/ - take a document out of the trash."""
+    def post(self, request, pk):
+        doc = Document.objects.filter(pk=pk, trashed_at__isnull=False).first()
+        if not doc:
+            return Response(
+                {
+                    "message": f"Document with ID {pk} is not in the trash"
+                }, status=status.HTTP_404_NOT_FOUND
+            )
+        if not can_write(request.user, doc):
+            return Response(
+                {
+                    "message": "You do not have permission to restore this document"
+                }, status=status.HTTP_403_FORBIDDEN
+            )
+        if not Folder.objects.live().filter(pk=doc.folder_id).exists():
+            return Response(
+                {
+                    "message": "Restore failed", 
+                    "errors": {"detail": "The containing folder is in the trash; restore it first"}
+                }, status=status.HTTP_409_CONFLICT
+            )
+
+        doc.restore()
+        doc = Document.objects.with_latest_version().get(pk=pk)
+        return Response(
+            {
+                "message": "Restore document successful", 
+                "data": DocumentSerializer(doc, context={'request': request}).data
+            }, status=status.HTTP_200_OK
+        )
+
+
+# -------------------- Job APIs --------------------
+
+class JobStatsAPIView(APIView):
+    """GET /api/jobs/stats/ - background queue depth, for monitoring."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(
+            {
+                "message": "success", 
+                "data": Job.objects.stats()
+            }, status=status.HTTP_200_OK
+        )
+
+
 # -----------------New Task -----------------
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -623,12 +1643,14 @@ class DocumentAPIView(APIView):
     # 🔹 GET: All docs or single doc
     def get(self, request, pk=None):
         if pk:
-            doc = Document.objects.filter(pk=pk).first()
+            doc = Document.objects.live().with_latest_version().filter(pk=pk).first()
             if not doc:
                 return Response({"error": "Document not found"}, status=status.HTTP_404_NOT_FOUND)
+            if not can_read(request.user, doc):
+                return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
             serializer = DocumentSerializer(doc)
             return Response(serializer.data)
-        docs = Document.objects.all()
+        docs = filter_readable(Document.objects.live().with_latest_version(), request.user)
         serializer = DocumentSerializer(docs, many=True)
         return Response(serializer.data)
 
@@ -645,6 +1667,9 @@ class DocumentAPIView(APIView):
 
         serializer = DocumentSerializer(data=data)
         if serializer.is_valid():
+            folder = serializer.validated_data.get('folder')
+            if folder is not None and not can_manage_folder(request.user, folder):
+                return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
             doc = serializer.save()
 
             # Assign M2M after save
@@ -654,6 +1679,7 @@ class DocumentAPIView(APIView):
                 doc.write_permissions.set(write_ids)
 
             # Refresh data
+            doc = Document.objects.with_latest_version().get(pk=doc.pk)
             serializer = DocumentSerializer(doc)
             return Response(
                 {"message": "Document created successfully", "data": serializer.data},
@@ -663,9 +1689,11 @@ class DocumentAPIView(APIView):
 
     # 🔹 PUT: Update document
     def put(self, request, pk=None):
-        doc = Document.objects.filter(pk=pk).first()
+        doc = Document.objects.live().filter(pk=pk).first()
         if not doc:
             return Response({"error": "Document not found"}, status=status.HTTP_404_NOT_FOUND)
+        if not can_write(request.user, doc):
+            return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
 
         data = request.data.copy()
 
@@ -677,6 +1705,12 @@ class DocumentAPIView(APIView):
 
         serializer = DocumentSerializer(doc, data=data, partial=True)
         if serializer.is_valid():
+            folder = serializer.validated_data.get('folder')
+            if (
+                folder is not None and folder.pk != doc.folder_id
+                and not can_manage_folder(request.user, folder)
+            ):
+                return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
             doc = serializer.save()
 
             if read_ids:
@@ -684,6 +1718,7 @@ class DocumentAPIView(APIView):
             if write_ids:
                 doc.write_permissions.set(write_ids)
 
+            doc = Document.objects.with_latest_version().get(pk=doc.pk)
             serializer = DocumentSerializer(doc)
             return Response(
                 {"message": "Document updated successfully", "data": serializer.data},
@@ -693,8 +1728,10 @@ class DocumentAPIView(APIView):
 
     # 🔹 DELETE: Remove document
     def delete(self, request, pk=None):
-        doc = Document.objects.filter(pk=pk).first()
+        doc = Document.objects.live().filter(pk=pk).first()
         if not doc:
             return Response({"error": "Document not found"}, status=status.HTTP_404_NOT_FOUND)
-        doc.delete()
+        if not can_write(request.user, doc):
+            return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
+        doc.trash(request.user)
         return Response({"message": "Document deleted"}, status=status.HTTP_204_NO_CONTENT)
@@ -65,6 +65,58 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Keyset pagination for list endpoints (?page_size=, ?cursor=)
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+# Per-user readable/writable document id sets (core/permissions.py) are kept
+# in the default cache and invalidated on permission changes. Use a shared
+# cache (Redis/Memcached) when running several processes, otherwise other
+# processes only see a revoke once this timeout expires.
+PERMISSION_CACHE_TIMEOUT = 300
+
+# Resumable uploads (/api/uploads/): sessions idle longer than this are
+# removed by `manage.py expire_uploads`; larger chunks are rejected.
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+UPLOAD_CHUNK_MAX_SIZE = 64 * 1024 * 1024
+
+# Most files accepted by one bulk upload (files + archive members).
+BULK_UPLOAD_MAX_FILES = 10000
+# Most bytes one bulk upload may add once its archive is extracted; checked
+# while extracting, along with the uploader's quota.
+BULK_UPLOAD_MAX_BYTES = 10 * 1024 ** 3
+
+# Default per-user storage limit in bytes for users without their own
+# (None = unlimited); see UserQuota.
+USER_STORAGE_QUOTA = None
+
+# Background jobs (`manage.py run_jobs`): attempts before a job is marked
+# failed, base delay of the exponential retry backoff, and how long a job
+# may run before another worker assumes its worker died.
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = timedelta(seconds=30)
+JOB_TIMEOUT = timedelta(minutes=15)
+# Finished jobs (and their idempotency keys) are deleted by
+# `manage.py prune_jobs` and on `run_jobs` startup once this old.
+JOB_RETENTION = timedelta(days=7)
+
+# Deleted folders and documents stay in the trash (restorable) this long
+# before `manage.py purge_trash` removes them for good.
+TRASH_RETENTION = timedelta(days=30)
+
+# Store older document versions as binary deltas against the version after
+# them (see core.delta). Every BLOB_DELTA_KEYFRAME_INTERVAL-th minor version
+# stays whole to bound the chain a download follows, and files under
+# BLOB_DELTA_MIN_SIZE bytes are not worth it.
+BLOB_DELTA_STORAGE = False
+BLOB_DELTA_KEYFRAME_INTERVAL = 10
+BLOB_DELTA_MIN_SIZE = 64 * 1024
+
+# Gzip stored files that sample as compressible (see BlobManager.compress).
+# Downloads decompress on the fly, or send the gzipped bytes as they are to
+# clients that accept them.
+BLOB_COMPRESSION = True
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),